@@ -0,0 +1,180 @@
+"""
+Performance benchmark of processing stages over synthetic source files
+
+Every stage is timed (best of repeats) and its peak memory is measured by tracemalloc. Results can be stored as a
+baseline and later runs fail (exit code 1) when a stage is slower or uses more memory than baseline * threshold,
+exit code 2 means there is no baseline to compare with. benchmarks/baseline.json is committed - refresh it with
+--save-baseline on the machine which runs the comparison whenever a stage is added or intentionally changed
+
+    python -m benchmarks.bench --save-baseline
+    python -m benchmarks.bench --threshold 1.5
+"""
+import argparse
+import gc
+import io
+import json
+import logging
+import os
+import sys
+import time
+import tracemalloc
+from functools import cached_property
+
+import pandas as pd
+
+from benchmarks.synthetic import huawei_accumulated_csv, hub_minute_files
+from lib import TIMEZONE, slot_reducer
+from lib.csv_reader import (huawei_datalogger_csv_parser, huawei_datalogger_csv_parser_vectorized,
+                            handle_missing_intervals, pecom_hub_csv_parser, pecom_hub_csv_batch_parser,
+                            aggregate_hub_csvs)
+from lib.json_writer import production_to_json_bytes, production_to_json_bytes_fast
+from lib.np_engine import datalogger_production
+
+log = logging.getLogger(__name__)
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), "baseline.json")
+DAY = "2024-06-01"
+
+
+class StageInputs:
+    """
+    Synthetic inputs of stages - generated lazily, only for selected stages
+    """
+    def __init__(self, inverters: int):
+        self.inverters = inverters
+        self.date = pd.Timestamp(f"{DAY} 23:55", tz=TIMEZONE)
+
+    @cached_property
+    def huawei_text(self) -> str:
+        return huawei_accumulated_csv(DAY, inverters=self.inverters)
+
+    @cached_property
+    def huawei_bytes(self) -> bytes:
+        return self.huawei_text.encode("utf-8")
+
+    @cached_property
+    def hub_files(self) -> dict:
+        return hub_minute_files(DAY)
+
+    @cached_property
+    def hub_dfs(self) -> list:
+        return [pecom_hub_csv_parser(io.StringIO(s)) for s in self.hub_files.values()]
+
+    @cached_property
+    def production(self) -> pd.DataFrame:
+        return huawei_datalogger_csv_parser(io.StringIO(self.huawei_text), self.date)
+
+    @cached_property
+    def result(self) -> pd.DataFrame:
+        return handle_missing_intervals(self.production, self.date)
+
+
+def build_stages(inverters: int) -> dict:
+    """
+    Return dictionary with stage name as key and callable running the stage as value
+    """
+    inputs = StageInputs(inverters)
+    return {
+        "huawei_datalogger_csv_parser":
+            lambda: huawei_datalogger_csv_parser(io.StringIO(inputs.huawei_text), inputs.date),
+        "huawei_datalogger_csv_parser_vectorized":
+            lambda: huawei_datalogger_csv_parser_vectorized(io.StringIO(inputs.huawei_text), inputs.date),
+        "pecom_hub_csv_parser": lambda: [pecom_hub_csv_parser(io.StringIO(s)) for s in inputs.hub_files.values()],
+        "pecom_hub_csv_batch_parser": lambda: pecom_hub_csv_batch_parser(inputs.hub_files),
+        "aggregate_hub_csvs": lambda: aggregate_hub_csvs(inputs.hub_dfs, inputs.date),
+        "handle_missing_intervals": lambda: handle_missing_intervals(inputs.production, inputs.date),
+        "production_to_json_bytes": lambda: production_to_json_bytes(inputs.result),
+        "production_to_json_bytes_fast": lambda: production_to_json_bytes_fast(inputs.result),
+        # whole datalogger-to-json path - pandas engine vs numpy engine
+        "datalogger_to_json_pandas": lambda: production_to_json_bytes_fast(handle_missing_intervals(
+            huawei_datalogger_csv_parser(io.StringIO(inputs.huawei_text), inputs.date), inputs.date)),
+        "datalogger_to_json_numpy": lambda: datalogger_production(inputs.huawei_text, inputs.date).to_json_bytes(),
+        "datalogger_to_json_streaming":
+            lambda: slot_reducer.datalogger_production(inputs.huawei_bytes, inputs.date).to_json_bytes(),
+    }
+
+
+def measure(func, repeat: int) -> dict:
+    """
+    Best wall time of repeated runs and peak traced memory of one run
+    """
+    func()  # warm up caches
+    times = []
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    gc.collect()
+    tracemalloc.start()
+    try:
+        func()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return {"seconds": min(times), "peak_bytes": peak}
+
+
+def run_benchmarks(inverters: int = 50, repeat: int = 5, stages: list | None = None) -> dict:
+    """
+    Measure all (or selected) stages
+
+    :return: dictionary with stage name as key and dict with seconds and peak_bytes as value
+    """
+    all_stages = build_stages(inverters)
+    selected = stages or list(all_stages)
+    return {name: measure(all_stages[name], repeat) for name in selected}
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list:
+    """
+    Compare results with baseline
+
+    :return: list of regression messages, empty if no stage regressed
+    """
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        for metric in ("seconds", "peak_bytes"):
+            limit = baseline[name][metric] * threshold
+            if result[metric] > limit:
+                regressions.append(f"{name} {metric} {result[metric]:.6g} > {limit:.6g} "
+                                   f"(baseline {baseline[name][metric]:.6g} * {threshold})")
+    return regressions
+
+
+def main(argv: list | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark processing stages over synthetic data")
+    parser.add_argument("--inverters", type=int, default=50, help="inverters in synthetic Huawei file")
+    parser.add_argument("--repeat", type=int, default=5, help="timed runs per stage (best is reported)")
+    parser.add_argument("--stage", action="append", dest="stages", help="run only given stage (repeatable)")
+    parser.add_argument("--baseline", default=BASELINE_PATH, help="baseline json path")
+    parser.add_argument("--save-baseline", action="store_true", help="store results as new baseline")
+    parser.add_argument("--threshold", type=float, default=1.5, help="allowed ratio to baseline")
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(inverters=args.inverters, repeat=args.repeat, stages=args.stages)
+    for name, result in results.items():
+        print(f"{name:45s} {result['seconds'] * 1000:10.2f} ms {result['peak_bytes'] / 1024:12.1f} KiB")
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(results, f, indent=4)
+        print(f"Baseline saved to {args.baseline}")
+        return 0
+    if not os.path.exists(args.baseline):
+        print(f"No baseline at {args.baseline} - run with --save-baseline first")
+        return 2
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    for name in sorted(set(results) - set(baseline)):
+        print(f"Stage {name} is not in baseline - refresh it with --save-baseline")
+    regressions = compare(results, baseline, args.threshold)
+    for message in regressions:
+        print(f"REGRESSION {message}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
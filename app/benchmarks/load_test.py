@@ -0,0 +1,132 @@
+"""
+Whole-cycle load test against local sftp/ftp stand-ins
+
+Creates temporary source tree with many POD directories (synthetic Huawei files for current interval), starts local
+sftp and ftp servers, points the application configuration to them and runs main() (or main_pipeline(), main_deadline()) end
+to end.
+
+    python -m benchmarks.load_test --pods 500 --cycles 2
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from contextlib import ExitStack
+from unittest.mock import patch
+
+import pandas as pd
+
+from benchmarks.servers import LocalSftpServer, LocalFtpServer
+from benchmarks.synthetic import huawei_accumulated_csv
+from lib import LOGGER_DT_FMT
+
+
+def create_source_tree(root: str, pods: int, inverters: int, date: pd.Timestamp) -> list:
+    """
+    Create POD directories with accumulated datalogger file of given date
+
+    :return: list of POD ids
+    """
+    text = huawei_accumulated_csv(date.strftime("%Y-%m-%d"), inverters=inverters, until=date)
+    pod_ids = [f"HU000000000-LOADTEST-{i:05d}" for i in range(pods)]
+    for pod_id in pod_ids:
+        os.makedirs(os.path.join(root, pod_id))
+        with open(os.path.join(root, pod_id, f"min{date.strftime(LOGGER_DT_FMT)}.csv"), "w") as f:
+            f.write(text)
+    return pod_ids
+
+
+def write_configs(config_dir: str, sftp: LocalSftpServer, ftp: LocalFtpServer, pod_ids: list) -> dict:
+    """
+    Write sftp.json, ftp.json and known hosts pointing to local servers
+
+    :return: dictionary with patch targets as key and config paths as value
+    """
+    sftp_config = os.path.join(config_dir, "sftp.json")
+    ftp_config = os.path.join(config_dir, "ftp.json")
+    known_hosts = os.path.join(config_dir, "known_hosts.txt")
+    with open(sftp_config, "w") as f:
+        json.dump({"host": sftp.host, "port": sftp.port, "username": sftp.username, "password": sftp.password}, f)
+    with open(ftp_config, "w") as f:
+        json.dump({s: {"host": ftp.host, "port": ftp.port, "username": ftp.username, "password": ftp.password}
+                   for s in pod_ids}, f)
+    with open(known_hosts, "w") as f:
+        f.write(sftp.known_hosts_line())
+    return {"lib.sftp_conn.SFTP_CONFIG": sftp_config, "lib.sftp_conn.FTP_CONFIG": ftp_config,
+            "lib.sftp_conn.SSH_KEY_PATH": known_hosts}
+
+
+# cycle functions of main.py by mode
+CYCLE_MODES = {"main": "main", "pipeline": "main_pipeline", "deadline": "main_deadline"}
+
+
+def run_load_test(pods: int = 100, inverters: int = 10, cycles: int = 1, mode: str = "main",
+                  date: pd.Timestamp | None = None) -> list:
+    """
+    Run cycles against local servers
+
+    :return: list of per-cycle reports (wall time, sftp/ftp requests, sessions and bytes, uploaded files,
+        stage totals from cycle metrics)
+    """
+    import main as app_main
+    from lib.csv_reader import last_interval_date
+
+    date = date or last_interval_date()
+    reports = []
+    with ExitStack() as stack:
+        tmp = stack.enter_context(tempfile.TemporaryDirectory(prefix="cez_load_test_"))
+        source, target, config_dir = (os.path.join(tmp, s) for s in ("source", "target", "config"))
+        for path in (source, target, config_dir):
+            os.makedirs(path)
+        pod_ids = create_source_tree(source, pods=pods, inverters=inverters, date=date)
+        sftp = stack.enter_context(LocalSftpServer(source))
+        ftp = stack.enter_context(LocalFtpServer(target))
+        for target_name, path in write_configs(config_dir, sftp, ftp, pod_ids).items():
+            stack.enter_context(patch(target_name, path))
+        metrics_jsonl = os.path.join(tmp, "metrics.jsonl")
+        stack.enter_context(patch("lib.metrics.METRICS_JSONL", metrics_jsonl))
+        stack.enter_context(patch("lib.metrics.METRICS_PROM", os.path.join(tmp, "metrics.prom")))
+
+        for cycle in range(cycles):
+            sftp.stats.reset()
+            ftp.stats.reset()
+            start = time.perf_counter()
+            getattr(app_main, CYCLE_MODES[mode])(date)
+            reports.append({
+                "cycle": cycle,
+                "pods": pods,
+                "wall_seconds": round(time.perf_counter() - start, 3),
+                "sftp": sftp.stats.as_dict(),
+                "ftp": ftp.stats.as_dict(),
+                "uploaded_files": len(os.listdir(target)),
+                "stages": last_cycle_stages(metrics_jsonl),
+            })
+    return reports
+
+
+def last_cycle_stages(metrics_jsonl: str) -> dict:
+    """
+    Total seconds and bytes of each stage from the last cycle metrics record
+    """
+    with open(metrics_jsonl) as f:
+        record = json.loads(f.readlines()[-1])
+    return {stage: {"seconds": value["sum"], "bytes": value["bytes"]} for stage, value in record["stages"].items()}
+
+
+def main(argv: list | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Load test whole cycle against local sftp/ftp servers")
+    parser.add_argument("--pods", type=int, default=100, help="number of POD directories")
+    parser.add_argument("--inverters", type=int, default=10, help="inverters per synthetic Huawei file")
+    parser.add_argument("--cycles", type=int, default=1, help="cycles to run (later cycles use warm caches)")
+    parser.add_argument("--mode", choices=list(CYCLE_MODES), default="main", help="cycle function of main.py")
+    args = parser.parse_args(argv)
+
+    for report in run_load_test(pods=args.pods, inverters=args.inverters, cycles=args.cycles, mode=args.mode):
+        print(json.dumps(report))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,417 @@
+"""
+In-process stand-ins of source sftp and target ftp servers over a local directory tree
+
+Both servers count protocol requests (round trips) and payload bytes, so whole cycles can be measured offline.
+"""
+import heapq
+import logging
+import os
+import posixpath
+import socket
+import socketserver
+import threading
+import time
+
+import paramiko
+
+# server side transports log client disconnects as errors - not interesting for load tests
+logging.getLogger(f"{__name__}.transport").setLevel(logging.CRITICAL)
+
+
+class TransferStats:
+    """
+    Thread-safe counters of one server
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.bytes = 0
+        self.sessions = 0
+
+    def add(self, requests: int = 0, nbytes: int = 0, sessions: int = 0):
+        with self._lock:
+            self.requests += requests
+            self.bytes += nbytes
+            self.sessions += sessions
+
+    def reset(self):
+        with self._lock:
+            self.requests = self.bytes = self.sessions = 0
+
+    def as_dict(self) -> dict:
+        with self._lock:
+            return {"requests": self.requests, "bytes": self.bytes, "sessions": self.sessions}
+
+
+class _SshServer(paramiko.ServerInterface):
+    def __init__(self, username: str, password: str):
+        self.username = username
+        self.password = password
+
+    def check_auth_password(self, username, password):
+        if (username, password) == (self.username, self.password):
+            return paramiko.AUTH_SUCCESSFUL
+        return paramiko.AUTH_FAILED
+
+    def get_allowed_auths(self, username):
+        return "password"
+
+    def check_channel_request(self, kind, chanid):
+        if kind == "session":
+            return paramiko.OPEN_SUCCEEDED
+        return paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+
+
+class _SftpHandle(paramiko.SFTPHandle):
+    def __init__(self, stats: TransferStats, flags: int = 0):
+        super().__init__(flags)
+        self.stats = stats
+
+    def read(self, offset, length):
+        data = super().read(offset, length)
+        if isinstance(data, bytes):
+            self.stats.add(nbytes=len(data))
+        return data
+
+    def write(self, offset, data):
+        self.stats.add(nbytes=len(data))
+        return super().write(offset, data)
+
+
+class _SftpInterface(paramiko.SFTPServerInterface):
+    """
+    Filesystem sftp interface rooted in server root directory
+    """
+    def __init__(self, server, *args, root: str, stats: TransferStats, **kwargs):
+        super().__init__(server, *args, **kwargs)
+        self.root = root
+        self.stats = stats
+
+    def _local(self, path: str) -> str:
+        return os.path.join(self.root, self.canonicalize(path).lstrip("/"))
+
+    def canonicalize(self, path):
+        return posixpath.normpath("/" + path.lstrip("/"))
+
+    def list_folder(self, path):
+        local = self._local(path)
+        try:
+            result = []
+            for name in os.listdir(local):
+                attr = paramiko.SFTPAttributes.from_stat(os.stat(os.path.join(local, name)))
+                attr.filename = name
+                result.append(attr)
+            return result
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+
+    def stat(self, path):
+        try:
+            return paramiko.SFTPAttributes.from_stat(os.stat(self._local(path)))
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+
+    lstat = stat
+
+    def open(self, path, flags, attr):
+        local = self._local(path)
+        try:
+            fd = os.open(local, flags | getattr(os, "O_BINARY", 0), 0o644)
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+        mode = "rb" if flags & (os.O_WRONLY | os.O_RDWR) == 0 else ("ab" if flags & os.O_APPEND else "r+b")
+        handle = _SftpHandle(self.stats, flags)
+        handle.filename = local
+        handle.readfile = handle.writefile = os.fdopen(fd, mode)
+        return handle
+
+
+class _CountingSftpServer(paramiko.SFTPServer):
+    stats = None
+
+    def _process(self, t, request_number, msg):
+        self.stats.add(requests=1)
+        return super()._process(t, request_number, msg)
+
+
+class LocalSftpServer:
+    """
+    Password-authenticated sftp server on 127.0.0.1 serving files of root directory
+    """
+    def __init__(self, root: str, username: str = "user", password: str = "password"):
+        self.root = root
+        self.username = username
+        self.password = password
+        self.host_key = paramiko.RSAKey.generate(2048)
+        self.stats = TransferStats()
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._socket.bind(("127.0.0.1", 0))
+        self.host, self.port = self._socket.getsockname()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def known_hosts_line(self) -> str:
+        return f"{self.host} {self.host_key.get_name()} {self.host_key.get_base64()}\n"
+
+    def start(self):
+        self._socket.listen(100)
+        self._socket.settimeout(0.2)
+        self._thread = threading.Thread(target=self._serve, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self._socket.close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def _serve(self):
+        while not self._stop.is_set():
+            try:
+                client, _ = self._socket.accept()
+            except socket.timeout:
+                continue
+            threading.Thread(target=self._handle, args=(client,), daemon=True).start()
+
+    def _handle(self, client: socket.socket):
+        self.stats.add(sessions=1)
+        server_class = type("SftpServer", (_CountingSftpServer,), {"stats": self.stats})
+        transport = paramiko.Transport(client)
+        transport.set_log_channel(f"{__name__}.transport")
+        transport.add_server_key(self.host_key)
+        transport.use_compression(True)  # offered, used only by clients asking for it
+        transport.set_subsystem_handler("sftp", server_class, _SftpInterface, root=self.root, stats=self.stats)
+        try:
+            transport.start_server(server=_SshServer(self.username, self.password))
+            while transport.is_active() and not self._stop.is_set():
+                self._stop.wait(0.2)
+        except Exception:
+            pass
+        finally:
+            transport.close()
+
+
+class _FtpHandler(socketserver.StreamRequestHandler):
+    """
+    Minimal FTP protocol (login, passive mode, STOR) sufficient for ftplib uploads
+    """
+    def setup(self):
+        super().setup()
+        self.logged_in = False
+        self.user = None
+        self.passive = None
+
+    def reply(self, line: str):
+        self.wfile.write(f"{line}\r\n".encode("utf-8"))
+
+    def handle(self):
+        server = self.server
+        server.stats.add(sessions=1)
+        self.reply("220 local ftp ready")
+        for raw in self.rfile:
+            line = raw.decode("utf-8").rstrip("\r\n")
+            command, _, argument = line.partition(" ")
+            command = command.upper()
+            server.stats.add(requests=1)
+            if command == "USER":
+                self.user = argument
+                self.reply("331 password required")
+            elif command == "PASS":
+                self.logged_in = (self.user, argument) == (server.username, server.password)
+                self.reply("230 logged in" if self.logged_in else "530 login incorrect")
+            elif command == "QUIT":
+                self.reply("221 bye")
+                return
+            elif not self.logged_in:
+                self.reply("530 not logged in")
+            elif command in ("NOOP", "TYPE"):
+                self.reply("200 ok")
+            elif command == "PWD":
+                self.reply('257 "/"')
+            elif command == "PASV":
+                self.passive = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+                self.passive.bind(("127.0.0.1", 0))
+                self.passive.listen(1)
+                port = self.passive.getsockname()[1]
+                self.reply(f"227 Entering Passive Mode (127,0,0,1,{port >> 8},{port & 0xFF})")
+            elif command == "STOR" and self.passive is not None:
+                self.reply("150 ok to send data")
+                connection, _ = self.passive.accept()
+                path = os.path.join(server.root, os.path.basename(argument))
+                size = 0
+                with connection, open(path, "wb") as f:
+                    while chunk := connection.recv(65536):
+                        f.write(chunk)
+                        size += len(chunk)
+                self.passive.close()
+                self.passive = None
+                server.stats.add(nbytes=size)
+                self.reply("226 transfer complete")
+            else:
+                self.reply("502 command not implemented")
+
+
+class LocalFtpServer(socketserver.ThreadingTCPServer):
+    """
+    FTP server on 127.0.0.1 storing uploaded files to root directory
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, root: str, username: str = "user", password: str = "password"):
+        super().__init__(("127.0.0.1", 0), _FtpHandler)
+        self.root = root
+        self.username = username
+        self.password = password
+        self.stats = TransferStats()
+        self.host, self.port = self.server_address
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, kwargs={"poll_interval": 0.1}, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+
+class WanLink:
+    """
+    TCP relay on 127.0.0.1 in front of a local server emulating WAN link - every chunk is delivered after one-way
+    latency and both directions are limited to bandwidth, bytes passed in each direction are counted (on the wire,
+    after ssh compression)
+    """
+    def __init__(self, target_host: str, target_port: int, latency: float = 0.02, bandwidth: float | None = None):
+        """
+        :param latency: one-way delay in seconds
+        :param bandwidth: bytes per second of each direction, None = unlimited
+        """
+        self.target = (target_host, target_port)
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.bytes_down = 0  # server -> client
+        self.bytes_up = 0
+        self._lock = threading.Lock()
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._socket.bind(("127.0.0.1", 0))
+        self.host, self.port = self._socket.getsockname()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def reset(self):
+        with self._lock:
+            self.bytes_down = self.bytes_up = 0
+
+    def start(self):
+        self._socket.listen(100)
+        self._socket.settimeout(0.2)
+        self._thread = threading.Thread(target=self._serve, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self._socket.close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def _serve(self):
+        while not self._stop.is_set():
+            try:
+                client, _ = self._socket.accept()
+            except socket.timeout:
+                continue
+            server = socket.create_connection(self.target)
+            for sock in (client, server):
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            pumps = [threading.Thread(target=self._pump, args=(client, server, False), daemon=True),
+                     threading.Thread(target=self._pump, args=(server, client, True), daemon=True)]
+            for pump in pumps:
+                pump.start()
+            threading.Thread(target=self._close_after, args=(pumps, client, server), daemon=True).start()
+
+    @staticmethod
+    def _close_after(pumps: list, *sockets: socket.socket):
+        for pump in pumps:
+            pump.join()
+        for sock in sockets:
+            sock.close()
+
+    def _pump(self, source: socket.socket, destination: socket.socket, down: bool):
+        """
+        Read chunks from source and deliver them to destination when they arrive at the other end of the link - a
+        chunk arrives after latency, once the link finished sending previous chunks at bandwidth
+        """
+        queue = []  # (arrival time, sequence, chunk)
+        condition = threading.Condition()
+        closed = []
+
+        def deliver():
+            while True:
+                with condition:
+                    while not queue and not closed:
+                        condition.wait()
+                    if not queue:
+                        break
+                    arrival, _, chunk = queue[0]
+                    delay = arrival - time.monotonic()
+                    if delay > 0:
+                        condition.wait(delay)
+                        continue
+                    heapq.heappop(queue)
+                try:
+                    destination.sendall(chunk)
+                except OSError:
+                    break
+            try:
+                destination.shutdown(socket.SHUT_WR)
+            except OSError:
+                pass
+
+        deliverer = threading.Thread(target=deliver, daemon=True)
+        deliverer.start()
+        link_free = 0.0  # time when the link finishes sending queued chunks
+        sequence = 0
+        while True:
+            try:
+                chunk = source.recv(65536)
+            except OSError:
+                chunk = b""
+            with condition:
+                if not chunk:
+                    closed.append(True)
+                    condition.notify()
+                    break
+                now = time.monotonic()
+                link_free = max(link_free, now) + (len(chunk) / self.bandwidth if self.bandwidth else 0.0)
+                heapq.heappush(queue, (link_free + self.latency, sequence, chunk))
+                sequence += 1
+                condition.notify()
+            with self._lock:
+                if down:
+                    self.bytes_down += len(chunk)
+                else:
+                    self.bytes_up += len(chunk)
+        deliverer.join()
@@ -0,0 +1,81 @@
+"""
+Startup time of the app measured by -X importtime in a fresh interpreter
+
+Reports cumulative import time of `import main` and of all top level imports of one --once cycle (failing fast on
+missing sftp config) and fails (exit code 1) when any exceeds its budget. Timings depend on the machine, so this is
+a benchmark, not a test - the test suite checks only which modules are imported
+
+    python -m benchmarks.startup
+    python -m benchmarks.startup --import-budget-ms 300 --once-budget-ms 3000
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import textwrap
+
+from lib import APP_PATH
+
+
+def parse_importtime(stderr: str) -> dict:
+    """
+    Parse -X importtime output
+
+    :return: dictionary with top level imported module as key and cumulative us as value
+    """
+    imports = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line.split("|")
+        if not name.startswith("  "):  # nested imports are indented
+            imports[name.strip()] = int(cumulative)
+    return imports
+
+
+def run_importtime(code: str) -> dict:
+    """
+    Run code in fresh interpreter with -X importtime
+
+    :return: dictionary with top level imported module as key and cumulative us as value
+    """
+    process = subprocess.run([sys.executable, "-X", "importtime", "-c", textwrap.dedent(code)], cwd=APP_PATH,
+                             capture_output=True, text=True, timeout=60)
+    return parse_importtime(process.stderr)
+
+
+def measure_startup(tmp_dir: str) -> dict:
+    """
+    :return: dictionary with measurement name as key and cumulative import us as value
+    """
+    once = run_importtime(f"""
+        import main
+        from lib import metrics, sftp_conn
+        sftp_conn.SFTP_CONFIG = {os.path.join(tmp_dir, "missing.json")!r}  # cycle fails without network access
+        metrics.METRICS_JSONL = {os.path.join(tmp_dir, "metrics.jsonl")!r}
+        metrics.METRICS_PROM = {os.path.join(tmp_dir, "metrics.prom")!r}
+        main.run_once(main.main, date="2024-03-04 10:00")
+    """)
+    return {"import_main": run_importtime("import main")["main"], "once_cycle": sum(once.values())}
+
+
+def main(argv: list | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Measure startup import time of the app")
+    parser.add_argument("--import-budget-ms", type=float, default=300, help="budget of import main")
+    parser.add_argument("--once-budget-ms", type=float, default=3000, help="budget of imports of one --once cycle")
+    args = parser.parse_args(argv)
+
+    budgets = {"import_main": args.import_budget_ms, "once_cycle": args.once_budget_ms}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        results = measure_startup(tmp_dir)
+    exceeded = False
+    for name, us in results.items():
+        over = us / 1000 > budgets[name]
+        exceeded |= over
+        print(f"{name:15s} {us / 1000:10.2f} ms (budget {budgets[name]:g} ms){' EXCEEDED' if over else ''}")
+    return 1 if exceeded else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
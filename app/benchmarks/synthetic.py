@@ -0,0 +1,70 @@
+"""
+Generator of realistic source files - Huawei accumulated datalogger csv and HUB minute csv files
+"""
+import numpy as np
+import pandas as pd
+
+from lib import TIMEZONE, INTERVAL, HUB_DT_FMT, HUB_CSV_DT_FMT, LOGGER_CSV_DT_FORMAT
+
+HUAWEI_COLUMNS = (["#Time"] + [f"Upv{i}" for i in range(1, 21)] + [f"Ipv{i}" for i in range(1, 21)]
+                  + ["Uac1", "Uac2", "Uac3", "Iac1", "Iac2", "Iac3", "Status", "Error", "Temp", "cos", "fac", "Pac",
+                     "Qac", "Eac", "E-Day", "E-Total", "Cycle Time"])
+HUB_METERS = 14
+
+
+def local_intervals(day: str, until: pd.Timestamp | None = None) -> pd.DatetimeIndex:
+    """
+    Local interval starts of the day (276 or 300 on DST change days) until given time (inclusive)
+    """
+    start = pd.Timestamp(day).tz_localize(TIMEZONE)
+    end = (pd.Timestamp(day) + pd.Timedelta(days=1)).tz_localize(TIMEZONE)
+    index = pd.date_range(start, end, freq=f"{INTERVAL}min", inclusive="left")
+    if until is not None:
+        index = index[index <= until]
+    return index
+
+
+def huawei_accumulated_csv(day: str, inverters: int = 10, until: pd.Timestamp | None = None,
+                           sunrise: int = 6, sunset: int = 20, seed: int = 0) -> str:
+    """
+    Content of minYYYYMMDD.csv in "Accumulated data" mode - block of rows for every inverter (newest row first),
+    no rows during night, E-Day is cumulative daily energy of the inverter
+    """
+    rng = np.random.default_rng(seed)
+    index = local_intervals(day, until)
+    index = index[(index.hour >= sunrise) & (index.hour < sunset)]
+    times = index.strftime(LOGGER_CSV_DT_FORMAT)
+    lines = ["#SmartLogger ESN:102060012320"]
+    for inverter in range(inverters):
+        e_day = np.round(np.cumsum(rng.random(len(index)) * 8), 2)
+        values = rng.random((len(index), len(HUAWEI_COLUMNS) - 4)) * 700
+        lines.append(f"#INV{inverter + 1} ESN:ES22400{inverter:05d}")
+        lines.append(";".join(HUAWEI_COLUMNS))
+        for i in reversed(range(len(index))):
+            measurements = ";".join(f"{s:.2f}" for s in values[i])
+            lines.append(f"{times[i]};{measurements};{e_day[i]:.2f};{338853.67 + e_day[i]:.2f};5;")
+    return "\n".join(lines)
+
+
+def hub_minute_files(day: str, until: pd.Timestamp | None = None, seed: int = 0) -> dict:
+    """
+    HUB files for the day - one file per minute with last 5 minute values of cumulative meters
+
+    :return: dictionary with filename as key and csv content as value
+    """
+    rng = np.random.default_rng(seed)
+    start = pd.Timestamp(day).tz_localize(TIMEZONE).tz_convert("UTC")
+    end = (pd.Timestamp(day) + pd.Timedelta(days=1)).tz_localize(TIMEZONE).tz_convert("UTC")
+    if until is not None:
+        end = min(end, until.tz_convert("UTC") + pd.Timedelta(minutes=INTERVAL))
+    minutes = pd.date_range(start - pd.Timedelta(minutes=4), end, freq="1min", inclusive="left")
+    meters = np.round(250000 + np.cumsum(rng.random((len(minutes), HUB_METERS)), axis=0), 2)
+    header = "\ufeffd9ac7687-e992-4b54-a785-5cb3befd479e;" + ";".join(
+        f"000001c8-0268-0000-0000-{i:012x}" for i in range(HUB_METERS))
+    rows = [f"{t.strftime(HUB_CSV_DT_FMT)};" + ";".join(f"{s:.2f}" for s in values)
+            for t, values in zip(minutes, meters)]
+    files = {}
+    for i in range(4, len(minutes)):
+        filename = f"{minutes[i].strftime(HUB_DT_FMT)}-hub.csv"
+        files[filename] = "\n".join([header] + rows[i - 4:i + 1]) + "\n"
+    return files
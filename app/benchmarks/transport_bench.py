@@ -0,0 +1,122 @@
+"""
+Throughput of source sftp downloads with different SSH transport profiles (sftp.json "transport")
+
+Downloads synthetic datalogger files from local sftp server through emulated WAN link (latency and bandwidth of each
+direction) with every profile and reports wall time, payload throughput and bytes on the wire.
+
+    python -m benchmarks.transport_bench --files 20 --latency-ms 20 --bandwidth-mbit 20
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from contextlib import ExitStack
+from unittest.mock import patch
+
+from benchmarks.servers import LocalSftpServer, WanLink
+from benchmarks.synthetic import huawei_accumulated_csv
+from lib.transport import TransportProfile
+
+DAY = "2024-06-01"
+
+PROFILES = {
+    "default": TransportProfile(),
+    "compression": TransportProfile(compression=True),
+    "window": TransportProfile(window_size=16 * 2 ** 20),
+    "prefetch": TransportProfile(prefetch=True),
+    "wan": TransportProfile(compression=True, window_size=16 * 2 ** 20, prefetch=True),
+}
+
+
+def create_files(root: str, files: int, inverters: int) -> list:
+    """
+    Write synthetic accumulated datalogger files (different seed each)
+
+    :return: list of file names
+    """
+    names = []
+    for i in range(files):
+        name = f"min{i:04d}.csv"
+        with open(os.path.join(root, name), "w") as f:
+            f.write(huawei_accumulated_csv(DAY, inverters=inverters, seed=i))
+        names.append(name)
+    return names
+
+
+def download_all(config_dir: str, names: list) -> int:
+    """
+    Open SftpConn with sftp.json of config_dir and read all files as a cycle does
+
+    :return: payload bytes read
+    """
+    from lib.sftp_conn import SftpConn, sftp_read_bytes
+
+    with patch("lib.sftp_conn.SFTP_CONFIG", os.path.join(config_dir, "sftp.json")), \
+            patch("lib.sftp_conn.SSH_KEY_PATH", os.path.join(config_dir, "known_hosts.txt")):
+        with SftpConn() as sftp:
+            sizes = {s.filename: s.st_size for s in sftp.listdir_attr()}
+            return sum(len(sftp_read_bytes(sftp, name, size=sizes[name])) for name in names)
+
+
+def run_transport_bench(files: int = 20, inverters: int = 50, latency: float = 0.02,
+                        bandwidth: float | None = 20e6 / 8, profiles: list | None = None, repeat: int = 1) -> dict:
+    """
+    Measure all (or selected) profiles
+
+    :param latency: one-way latency of emulated link in seconds
+    :param bandwidth: bytes per second of each direction, None = unlimited
+    :return: dictionary with profile name as key and dict with seconds (best of repeats), payload bytes, MiB/s and
+        bytes on the wire as value
+    """
+    results = {}
+    with ExitStack() as stack:
+        tmp = stack.enter_context(tempfile.TemporaryDirectory(prefix="cez_transport_bench_"))
+        source, config_dir = os.path.join(tmp, "source"), os.path.join(tmp, "config")
+        os.makedirs(source)
+        os.makedirs(config_dir)
+        names = create_files(source, files=files, inverters=inverters)
+        server = stack.enter_context(LocalSftpServer(source))
+        link = stack.enter_context(WanLink(server.host, server.port, latency=latency, bandwidth=bandwidth))
+        with open(os.path.join(config_dir, "known_hosts.txt"), "w") as f:
+            f.write(server.known_hosts_line())
+
+        for name in profiles or list(PROFILES):
+            with open(os.path.join(config_dir, "sftp.json"), "w") as f:
+                json.dump({"host": link.host, "port": link.port, "username": server.username,
+                           "password": server.password, "transport": PROFILES[name].model_dump()}, f)
+            times = []
+            for _ in range(repeat):
+                link.reset()
+                start = time.perf_counter()
+                payload = download_all(config_dir, names)
+                times.append(time.perf_counter() - start)
+            seconds = min(times)
+            results[name] = {"seconds": round(seconds, 3), "payload_bytes": payload,
+                             "mib_per_s": round(payload / seconds / 2 ** 20, 2), "wire_bytes_down": link.bytes_down}
+    return results
+
+
+def main(argv: list | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Compare sftp transport profiles against local sftp server")
+    parser.add_argument("--files", type=int, default=20, help="files downloaded per profile")
+    parser.add_argument("--inverters", type=int, default=50, help="inverters per synthetic Huawei file")
+    parser.add_argument("--latency-ms", type=float, default=20, help="one-way latency of emulated link")
+    parser.add_argument("--bandwidth-mbit", type=float, default=20, help="bandwidth of emulated link, 0 = unlimited")
+    parser.add_argument("--profile", action="append", dest="profiles", choices=list(PROFILES),
+                        help="run only given profile (repeatable)")
+    parser.add_argument("--repeat", type=int, default=1, help="runs per profile (best is reported)")
+    args = parser.parse_args(argv)
+
+    results = run_transport_bench(files=args.files, inverters=args.inverters, latency=args.latency_ms / 1000,
+                                  bandwidth=args.bandwidth_mbit * 1e6 / 8 or None, profiles=args.profiles,
+                                  repeat=args.repeat)
+    for name, result in results.items():
+        print(f"{name:12s} {result['seconds']:8.3f} s {result['mib_per_s']:8.2f} MiB/s "
+              f"{result['wire_bytes_down'] / 2 ** 20:8.2f} MiB on wire")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
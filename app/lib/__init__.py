@@ -16,3 +16,13 @@ HUB_DT_FMT = "%Y%m%d %H%M%S"
 HUB_CSV_DT_FMT = "%Y-%m-%dT%H:%M:%S"
 LOGGER_CSV_DT_FORMAT = "%Y-%m-%d %H:%M:%S"
 LOGGER_CSV_DT_FORMAT_2 = "%y-%m-%d %H:%M:%S"
+APP_CONFIG = os.path.join(CONFIG_PATH, "app.json")
+METRICS_JSONL = os.path.join(LOGS_DIR, "metrics.jsonl")
+METRICS_PROM = os.path.join(LOGS_DIR, "metrics.prom")
+PROFILES_DIR = os.path.join(LOGS_DIR, "profiles")
+PROFILE_TRIGGER = os.path.join(LOGS_DIR, "profile.trigger")
+BACKFILL_DIR = os.path.join(DATA_PATH, "backfill")
+MIRROR_DIR = os.path.join(DATA_PATH, "mirror")
+OUTBOX_DIR = os.path.join(DATA_PATH, "outbox")
+LEASES_DIR = os.path.join(DATA_PATH, "leases")
+ARCHIVE_DIR = os.path.join(DATA_PATH, "archive")
@@ -0,0 +1,242 @@
+"""
+Columnar archive of delivered timeseries - interval data of every POD sent by a cycle are appended as Parquet file
+under ARCHIVE_DIR, partitioned by local day and POD (hive layout readable also by pyarrow.dataset, DuckDB or Spark)
+
+    archive/date=2024-06-01/pod=<POD>/part-<HHMMSS>-<id>.parquet  appended by cycles of the day
+    archive/date=2024-06-01/pod=<POD>/data.parquet                compacted day
+
+Every cycle sends the whole day until the interval, so parts repeat most rows. Compaction at day end merges parts of
+the day into one file and keeps a row only when quantity, status or source of the interval changed since the
+previous delivery - later corrections stay in the archive with the time they were sent. query loads a date range of
+many PODs without reading source csvs or jsons
+
+pyarrow is needed only when the archive is enabled
+"""
+import datetime
+import logging
+import os
+import threading
+import time
+import uuid
+
+import numpy as np
+import pandas as pd
+
+from lib import ARCHIVE_DIR, sharding
+from lib.json_writer import DataValidity, startDate, quantity, status
+
+log = logging.getLogger(__name__)
+
+SOURCE = "source"
+SENT_AT = "sentAt"
+POD = "pod"
+DATA_FILE = "data.parquet"
+PART_PREFIX = "part-"
+LOCK_FILE = ".compacting"
+LOCK_TTL = 3600  # seconds after which lock of interrupted compaction is removed
+
+_compaction_lock = threading.Lock()
+_compacted_before = None  # local day of last compaction run of this process
+
+
+def schema():
+    import pyarrow as pa
+
+    return pa.schema([(startDate, pa.timestamp("s", tz="UTC")), (quantity, pa.float64()), (status, pa.string()),
+                      (SOURCE, pa.string()), (SENT_AT, pa.timestamp("ms", tz="UTC"))])
+
+
+def partition_dir(day: str, pod_id: str, root: str | None = None) -> str:
+    return os.path.join(root or ARCHIVE_DIR, f"date={day}", f"pod={pod_id}")
+
+
+def production_table(production_data, source: str | None, sent_at: pd.Timestamp):
+    """
+    Arrow table of interval data (DataFrame with UTC startDate index or np_engine.Production)
+    """
+    import pyarrow as pa
+
+    if isinstance(production_data, pd.DataFrame):
+        starts = production_data.index.tz_convert(None).to_numpy().astype("datetime64[s]")
+        quantities = np.asarray(production_data[quantity], dtype=float)
+        statuses = [s.value if isinstance(s, DataValidity) else s for s in production_data[status]]
+    else:
+        starts = production_data.start.astype("datetime64[s]")
+        quantities = np.asarray(production_data.quantity, dtype=float)
+        statuses = np.where(production_data.valid, DataValidity.w.value, DataValidity.f.value).tolist()
+    sent = pa.scalar(sent_at.tz_convert("UTC").to_pydatetime(), type=pa.timestamp("ms", tz="UTC"))
+    return pa.table({
+        startDate: pa.array(starts, type=pa.timestamp("s")).cast(pa.timestamp("s", tz="UTC")),
+        quantity: pa.array(quantities, type=pa.float64()),
+        status: pa.array(statuses, type=pa.string()),
+        SOURCE: pa.array([source] * len(quantities), type=pa.string()),
+        SENT_AT: pa.array([sent] * len(quantities), type=pa.timestamp("ms", tz="UTC")),
+    }, schema=schema())
+
+
+def append(pod_id: str, date: pd.Timestamp, production_data, source: str | None = None,
+           sent_at: pd.Timestamp | None = None, root: str | None = None) -> str:
+    """
+    Store interval data of POD sent for date (local day of the interval) as new part of its day partition - written
+    to temporary file renamed at the end, so readers never see a partial part
+
+    :return: path of the part
+    """
+    import pyarrow.parquet as pq
+
+    sent_at = sent_at if sent_at is not None else pd.Timestamp.now(tz="UTC")
+    directory = partition_dir(str(date.date()), pod_id, root=root)
+    os.makedirs(directory, exist_ok=True)
+    writer = sharding.worker_id() or os.getpid()
+    name = f"{PART_PREFIX}{sent_at.tz_convert('UTC'):%H%M%S}-{writer}-{uuid.uuid4().hex[:8]}.parquet"
+    path = os.path.join(directory, name)
+    tmp = os.path.join(directory, f".{name}.tmp")
+    pq.write_table(production_table(production_data, source=source, sent_at=sent_at), tmp)
+    os.replace(tmp, path)
+    return path
+
+
+def changes(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Rows of one partition in order of startDate and sentAt, each interval only at its first delivery and whenever
+    quantity, status or source changed
+    """
+    df = df.sort_values([startDate, SENT_AT], kind="stable").drop_duplicates()
+    same_interval = df[startDate].eq(df[startDate].shift())
+    same_values = (df[quantity].eq(df[quantity].shift()) & df[status].eq(df[status].shift())
+                   & (df[SOURCE].eq(df[SOURCE].shift()) | (df[SOURCE].isna() & df[SOURCE].shift().isna())))
+    return df[~(same_interval & same_values)].reset_index(drop=True)
+
+
+def read_partition(directory: str) -> tuple:
+    """
+    :return: (DataFrame of compacted file and all parts, list of part paths)
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    parts = sorted(os.path.join(directory, s) for s in os.listdir(directory) if s.startswith(PART_PREFIX))
+    files = parts + ([os.path.join(directory, DATA_FILE)] if os.path.exists(os.path.join(directory, DATA_FILE)) else [])
+    tables = [pq.read_table(path, schema=schema()) for path in files]
+    table = pa.concat_tables(tables) if tables else schema().empty_table()
+    return table.to_pandas(), parts
+
+
+def compact(day: str, pod_id: str, root: str | None = None) -> bool:
+    """
+    Merge parts of one day partition into its data file (see changes) - parts are deleted after the new data file
+    replaced the old one, so interrupted compaction only repeats. Partition locked by another process is skipped
+
+    :return: True if the partition was compacted
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    directory = partition_dir(day, pod_id, root=root)
+    lock = os.path.join(directory, LOCK_FILE)
+    try:
+        if time.time() - os.stat(lock).st_mtime > LOCK_TTL:
+            log.warning(f"Removing stale archive compaction lock {lock}")
+            os.remove(lock)
+    except FileNotFoundError:
+        pass
+    try:
+        os.close(os.open(lock, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+    except FileExistsError:
+        return False
+    try:
+        df, parts = read_partition(directory)
+        if not parts:
+            return False
+        tmp = os.path.join(directory, f".{DATA_FILE}.tmp")
+        pq.write_table(pa.Table.from_pandas(changes(df), schema=schema(), preserve_index=False), tmp)
+        os.replace(tmp, os.path.join(directory, DATA_FILE))
+        for path in parts:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        return True
+    finally:
+        os.remove(lock)
+
+
+def partition_days(root: str | None = None) -> list:
+    root = root or ARCHIVE_DIR
+    if not os.path.isdir(root):
+        return []
+    return sorted(s.removeprefix("date=") for s in os.listdir(root) if s.startswith("date="))
+
+
+def partition_pods(day: str, root: str | None = None) -> list:
+    directory = os.path.join(root or ARCHIVE_DIR, f"date={day}")
+    return sorted(s.removeprefix("pod=") for s in os.listdir(directory) if s.startswith("pod="))
+
+
+def compact_before(day: datetime.date, root: str | None = None) -> list:
+    """
+    Compact every partition with parts of days before day
+
+    :return: list of compacted (day, pod_id)
+    """
+    compacted = []
+    for partition_day in partition_days(root):
+        if partition_day >= day.isoformat():
+            break
+        for pod_id in partition_pods(partition_day, root=root):
+            directory = partition_dir(partition_day, pod_id, root=root)
+            if not any(s.startswith(PART_PREFIX) for s in os.listdir(directory)):
+                continue
+            try:
+                if compact(partition_day, pod_id, root=root):
+                    compacted.append((partition_day, pod_id))
+            except Exception as e:
+                log.warning(f"Cannot compact archive of pod_id {pod_id} for {partition_day} - {e}")
+    if compacted:
+        log.info(f"Compacted {len(compacted)} archive partitions before {day}")
+    return compacted
+
+
+def compact_periodically(day: datetime.date, root: str | None = None) -> threading.Thread | None:
+    """
+    Start compaction of earlier days in background thread once per local day (first archived POD of the day, also
+    after restart) - called on every append
+
+    :return: started thread or None
+    """
+    global _compacted_before
+    with _compaction_lock:
+        if _compacted_before is not None and _compacted_before >= day:
+            return None
+        _compacted_before = day
+    thread = threading.Thread(target=compact_before, args=(day, root), name="archive-compaction", daemon=True)
+    thread.start()
+    return thread
+
+
+def query(start, end, pod_ids: list | None = None, history: bool = False, root: str | None = None) -> pd.DataFrame:
+    """
+    Load archived interval data of local days start..end (inclusive) - only partitions of the range and PODs are read
+
+    :param pod_ids: PODs to load, all archived PODs if None
+    :param history: return every delivered change of an interval, only its latest values otherwise
+    :return: DataFrame with columns pod, startDate, quantity, status, source and sentAt sorted by pod and startDate
+    """
+    first, last = pd.Timestamp(start).date().isoformat(), pd.Timestamp(end).date().isoformat()
+    wanted = set(pod_ids) if pod_ids is not None else None
+    frames = []
+    for day in partition_days(root):
+        if not first <= day <= last:
+            continue
+        for pod_id in partition_pods(day, root=root):
+            if wanted is not None and pod_id not in wanted:
+                continue
+            df, _ = read_partition(partition_dir(day, pod_id, root=root))
+            df = changes(df)
+            if not history:
+                df = df.drop_duplicates(startDate, keep="last")
+            frames.append(df.assign(**{POD: pod_id}))
+    columns = [POD, startDate, quantity, status, SOURCE, SENT_AT]
+    if not frames:
+        return schema().empty_table().to_pandas().assign(**{POD: pd.Series(dtype=object)})[columns]
+    return pd.concat(frames, ignore_index=True)[columns].sort_values([POD, startDate], kind="stable", ignore_index=True)
@@ -0,0 +1,192 @@
+import datetime
+import json
+import logging
+import multiprocessing.util
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import NamedTuple
+
+import pandas as pd
+
+from lib import BACKFILL_DIR, INTERVAL, TIMEZONE, archive
+from lib.config import load_app_config
+from lib.sftp_conn import SftpConn, FtpPool, SourceType, list_pod_ids, fetch_pod, parse_pod, serialize_pod, \
+    write_json, archive_pod
+
+log = logging.getLogger(__name__)
+
+# sftp session and ftp pool of backfill worker process - opened by first task, reopened after failure
+_worker_sftp = None
+_worker_pool = None
+
+
+class BackfillTask(NamedTuple):
+    pod_id: str
+    day: str  # ISO date
+
+
+class BackfillResult(NamedTuple):
+    pod_id: str
+    day: str
+    status: str  # done, missing (no source files for the day) or failed
+    bytes: int = 0  # size of written json
+    error: str | None = None
+
+
+def day_end(day: datetime.date) -> pd.Timestamp:
+    """
+    Start of the last interval of local day - the date live cycle would use when processing the day for the last time
+    """
+    next_midnight = pd.Timestamp(day + datetime.timedelta(days=1)).tz_localize(TIMEZONE)
+    return next_midnight - pd.Timedelta(minutes=INTERVAL)
+
+
+def backfill_tasks(pod_ids: list, start: datetime.date, end: datetime.date) -> list:
+    """
+    (POD, day) pairs of date range including both ends, ordered by day
+    """
+    days = pd.date_range(start, end, freq="1D")
+    return [BackfillTask(pod_id=pod_id, day=day.date().isoformat()) for day in days for pod_id in pod_ids]
+
+
+def progress_key(pod_id: str, day: str, target: str) -> str:
+    return f"{pod_id}|{day}|{target}"
+
+
+def load_progress(path: str) -> set:
+    """
+    Keys of (POD, day, target) finished by previous runs - failed or missing tasks are tried again
+    """
+    if not os.path.exists(path):
+        return set()
+    done = set()
+    with open(path) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:  # last line of interrupted run
+                continue
+            if record.get("status") == "done":
+                done.add(progress_key(record["pod_id"], record["day"], record["target"]))
+    return done
+
+
+def append_progress(path: str, result: BackfillResult, target: str):
+    record = result._asdict() | {"target": target, "finished": pd.Timestamp.now(tz="UTC").isoformat()}
+    with open(path, "a") as f:
+        f.write(json.dumps(record) + "\n")
+
+
+def backfill_pod_day(task: BackfillTask, output_dir: str | None = None) -> BackfillResult:
+    """
+    Fetch files of one POD for one day, parse them as at the end of the day and upload json or write it to output_dir
+
+    Days without source files are reported as missing - replacement data is never sent by backfill
+    """
+    global _worker_sftp, _worker_pool
+    date = day_end(datetime.date.fromisoformat(task.day))
+    try:
+        if _worker_sftp is None:
+            _worker_sftp = SftpConn()
+        pod_files = fetch_pod(sftp=_worker_sftp, pod_id=task.pod_id, date=date)
+    except Exception as e:
+        if _worker_sftp is not None:
+            _worker_sftp.close()
+            _worker_sftp = None
+        return BackfillResult(pod_id=task.pod_id, day=task.day, status="failed", error=f"fetch: {e}")
+    if pod_files.source == SourceType.replacement:
+        return BackfillResult(pod_id=task.pod_id, day=task.day, status="missing")
+
+    try:
+        production_data = parse_pod(pod_files, date)
+        json_io = serialize_pod(pod_id=task.pod_id, production_data=production_data)
+    except Exception as e:
+        return BackfillResult(pod_id=task.pod_id, day=task.day, status="failed", error=f"parse: {e}")
+    size = json_io.getbuffer().nbytes
+
+    if output_dir is not None:
+        with open(os.path.join(output_dir, f"{task.pod_id}-{date.date()}.json"), "wb") as f:
+            f.write(json_io.getvalue())
+        return BackfillResult(pod_id=task.pod_id, day=task.day, status="done", bytes=size)
+
+    if _worker_pool is None:
+        _worker_pool = FtpPool(sessions_per_host=load_app_config().ftp_sessions_per_host)
+    if write_json(pod_id=task.pod_id, date=date, json_io=json_io, pool=_worker_pool):
+        archive_pod(pod_id=task.pod_id, date=date, production_data=production_data, source=pod_files.source,
+                    compact=False)
+        return BackfillResult(pod_id=task.pod_id, day=task.day, status="done", bytes=size)
+    return BackfillResult(pod_id=task.pod_id, day=task.day, status="failed", error="upload failed")
+
+
+def close_worker():
+    """
+    Close sftp session and ftp pool of current process
+    """
+    global _worker_sftp, _worker_pool
+    if _worker_sftp is not None:
+        _worker_sftp.close()
+        _worker_sftp = None
+    if _worker_pool is not None:
+        _worker_pool.close()
+        _worker_pool = None
+
+
+def init_worker():
+    """
+    Initializer of backfill worker processes - close_worker runs when the process exits (worker processes end by
+    os._exit, so atexit handlers are not called there)
+    """
+    multiprocessing.util.Finalize(None, close_worker, exitpriority=10)
+
+
+def run_backfill(start: datetime.date, end: datetime.date, pod_ids: list | None = None, output_dir: str | None = None,
+                 workers: int = 4, progress_path: str | None = None, resume: bool = True) -> list:
+    """
+    Resend data of PODs for every day of date range - (POD, day) tasks are spread across a process pool, each worker
+    keeps its own sftp session and ftp pool
+
+    Every finished task is appended to progress file, so an interrupted backfill continues where it stopped
+
+    :param pod_ids: PODs to process, all configured PODs found on sftp if None
+    :param output_dir: write jsons to this directory instead of uploading them to ftp
+    :param workers: number of processes, 0 runs tasks in the current process
+    :return: list of BackfillResult of tasks run now (tasks finished by previous runs are not included)
+    """
+    if pod_ids is None:
+        with SftpConn() as sftp:
+            pod_ids = list_pod_ids(sftp, sharded=False)  # backfill is not a worker of sharded deployment
+    if output_dir is not None:
+        os.makedirs(output_dir, exist_ok=True)
+    target = "ftp" if output_dir is None else os.path.abspath(output_dir)
+    progress_path = progress_path or os.path.join(BACKFILL_DIR, "progress.jsonl")
+    os.makedirs(os.path.dirname(progress_path), exist_ok=True)
+
+    done = load_progress(progress_path) if resume else set()
+    tasks = [s for s in backfill_tasks(pod_ids, start, end) if progress_key(s.pod_id, s.day, target) not in done]
+    log.info(f"Backfill of {len(pod_ids)} PODs from {start} to {end} - {len(tasks)} tasks to run")
+
+    results = []
+    if workers == 0:
+        try:
+            for task in tasks:
+                results.append(record_result(progress_path, backfill_pod_day(task, output_dir), target))
+        finally:
+            close_worker()
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_worker) as executor:
+            futures = [executor.submit(backfill_pod_day, task, output_dir) for task in tasks]
+            for future in as_completed(futures):
+                results.append(record_result(progress_path, future.result(), target))
+
+    if output_dir is None and load_app_config().archive.enabled:  # resent days are complete, merge their parts now
+        archive.compact_before(pd.Timestamp.now(tz=TIMEZONE).date())
+    counts = {status: sum(s.status == status for s in results) for status in ("done", "missing", "failed")}
+    log.info(f"Backfill finished - {counts['done']} done, {counts['missing']} missing, {counts['failed']} failed")
+    return results
+
+
+def record_result(progress_path: str, result: BackfillResult, target: str) -> BackfillResult:
+    append_progress(progress_path, result, target)
+    if result.status == "failed":
+        log.warning(f"Backfill of pod_id {result.pod_id} for {result.day} failed - {result.error}")
+    return result
@@ -0,0 +1,54 @@
+"""
+Wall-clock time limit of work done by one thread - deadline mode gives every POD the smaller of its budget and the
+time left to the cycle deadline
+
+The limit is checked at checkpoints between file reads and before uploads (sftp_conn and mirror), a checkpoint past
+the limit raises BudgetExceeded and the POD is given up. Every checkpoint also calls on_check with the remaining
+seconds, which shortens socket timeouts, so one blocked operation cannot overrun the limit either. Threads without a
+limit (other modes) pass all checkpoints
+
+Only stdlib is imported here - the module is used by sftp_conn and mirror
+"""
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable
+
+_local = threading.local()
+
+
+class BudgetExceeded(TimeoutError):
+    pass
+
+
+@contextmanager
+def limit(seconds: float, on_check: Callable[[float], None] | None = None):
+    """
+    Limit work of current thread inside the block to seconds of wall-clock time
+
+    :param on_check: called with remaining seconds at every passed checkpoint
+    """
+    previous = getattr(_local, "limit", None)
+    _local.limit = (time.monotonic() + seconds, on_check)
+    try:
+        yield
+    finally:
+        _local.limit = previous
+
+
+def check(activity: str) -> float | None:
+    """
+    Checkpoint before activity (e.g. "reading <file>")
+
+    :return: seconds remaining to the limit, None if current thread is not limited
+    """
+    current = getattr(_local, "limit", None)
+    if current is None:
+        return None
+    deadline, on_check = current
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        raise BudgetExceeded(f"time limit exceeded before {activity}")
+    if on_check is not None:
+        on_check(remaining)
+    return remaining
@@ -0,0 +1,155 @@
+import json
+import logging
+import os
+from enum import Enum
+from functools import lru_cache
+
+from pydantic import BaseModel, ConfigDict, Field
+
+from lib import APP_CONFIG
+
+log = logging.getLogger(__name__)
+
+
+class ReadMode(Enum):
+    full = 'full'
+    incremental = 'incremental'
+
+
+class ParserEngine(Enum):
+    python = 'python'  # csv module, row by row
+    vectorized = 'vectorized'  # block split by regex, pandas C parser with projected columns
+    numpy = 'numpy'  # csv module to NumPy arrays, no DataFrames on the way to json (lib.np_engine)
+    streaming = 'streaming'  # line by line into running sums of day slots, flat memory (lib.slot_reducer)
+
+
+class JsonSerializer(Enum):
+    pydantic = 'pydantic'  # reference - every row validated by TimeSeries model
+    fast = 'fast'  # column-wise validation, json written directly from arrays
+
+
+class PipelineConfig(BaseModel):
+    """
+    Concurrency of asyncio pipeline stages
+    """
+    model_config = ConfigDict(extra='forbid')
+
+    producers: int = Field(default=4, ge=1)  # parallel sftp sessions fetching POD files
+    workers: int = Field(default=2, ge=1)  # parsing and json serialization
+    uploaders: int = Field(default=4, ge=1)  # parallel ftp uploads
+    queue_size: int = Field(default=8, ge=1)  # max items waiting between stages
+
+
+class SchedulerConfig(BaseModel):
+    """
+    Time limits of cycles in deadline mode
+    """
+    model_config = ConfigDict(extra='forbid')
+
+    cycle_deadline: float = Field(default=270, gt=0)  # seconds from cycle start, PODs not started by then are skipped
+    pod_budget: float = Field(default=60, gt=0)  # seconds of wall-clock time one POD may take
+    misfire_grace_time: int = Field(default=10, ge=1)  # seconds a delayed cycle may still start
+
+
+class WatcherConfig(BaseModel):
+    """
+    Polling of POD directories in watch mode
+    """
+    model_config = ConfigDict(extra='forbid')
+
+    poll_period: float = Field(default=10, gt=0)  # seconds between listings of POD directories
+    debounce: float = Field(default=5, ge=0)  # seconds without further change before changed POD is processed
+    min_upload_interval: float = Field(default=60, ge=0)  # seconds between two uploads of one POD
+    force_spread: float = Field(default=60, ge=0)  # seconds after interval start over which unchanged PODs are sent
+
+
+class MirrorConfig(BaseModel):
+    """
+    Local copy of source sftp files under MIRROR_DIR
+    """
+    model_config = ConfigDict(extra='forbid')
+
+    enabled: bool = False  # download changed files to mirror and parse them from there
+    retention_days: float = Field(default=7, gt=0)  # mirrored files with older mtime are deleted
+
+
+class OutboxConfig(BaseModel):
+    """
+    Durable queue of generated jsons under OUTBOX_DIR drained by background uploader
+    """
+    model_config = ConfigDict(extra='forbid')
+
+    enabled: bool = False  # cycles store jsons to outbox instead of writing them to ftp
+    retry_min: float = Field(default=10, gt=0)  # seconds before first retry of failed upload, doubled every attempt
+    retry_max: float = Field(default=600, gt=0)  # max seconds between retries
+
+
+class ArchiveConfig(BaseModel):
+    """
+    Parquet archive of delivered interval data under ARCHIVE_DIR
+    """
+    model_config = ConfigDict(extra='forbid')
+
+    enabled: bool = False  # append data of every sent json to archive, compacted at day end
+
+
+class ProfilingConfig(BaseModel):
+    """
+    cProfile and tracemalloc of selected cycles written to PROFILES_DIR (see lib.profiling)
+    """
+    model_config = ConfigDict(extra='forbid')
+
+    every: int = Field(default=0, ge=0)  # profile every Nth cycle, 0 = off
+    threshold: float | None = Field(default=None, gt=0)  # seconds, all cycles profiled, kept only if slower
+    stages: list[str] = []  # metrics stages to profile (e.g. parse, upload), empty = whole cycle
+    functions: list[str] = []  # report only these functions and their callees, empty = top functions
+    memory: bool | None = None  # tracemalloc top allocations, None = on except in threshold mode
+    top: int = Field(default=30, ge=1)  # lines of report sections
+    keep: int = Field(default=20, ge=1)  # newest profiles kept
+
+
+class ShardingConfig(BaseModel):
+    """
+    Sharded deployment of several workers (active when WORKER_ID environment variable is set)
+    """
+    model_config = ConfigDict(extra='forbid')
+
+    lease_ttl: float = Field(default=60, gt=0)  # seconds without heartbeat after which worker is considered dead
+    replicas: int = Field(default=64, ge=1)  # points of every worker on consistent hash ring
+
+
+class AppConfig(BaseModel):
+    """
+    Application behaviour switches - every field has a default so app.json may contain only overrides
+    """
+    model_config = ConfigDict(use_enum_values=True, extra='forbid', validate_default=True)
+
+    huawei_read_mode: ReadMode = ReadMode.full
+    huawei_parser_engine: ParserEngine = ParserEngine.python
+    hub_cache: bool = True
+    json_serializer: JsonSerializer = JsonSerializer.fast
+    pipeline: PipelineConfig = Field(default_factory=PipelineConfig)
+    scheduler: SchedulerConfig = Field(default_factory=SchedulerConfig)
+    mirror: MirrorConfig = Field(default_factory=MirrorConfig)
+    watcher: WatcherConfig = Field(default_factory=WatcherConfig)
+    outbox: OutboxConfig = Field(default_factory=OutboxConfig)
+    archive: ArchiveConfig = Field(default_factory=ArchiveConfig)
+    sharding: ShardingConfig = Field(default_factory=ShardingConfig)
+    profiling: ProfilingConfig = Field(default_factory=ProfilingConfig)
+    ftp_sessions_per_host: int = Field(default=2, ge=1)
+    root_listing_ttl: float = Field(default=3600, ge=0)  # seconds, 0 = list sftp root every cycle
+    json_compact: bool = False  # json without indentation
+    json_streaming: bool = False  # json chunks are written to ftp data connection as they are encoded
+
+
+@lru_cache(maxsize=1)
+def load_app_config() -> AppConfig:
+    """
+    Load app.json once per process - missing file means default configuration
+    """
+    if not os.path.exists(APP_CONFIG):
+        log.info(f"No app config found at {APP_CONFIG} - using defaults")
+        return AppConfig()
+    with open(APP_CONFIG) as f:
+        data = json.load(f)
+    return AppConfig(**data)
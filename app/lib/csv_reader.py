@@ -1,7 +1,11 @@
 import csv
+import datetime
 import io
 import logging
+import re
+from functools import lru_cache
 
+import numpy as np
 import pandas as pd
 
 from lib import TIMEZONE, INTERVAL, HUB_CSV_DT_FMT, LOGGER_CSV_DT_FORMAT, LOGGER_CSV_DT_FORMAT_2
@@ -14,6 +18,9 @@ TIMESTAMP_COL = "#Time"
 E_DAY_COL = "E-Day"
 UTC_TIMESTAMP = "timestamp_utc"
 E_INTERVAL = "E-Increment"
+SOURCE_COL = "source"  # file a row of batched HUB read comes from
+HUB_FILE_ROWS = 5  # HUB file is valid only with exactly 5 minute rows
+DAY_GRID_CACHE_SIZE = 8  # local days kept in day_grid cache
 
 
 def last_interval_date() -> pd.Timestamp:
@@ -23,6 +30,13 @@ def last_interval_date() -> pd.Timestamp:
     return (pd.Timestamp.now(tz=TIMEZONE).floor(f"{INTERVAL}min")) - pd.Timedelta(minutes=INTERVAL)
 
 
+def interval_date(value: str) -> pd.Timestamp:
+    """
+    Localize time given in local timezone (e.g. "2024-03-04 10:00") and floor it to start of its interval
+    """
+    return pd.Timestamp(value).tz_localize(TIMEZONE).floor(f"{INTERVAL}min")
+
+
 def huawei_datalogger_csv_parser(data: io.StringIO, date: pd.Timestamp) -> pd.DataFrame:
     """
     Parse csv from huawei datalogger with inverter data
@@ -38,7 +52,13 @@ def huawei_datalogger_csv_parser(data: io.StringIO, date: pd.Timestamp) -> pd.Da
         elif not any(["#" in element for element in row]):
             inverter_data.append(row)
     all_inverters.append(inverter_data)  # append last inv data because there wont be additional header
+    return inverter_blocks_to_df(all_inverters, date=date)
+
 
+def inverter_blocks_to_df(all_inverters: list, date: pd.Timestamp) -> pd.DataFrame:
+    """
+    Convert rows of all inverter blocks (first row of every block is its header) to interval production of the plant
+    """
     dfs = []
     for item in all_inverters:
         if item:
@@ -52,7 +72,13 @@ def huawei_datalogger_csv_parser(data: io.StringIO, date: pd.Timestamp) -> pd.Da
                 log.warning(f"Invalid csv data - missing columns {TIMESTAMP_COL}, {E_DAY_COL} - using replacement data")
                 df = pd.DataFrame(columns=[startDate, quantity])
             dfs.append(df)
+    return inverter_dfs_to_df(dfs, date=date)
 
+
+def inverter_dfs_to_df(dfs: list, date: pd.Timestamp) -> pd.DataFrame:
+    """
+    Sum E-Day of all inverters (DataFrames with startDate and quantity columns) and convert it to interval production
+    """
     if dfs:
         df = pd.concat(dfs, ignore_index=True)
         try:
@@ -72,6 +98,146 @@ def huawei_datalogger_csv_parser(data: io.StringIO, date: pd.Timestamp) -> pd.Da
     return df
 
 
+def huawei_datalogger_csv_parser_vectorized(data: io.StringIO, date: pd.Timestamp) -> pd.DataFrame:
+    """
+    Same output as huawei_datalogger_csv_parser - inverter blocks are found by one regex scan over the whole buffer and
+    each block is read by pandas C parser with only #Time and E-Day columns
+
+    Cells are read as text and converted in inverter_dfs_to_df as by the python engine, so an empty or non-numeric
+    E-Day raises ValueError in both engines
+    """
+    dfs = []
+    for block in split_inverter_blocks(data.read()):
+        header = next(csv.reader(block.splitlines()[:1], delimiter=';'), [])
+        if TIMESTAMP_COL not in header or E_DAY_COL not in header:
+            log.warning(f"Invalid csv data - missing columns {TIMESTAMP_COL}, {E_DAY_COL} - using replacement data")
+            dfs.append(pd.DataFrame(columns=[startDate, quantity]))
+            continue
+        df = pd.read_csv(io.StringIO(block), sep=";", usecols=[TIMESTAMP_COL, E_DAY_COL], index_col=False,
+                         dtype=str, keep_default_na=False)
+        dfs.append(df.rename(columns={TIMESTAMP_COL: startDate, E_DAY_COL: quantity}))
+    return inverter_dfs_to_df(dfs, date=date)
+
+
+# parser engines selectable in app config
+HUAWEI_PARSERS = {
+    "python": huawei_datalogger_csv_parser,
+    "vectorized": huawei_datalogger_csv_parser_vectorized,
+}
+
+# any line containing "#" is either header of inverter block (contains #Time) or a comment
+_HASH_LINE = re.compile(r"^[^\n]*#[^\n]*$", re.MULTILINE)
+
+
+def split_inverter_blocks(text: str) -> list:
+    """
+    Split Huawei csv text to inverter blocks - text of every block starts with its header line, comment lines are
+    dropped, data before first header form a block whose first line is used as header (as in csv parser)
+    """
+    blocks = []
+    pieces = []
+    position = 0
+    for match in _HASH_LINE.finditer(text):
+        pieces.append(text[position:match.start()])
+        position = match.end()
+        if TIMESTAMP_COL in match.group():
+            if "".join(pieces).strip():
+                blocks.append("".join(pieces))
+            pieces = [match.group()]
+    pieces.append(text[position:])
+    if "".join(pieces).strip():
+        blocks.append("".join(pieces))
+    return blocks
+
+
+class HuaweiCsvState:
+    """
+    Parser state of one accumulated Huawei csv file - bytes are fed as they are appended to the file on sftp, only
+    #Time and E-Day values of every inverter block are kept so the file never has to be parsed from the first byte again
+    """
+    TAIL_SIZE = 256  # bytes preceding offset kept to detect that the file was rewritten, not only appended
+
+    def __init__(self, mtime: int | None = None):
+        self.offset = 0  # number of bytes of the file already fed
+        self.mtime = mtime
+        self.tail = b""
+        self.pending = b""  # last line without line ending - may still grow
+        self.blocks = [[]]  # rows of inverter blocks, first row of each block is its header
+        self.projections = [None]  # (#Time, E-Day) column positions of each block, None if block has no such header
+
+    def feed(self, chunk: bytes):
+        """
+        Parse bytes appended to the file since last feed
+        """
+        self.offset += len(chunk)
+        self.tail = (self.tail + chunk)[-self.TAIL_SIZE:]
+        data = self.pending + chunk
+        end = data.rfind(b"\n") + 1
+        self.pending = data[end:]
+        for row in csv.reader(data[:end].decode('utf-8').splitlines(), delimiter=';'):
+            self._add_row(self.blocks, self.projections, row)
+
+    def matches_tail(self, data: bytes) -> bool:
+        """
+        Check that bytes read from (offset - len(tail)) start with the cached tail - file was only appended
+        """
+        return data[:len(self.tail)] == self.tail
+
+    def to_df(self, date: pd.Timestamp) -> pd.DataFrame:
+        """
+        Convert all data fed so far (including incomplete last line) to the same output as huawei_datalogger_csv_parser
+        """
+        blocks, _ = self.projected_blocks()
+        return inverter_blocks_to_df(blocks, date=date)
+
+    def projected_blocks(self) -> tuple:
+        """
+        Blocks and their projections of all data fed so far including incomplete last line
+        """
+        blocks, projections = self.blocks, self.projections
+        if self.pending:
+            blocks = blocks[:-1] + [list(blocks[-1])]
+            projections = list(projections)
+            for row in csv.reader(self.pending.decode('utf-8').splitlines(), delimiter=';'):
+                self._add_row(blocks, projections, row)
+        return blocks, projections
+
+    @staticmethod
+    def _add_row(blocks: list, projections: list, row: list):
+        if any([TIMESTAMP_COL in element for element in row]):
+            if blocks[-1]:
+                blocks.append([])
+                projections.append(None)
+        elif any(["#" in element for element in row]):
+            return
+        block = blocks[-1]
+        if not block:  # first row of block is its header
+            if TIMESTAMP_COL in row and E_DAY_COL in row:
+                projections[-1] = (row.index(TIMESTAMP_COL), row.index(E_DAY_COL))
+            else:
+                projections[-1] = None
+        projection = projections[-1]
+        if projection is not None:
+            row = [row[i] if i < len(row) else None for i in projection]
+        block.append(row)
+
+
+@lru_cache(maxsize=DAY_GRID_CACHE_SIZE)
+def day_grid(day: datetime.date) -> pd.DataFrame:
+    """
+    Replacement data (0 values and F status) for all intervals of local day with UTC index - on DST change days the
+    day has 276 or 300 intervals, result is cached (LRU) and must not be modified
+    """
+    start = pd.Timestamp(day).tz_localize(TIMEZONE)
+    end = (pd.Timestamp(day) + pd.Timedelta(days=1)).tz_localize(TIMEZONE)
+    index = pd.date_range(start, end, freq=f"{INTERVAL}min", inclusive="left", name=startDate).tz_convert("UTC")
+    index.freq = None
+    return pd.DataFrame({
+        status: np.full(len(index), DataValidity.f.value, dtype=object),
+        quantity: np.zeros(len(index), dtype=np.int64)
+    }, index=index)
+
+
 def replacement_data(date: pd.Timestamp) -> pd.DataFrame:
     """
     Generate fake data with 0 values and F status for the whole day until interval date (inclusive) - csv data from
@@ -80,30 +246,25 @@ def replacement_data(date: pd.Timestamp) -> pd.DataFrame:
     """
     if date.tz is None:
         date = date.tz_localize(TIMEZONE, ambiguous=True)
-    start = date.floor('D')
-    end = start + pd.Timedelta(days=1)
-    date_range = pd.date_range(start, end, freq=f"{INTERVAL}min", tz=TIMEZONE, inclusive="left")
-    df = pd.DataFrame({
-        startDate: date_range,
-        quantity: [0] * len(date_range)
-    })
-    df = df.set_index(startDate)
-    df = df[df.index <= date]
-    df.index = df.index.tz_convert("UTC")
-    df[status] = DataValidity.f.value
-    df = df[[status, quantity]]
-    return df
+    grid = day_grid(date.tz_convert(TIMEZONE).date())
+    return grid.iloc[:grid.index.searchsorted(date, side="right")].copy()
 
 
 def handle_missing_intervals(datalogger_df: pd.DataFrame, date: pd.Timestamp) -> pd.DataFrame:
     """
-    Merge df with data from datalogger with replacement df to create continuous timeseries - missing intervals in
+    Align df with data from datalogger to replacement index to create continuous timeseries - missing intervals in
     datalogger data will be replaced by date (value 0 and status 0) from replacement data
     """
-    replacement = replacement_data(date).drop(columns=[quantity])
-    df = pd.merge(replacement, datalogger_df, left_index=True, right_index=True, how="left")
-    df[status] = [DataValidity.f.value if pd.isna(x) else DataValidity.w.value for x in df[quantity]]
-    df[quantity] = df[quantity].fillna(0)
+    index = replacement_data(date).index
+    values = datalogger_df[quantity]
+    if values.index.has_duplicates:
+        values = values[~values.index.duplicated(keep="last")]
+    values = values.reindex(index)
+    missing = values.isna().to_numpy()
+    df = pd.DataFrame({
+        status: np.where(missing, DataValidity.f.value, DataValidity.w.value).astype(object),
+        quantity: values.fillna(0)
+    }, index=index)
     return df
 
 
@@ -118,7 +279,7 @@ def pecom_hub_csv_parser(data: io.StringIO) -> pd.DataFrame:
         return pd.DataFrame(columns=[startDate, quantity])
     else:
         df = df.rename(columns={df.columns[0]: startDate})
-        if len(df.index) != 5:
+        if len(df.index) != HUB_FILE_ROWS:
             return pd.DataFrame(columns=[startDate, quantity])
         else:
             df[startDate] = pd.to_datetime(df[startDate], format=HUB_CSV_DT_FMT).dt.tz_localize("UTC")
@@ -128,20 +289,144 @@ def pecom_hub_csv_parser(data: io.StringIO) -> pd.DataFrame:
             return df
 
 
+def pecom_hub_csv_batch_parser(contents: dict) -> pd.DataFrame:
+    """
+    Parse many HUB csv files with one read_csv call per header width (normally one call) - same rows as
+    pecom_hub_csv_parser of every file, files without exactly HUB_FILE_ROWS rows are dropped
+
+    :param contents: dictionary with filename as key and decoded csv text as value
+    :return: DataFrame with source (filename), startDate and quantity columns
+    """
+    batches = {}  # fields of header -> (sources, data lines prefixed by source index)
+    for name, text in contents.items():
+        lines = [s for s in text.splitlines() if s.strip()]
+        if len(lines) != HUB_FILE_ROWS + 1:  # header and minute rows
+            continue
+        sources, rows = batches.setdefault(lines[0].count(";") + 1, ([], []))
+        rows += [f"{len(sources)};{s}" for s in lines[1:]]
+        sources.append(name)
+
+    dfs = []
+    for fields, (sources, rows) in batches.items():
+        df = pd.read_csv(io.StringIO("\n".join(rows)), sep=";", header=None, names=range(fields + 1))
+        dfs.append(pd.DataFrame({
+            SOURCE_COL: np.asarray(sources, dtype=object)[df[0].to_numpy()],
+            startDate: pd.to_datetime(df[1], format=HUB_CSV_DT_FMT).dt.tz_localize("UTC"),
+            quantity: df.iloc[:, 2:].sum(axis=1),
+        }))
+    if not dfs:
+        return pd.DataFrame({SOURCE_COL: pd.Series(dtype=object), startDate: pd.Series(dtype="datetime64[ns, UTC]"),
+                             quantity: pd.Series(dtype=float)})
+    return pd.concat(dfs, ignore_index=True)
+
+
 def aggregate_hub_csvs(dfs: list, date: pd.Timestamp) -> pd.DataFrame:
     """
     Aggregate all csv files (converted to dataframe) for given date to CEZ formated dataframe
     """
+    aggregator = HubAggregator()
+    dfs = [s for s in dfs if not s.empty]
     if dfs:
-        df = pd.concat(dfs, ignore_index=True)
-        df[startDate] = df[startDate] + pd.Timedelta(minutes=-1)
-        df = df.set_index(startDate).resample("5min").max()
+        aggregator.add(0, pd.concat(dfs, ignore_index=True))
+    return aggregator.to_df(date=date)
+
+
+class HubAggregator:
+    """
+    Running 5min maximum of HUB meter values - csv files are added one by one and every file keeps its own per-slot
+    maxima, so a file which changed on sftp can replace its previous contribution
+    """
+    SLOT_NS = INTERVAL * 60 * 10 ** 9
+    SHIFT_NS = 60 * 10 ** 9  # values are shifted by -1min before slotting (value at 12:05 belongs to 12:00 slot)
+
+    def __init__(self):
+        self.sources = {}  # source key (e.g. filename) -> {slot start in UTC ns: max value} of the file
+        self.slot_max = {}  # slot start in UTC ns -> max value of all sources
+
+    def add(self, source, df: pd.DataFrame):
+        """
+        Add parsed csv (output of pecom_hub_csv_parser) to running maxima
+        """
+        replaced = source in self.sources
+        slots = self._slot_max(df)
+        self.sources[source] = slots
+        if replaced:
+            self._rebuild()
+        else:
+            self._merge(slots)
+
+    def add_batch(self, sources: list, df: pd.DataFrame):
+        """
+        Add output of pecom_hub_csv_batch_parser - sources without valid rows are added as empty files
+        """
+        batch_slots = self._batch_slot_max(df)
+        replaced = False
+        for source in sources:
+            replaced |= source in self.sources
+            self.sources[source] = batch_slots.get(source, {})
+        if replaced:
+            self._rebuild()
+        else:
+            for source in sources:
+                self._merge(self.sources[source])
+
+    def remove(self, source):
+        if self.sources.pop(source, None) is not None:
+            self._rebuild()
+
+    def to_df(self, date: pd.Timestamp) -> pd.DataFrame:
+        """
+        Convert running maxima to interval production in CEZ format
+        """
+        if not self.slot_max:
+            return replacement_data(date=date)
+        slots = sorted(self.slot_max)
+        slot_index = pd.date_range(pd.Timestamp(slots[0], tz="UTC"), pd.Timestamp(slots[-1], tz="UTC"),
+                                   freq=f"{INTERVAL}min", name=startDate)
+        df = pd.Series(self.slot_max, dtype=float).set_axis(pd.DatetimeIndex(list(self.slot_max), tz="UTC")).reindex(
+            slot_index).to_frame(quantity)
         df[quantity] = df[quantity].ffill().bfill()
         df[quantity] = df[quantity].diff().fillna(0)
         df[quantity] = df[quantity].clip(lower=0)
         df[quantity] = df[quantity].round(3)
-        df.columns.name = None
-        df = handle_missing_intervals(df, date=date)
-    else:
-        df = replacement_data(date=date)
-    return df
+        return handle_missing_intervals(df, date=date)
+
+    def _merge(self, slots: dict):
+        for slot, value in slots.items():
+            current = self.slot_max.get(slot)
+            if current is None or value > current:
+                self.slot_max[slot] = value
+
+    def _rebuild(self):
+        self.slot_max = {}
+        for slots in self.sources.values():
+            self._merge(slots)
+
+    @classmethod
+    def _batch_slot_max(cls, df: pd.DataFrame) -> dict:
+        """
+        Per-slot maxima of every source of batched read at once - source -> {slot: max value}
+        """
+        if df.empty:
+            return {}
+        timestamps = pd.DatetimeIndex(df[startDate]).asi8 - cls.SHIFT_NS
+        slots = pd.DataFrame({SOURCE_COL: df[SOURCE_COL].to_numpy(), "slot": timestamps // cls.SLOT_NS * cls.SLOT_NS,
+                              quantity: pd.to_numeric(df[quantity]).to_numpy(dtype=float)}).dropna()
+        result = {}
+        for (source, slot), value in slots.groupby([SOURCE_COL, "slot"], sort=False)[quantity].max().items():
+            result.setdefault(source, {})[slot] = value
+        return result
+
+    @classmethod
+    def _slot_max(cls, df: pd.DataFrame) -> dict:
+        if df.empty:
+            return {}
+        timestamps = pd.DatetimeIndex(df[startDate]).asi8 - cls.SHIFT_NS
+        values = pd.to_numeric(df[quantity]).to_numpy(dtype=float)
+        slots = {}
+        for slot, value in zip((timestamps // cls.SLOT_NS * cls.SLOT_NS).tolist(), values.tolist()):
+            if value != value:  # NaN does not take part in maximum
+                continue
+            if slot not in slots or value > slots[slot]:
+                slots[slot] = value
+        return slots
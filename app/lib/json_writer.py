@@ -1,12 +1,14 @@
 import io
 import logging
+from decimal import Decimal
 from enum import Enum
-from typing import List
+from typing import Iterator, List
 
+import numpy as np
 import pandas as pd
 from pydantic import BaseModel, Field, ConfigDict, field_validator
 
-from lib import INTERVAL
+from lib import INTERVAL, metrics
 
 log = logging.getLogger(__name__)
 
@@ -17,6 +19,9 @@ status = "status"
 
 # requested json model: https://megujulo-cez.hu/files/json-data-structure.json
 
+# production items per chunk of streamed json - about one ftplib block (8 KiB) of indented json
+CHUNK_ROWS = 64
+
 
 class DataValidity(Enum):
     w = 'w'
@@ -67,12 +72,148 @@ def generate_json_data(production_data: List[TimeSeries]) -> JsonDataCEZ:
     return json_data
 
 
-def production_to_json_bytes(production_data: pd.DataFrame) -> io.BytesIO:
+def production_to_json_bytes(production_data: pd.DataFrame, compact: bool = False) -> io.BytesIO:
     """
     Write json to bytes io - prepare for sftp write
+
+    :param compact: json without indentation and whitespace
     """
     data = dump_df(production_data, TimeSeries)
     json_data = generate_json_data(data)
-    json_str = json_data.model_dump_json(indent=4)
+    json_str = json_data.model_dump_json(indent=None if compact else 4)
     json_bytes_io = io.BytesIO(json_str.encode("utf-8"))
     return json_bytes_io
+
+
+def validate_production(production_data: pd.DataFrame):
+    """
+    Column-wise check of the rules of TimeSeries model - raises ValueError (as pydantic ValidationError does)
+    """
+    df = production_data
+    if not isinstance(df.index, pd.DatetimeIndex):
+        raise ValueError(f"Index of production data must be DatetimeIndex ({startDate}), got {type(df.index).__name__}")
+    if df.index.name != startDate:
+        raise ValueError(f"Index of production data must be named {startDate}, got {df.index.name}")
+    if df.index.tz is None or str(df.index.tz) != "UTC":
+        raise ValueError(f"Index of production data must be in UTC, got {df.index.tz}")
+    if df.index.hasnans:
+        raise ValueError(f"Missing {startDate} in production data")
+    if set(df.columns) != {quantity, status}:
+        raise ValueError(f"Production data must have columns {quantity}, {status}, got {list(df.columns)}")
+    validate_quantities(np.asarray(df[quantity], dtype=float))
+    statuses = df[status].map(lambda x: x.value if isinstance(x, DataValidity) else x)
+    if not statuses.isin([e.value for e in DataValidity]).all():
+        raise ValueError(f"Production data contain invalid {status} - allowed {[e.value for e in DataValidity]}")
+
+
+def validate_quantities(values: np.ndarray):
+    """
+    Quantities must be finite and non-negative - raises ValueError
+    """
+    if not np.isfinite(values).all():
+        raise ValueError(f"Production data contain NaN or infinite {quantity}")
+    if (values < 0).any():
+        raise ValueError(f"Production data contain negative {quantity}")
+
+
+def format_float(value: float) -> str:
+    """
+    Format float as pydantic json serializer does (shortest round-trip digits, exponent only outside 1e-5..1e16)
+    """
+    text = repr(value)
+    if "e" not in text:
+        return text
+    sign = "-" if text.startswith("-") else ""
+    digits, exponent = Decimal(text).copy_abs().normalize().as_tuple()[1:]
+    digits = "".join(map(str, digits))
+    point = len(digits) + exponent  # position of decimal point relative to first digit
+    if 0 <= exponent and point <= 16:
+        return f"{sign}{digits}{'0' * exponent}.0"
+    if 0 < point <= 16:
+        return f"{sign}{digits[:point]}.{digits[point:]}"
+    if -5 < point <= 0:
+        return f"{sign}0.{'0' * -point}{digits}"
+    mantissa = digits if len(digits) == 1 else f"{digits[0]}.{digits[1:]}"
+    return f"{sign}{mantissa}e{point - 1}"
+
+
+def production_to_json_str(production_data: pd.DataFrame, compact: bool = False) -> str:
+    """
+    Validate production data column-wise and write CEZ json directly from arrays - same output as
+    JsonDataCEZ.model_dump_json(indent=4) (or model_dump_json() if compact) without creating model instances
+    """
+    return "".join(production_json_chunks(production_data, compact=compact, encode=False))
+
+
+def production_json_chunks(production_data: pd.DataFrame, compact: bool = False, chunk_rows: int = CHUNK_ROWS,
+                           encode: bool = True) -> Iterator:
+    """
+    Validate production data column-wise and return generator of CEZ json chunks - validation is done before the
+    first chunk is requested, so invalid data never starts an upload
+    """
+    with metrics.stage("validate"):
+        validate_production(production_data)
+    statuses = production_data[status].map(lambda x: x.value if isinstance(x, DataValidity) else x)
+    return production_arrays_json_chunks(start_dates=production_data.index.tz_convert(None).to_numpy(),
+                                         quantities=np.asarray(production_data[quantity], dtype=float),
+                                         statuses=statuses, compact=compact, chunk_rows=chunk_rows, encode=encode)
+
+
+def production_arrays_to_json_str(start_dates: np.ndarray, quantities: np.ndarray, statuses,
+                                  compact: bool = False) -> str:
+    """
+    Write CEZ json (same layout as JsonDataCEZ.model_dump_json(indent=4)) from validated arrays
+
+    :param start_dates: datetime64 array of interval starts in UTC
+    :param quantities: float array
+    :param statuses: iterable of status values (w/f)
+    """
+    return "".join(production_arrays_json_chunks(start_dates=start_dates, quantities=quantities, statuses=statuses,
+                                                 compact=compact, encode=False))
+
+
+def production_arrays_json_chunks(start_dates: np.ndarray, quantities: np.ndarray, statuses, compact: bool = False,
+                                  chunk_rows: int = CHUNK_ROWS, encode: bool = True) -> Iterator:
+    """
+    Yield CEZ json from validated arrays in pieces of chunk_rows production items - joined pieces are the same as
+    production_arrays_to_json_str output
+
+    :param encode: yield utf-8 bytes instead of str
+    """
+    start_dates = np.datetime_as_string(start_dates.astype("datetime64[us]"), unit="us")
+    quantities = [format_float(s) for s in quantities.tolist()]
+    statuses = list(statuses)
+    if compact:
+        head = f'{{"unitType":"kWh","intervalInMinutes":{INTERVAL},"production":['
+        item = f'{{{{"{startDate}":"{{}}Z","{quantity}":{{}},"{status}":"{{}}"}}}}'
+        first, separator, tail = "", ",", "]}"
+    else:
+        head = f'{{\n    "unitType": "kWh",\n    "intervalInMinutes": {INTERVAL},\n    "production": ['
+        item = (f'        {{{{\n            "{startDate}": "{{}}Z",\n            "{quantity}": {{}},\n'
+                f'            "{status}": "{{}}"\n        }}}}')
+        first, separator, tail = "\n", ",\n", "\n    ]\n}" if len(start_dates) else "]\n}"
+
+    def pieces():
+        yield head
+        for start in range(0, len(start_dates), chunk_rows):
+            end = start + chunk_rows
+            rows = separator.join(item.format(d, q, v) for d, q, v in
+                                  zip(start_dates[start:end], quantities[start:end], statuses[start:end]))
+            yield (first if start == 0 else separator) + rows
+        yield tail
+
+    return (s.encode("utf-8") for s in pieces()) if encode else pieces()
+
+
+def production_to_json_bytes_fast(production_data: pd.DataFrame, compact: bool = False) -> io.BytesIO:
+    """
+    Write json to bytes io without pydantic round trips - prepare for sftp write
+    """
+    return io.BytesIO(production_to_json_str(production_data, compact=compact).encode("utf-8"))
+
+
+# json serializers selectable in app config
+JSON_SERIALIZERS = {
+    "pydantic": production_to_json_bytes,
+    "fast": production_to_json_bytes_fast,
+}
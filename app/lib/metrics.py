@@ -0,0 +1,337 @@
+import contextvars
+import datetime
+import json
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+from lib import INTERVAL, METRICS_JSONL, METRICS_PROM, profiling
+
+log = logging.getLogger(__name__)
+
+# stages of one cycle - list (sftp directory listings), download (sftp reads), parse (csv parsing, aggregation and
+# missing intervals), validate (column-wise check of production data), serialize (CEZ json, includes validate),
+# upload (ftp writes)
+STAGES = ("list", "download", "parse", "validate", "serialize", "upload")
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+CYCLE_BUDGET = INTERVAL * 60  # seconds - next cycle is started by scheduler after INTERVAL minutes
+PROM_PREFIX = "cez_ftp"
+JSONL_MAX_BYTES = 5 * 2 ** 20  # METRICS_JSONL is rotated like the application log - metrics.jsonl.1 is the newest backup
+JSONL_BACKUPS = 10
+
+
+class Histogram:
+    """
+    Histogram with fixed upper bounds in seconds - bucket counts are kept per bucket and made cumulative on export
+    """
+    def __init__(self, buckets: tuple = BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float):
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+        index = bisect_left(self.buckets, value)
+        if index < len(self.buckets):
+            self.counts[index] += 1
+
+    def merge(self, other: "Histogram"):
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        self.count += other.count
+        self.sum += other.sum
+        self.max = max(self.max, other.max)
+
+    def cumulative(self) -> list:
+        """
+        :return: list of (upper bound as string, number of observations <= bound) including +Inf
+        """
+        result, total = [], 0
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            result.append((format_bound(bound), total))
+        result.append(("+Inf", self.count))
+        return result
+
+    def to_dict(self) -> dict:
+        return {"count": self.count, "sum": round(self.sum, 6), "max": round(self.max, 6),
+                "buckets": dict(self.cumulative())}
+
+
+def format_bound(bound: float) -> str:
+    return f"{bound:g}"
+
+
+class StageTimer:
+    """
+    Handle yielded by stage - code inside the stage sets number of bytes it moved
+    """
+    def __init__(self):
+        self.bytes = 0
+
+
+class CycleMetrics:
+    """
+    Durations and bytes of stages observed during one cycle, total and per POD
+    """
+    def __init__(self, date: datetime.datetime | None = None):
+        self.date = date
+        self.started = time.time()
+        self.duration = None
+        self.stages = {}  # stage -> Histogram
+        self.stage_bytes = {}  # stage -> bytes
+        self.pods = {}  # pod_id -> {stage: {"seconds": float, "bytes": int}}
+        self.events = {}  # event -> count
+        self._start = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def observe(self, stage: str, seconds: float, nbytes: int = 0, pod_id: str | None = None):
+        with self._lock:
+            self.stages.setdefault(stage, Histogram()).observe(seconds)
+            self.stage_bytes[stage] = self.stage_bytes.get(stage, 0) + nbytes
+            if pod_id is not None:
+                pod_stage = self.pods.setdefault(pod_id, {}).setdefault(stage, {"seconds": 0.0, "bytes": 0})
+                pod_stage["seconds"] += seconds
+                pod_stage["bytes"] += nbytes
+
+    def count(self, event: str, n: int = 1):
+        with self._lock:
+            self.events[event] = self.events.get(event, 0) + n
+
+    def finish(self):
+        self.duration = time.perf_counter() - self._start
+
+    @property
+    def over_budget(self) -> bool:
+        return self.duration is not None and self.duration > CYCLE_BUDGET
+
+    def to_record(self) -> dict:
+        """
+        One JSON lines record of the cycle
+        """
+        stages = {}
+        for stage in sorted(self.stages, key=stage_order):
+            stages[stage] = self.stages[stage].to_dict() | {"bytes": self.stage_bytes[stage]}
+        pods = {pod_id: {stage: {"seconds": round(value["seconds"], 6), "bytes": value["bytes"]}
+                         for stage, value in pod_stages.items()}
+                for pod_id, pod_stages in sorted(self.pods.items())}
+        return {
+            "date": None if self.date is None else self.date.isoformat(),
+            "started": datetime.datetime.fromtimestamp(self.started, tz=datetime.timezone.utc).isoformat(),
+            "duration_seconds": None if self.duration is None else round(self.duration, 6),
+            "budget_seconds": CYCLE_BUDGET,
+            "budget_used": None if self.duration is None else round(self.duration / CYCLE_BUDGET, 6),
+            "over_budget": self.over_budget,
+            "pods": len(self.pods),
+            "stages": stages,
+            "events": dict(sorted(self.events.items())),
+            "per_pod": pods,
+        }
+
+
+def stage_order(stage: str) -> tuple:
+    return (STAGES.index(stage), stage) if stage in STAGES else (len(STAGES), stage)
+
+
+class MetricsTotals:
+    """
+    Stage histograms and counters accumulated over all cycles of the process - exported as Prometheus textfile
+    """
+    def __init__(self):
+        self.stages = {}  # stage -> Histogram
+        self.stage_bytes = {}  # stage -> bytes
+        self.events = {}  # event -> count
+        self.cycles = 0
+        self.cycles_over_budget = 0
+        self.last_cycle = None
+        self._lock = threading.Lock()  # scheduler events are counted from other thread than finished cycles
+
+    def add(self, cycle_metrics: CycleMetrics):
+        with self._lock:
+            for stage, histogram in cycle_metrics.stages.items():
+                self.stages.setdefault(stage, Histogram()).merge(histogram)
+                self.stage_bytes[stage] = self.stage_bytes.get(stage, 0) + cycle_metrics.stage_bytes[stage]
+            for event, n in cycle_metrics.events.items():
+                self.events[event] = self.events.get(event, 0) + n
+            self.cycles += 1
+            self.cycles_over_budget += cycle_metrics.over_budget
+            self.last_cycle = cycle_metrics
+
+    def observe(self, stage: str, seconds: float, nbytes: int = 0):
+        with self._lock:
+            self.stages.setdefault(stage, Histogram()).observe(seconds)
+            self.stage_bytes[stage] = self.stage_bytes.get(stage, 0) + nbytes
+
+    def count(self, event: str, n: int = 1):
+        with self._lock:
+            self.events[event] = self.events.get(event, 0) + n
+
+    def to_prometheus(self) -> str:
+        """
+        Prometheus text exposition format
+        """
+        name = f"{PROM_PREFIX}_stage_duration_seconds"
+        lines = [f"# HELP {name} Duration of cycle stages.", f"# TYPE {name} histogram"]
+        for stage in sorted(self.stages, key=stage_order):
+            histogram = self.stages[stage]
+            for bound, count in histogram.cumulative():
+                lines.append(f'{name}_bucket{{stage="{stage}",le="{bound}"}} {count}')
+            lines.append(f'{name}_sum{{stage="{stage}"}} {histogram.sum:.6f}')
+            lines.append(f'{name}_count{{stage="{stage}"}} {histogram.count}')
+
+        name = f"{PROM_PREFIX}_stage_bytes_total"
+        lines += [f"# HELP {name} Bytes moved by cycle stages.", f"# TYPE {name} counter"]
+        lines += [f'{name}{{stage="{stage}"}} {self.stage_bytes[stage]}' for stage in sorted(self.stage_bytes, key=stage_order)]
+
+        name = f"{PROM_PREFIX}_events_total"
+        lines += [f"# HELP {name} Counted cycle and scheduler events.", f"# TYPE {name} counter"]
+        lines += [f'{name}{{event="{event}"}} {n}' for event, n in sorted(self.events.items())]
+
+        last = self.last_cycle
+        metrics = [
+            ("cycles_total", "counter", "Finished cycles.", self.cycles),
+            ("cycles_over_budget_total", "counter", "Cycles which took longer than the budget.", self.cycles_over_budget),
+            ("cycle_budget_seconds", "gauge", "Time budget of one cycle.", CYCLE_BUDGET),
+        ]
+        if last is not None:
+            metrics += [
+                ("last_cycle_duration_seconds", "gauge", "Duration of the last cycle.", f"{last.duration:.6f}"),
+                ("last_cycle_budget_ratio", "gauge", "Duration of the last cycle divided by the budget.", f"{last.duration / CYCLE_BUDGET:.6f}"),
+                ("last_cycle_pods", "gauge", "PODs processed in the last cycle.", len(last.pods)),
+                ("last_cycle_timestamp_seconds", "gauge", "Start of the last cycle as unix time.", f"{last.started:.3f}"),
+            ]
+        for suffix, kind, description, value in metrics:
+            name = f"{PROM_PREFIX}_{suffix}"
+            lines += [f"# HELP {name} {description}", f"# TYPE {name} {kind}", f"{name} {value}"]
+        return "\n".join(lines) + "\n"
+
+
+totals = MetricsTotals()
+# CycleMetrics of running cycle - context variable, so only the cycle thread and threads running a copy of its context
+# (executor of pipeline mode) count into the cycle, background threads (outbox uploader, archive compaction) do not
+_current = contextvars.ContextVar("cycle_metrics", default=None)
+_local = threading.local()  # pod_id processed by current thread
+
+
+@contextmanager
+def cycle(date: datetime.datetime | None = None):
+    """
+    Collect stage metrics of one cycle - on exit one record is appended to METRICS_JSONL and METRICS_PROM is rewritten
+
+    Stages observed outside of cycle (background threads, instrumented functions called on their own) are added only
+    to totals exported with the next cycle
+    """
+    cycle_metrics = CycleMetrics(date=date)
+    token = _current.set(cycle_metrics)
+    try:
+        yield cycle_metrics
+    finally:
+        _current.reset(token)
+        cycle_metrics.finish()
+        totals.add(cycle_metrics)
+        if cycle_metrics.over_budget:
+            log.warning(f"Cycle took {cycle_metrics.duration:.1f} s - over budget of {CYCLE_BUDGET} s")
+        try:
+            write_jsonl(cycle_metrics.to_record())
+            write_prometheus(totals.to_prometheus())
+        except OSError as e:
+            log.warning(f"Cannot write cycle metrics - {e}")
+
+
+@contextmanager
+def pod(pod_id: str):
+    """
+    Attribute stages observed by current thread to given POD
+    """
+    previous = getattr(_local, "pod_id", None)
+    _local.pod_id = pod_id
+    try:
+        yield
+    finally:
+        _local.pod_id = previous
+
+
+@contextmanager
+def stage(name: str, pod_id: str | None = None):
+    """
+    Measure duration of the block as given stage of running cycle, set bytes of yielded StageTimer to record data size
+
+    The block is profiled by current thread if the cycle is profiled (see lib.profiling)
+    """
+    timer = StageTimer()
+    session = profiling.current()
+    profiled = session is not None and session.enter(name)
+    start = time.perf_counter()
+    try:
+        yield timer
+    finally:
+        if profiled:
+            session.exit()
+        cycle_metrics = _current.get()
+        if cycle_metrics is not None:
+            cycle_metrics.observe(name, time.perf_counter() - start, nbytes=timer.bytes,
+                                  pod_id=pod_id or getattr(_local, "pod_id", None))
+        else:
+            totals.observe(name, time.perf_counter() - start, nbytes=timer.bytes)
+
+
+def count(event: str, n: int = 1):
+    """
+    Count event (e.g. skipped POD) in running cycle - events outside of cycle (e.g. cycle skipped by scheduler) are
+    added to totals and METRICS_PROM is rewritten immediately
+    """
+    cycle_metrics = _current.get()
+    if cycle_metrics is not None:
+        cycle_metrics.count(event, n)
+        return
+    totals.count(event, n)
+    try:
+        write_prometheus(totals.to_prometheus())
+    except OSError as e:
+        log.warning(f"Cannot write metrics - {e}")
+
+
+def write_jsonl(record: dict, path: str | None = None, max_bytes: int = JSONL_MAX_BYTES,
+                backups: int = JSONL_BACKUPS):
+    """
+    Append record, the file is rotated first if the record would make it larger than max_bytes
+    """
+    path = path or METRICS_JSONL
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    line = json.dumps(record) + "\n"
+    size = os.path.getsize(path) if os.path.exists(path) else 0
+    if size and size + len(line) > max_bytes:
+        rotate(path, backups)
+    with open(path, "a") as f:
+        f.write(line)
+
+
+def rotate(path: str, backups: int):
+    """
+    Shift path.1 .. path.<backups - 1> by one and rename path to path.1 - the oldest backup is overwritten
+    """
+    for i in range(backups - 1, 0, -1):
+        if os.path.exists(f"{path}.{i}"):
+            os.replace(f"{path}.{i}", f"{path}.{i + 1}")
+    if backups > 0:
+        os.replace(path, f"{path}.1")
+    else:
+        os.remove(path)
+
+
+def write_prometheus(text: str, path: str | None = None):
+    """
+    Replace textfile atomically, so node exporter never reads half written file
+    """
+    path = path or METRICS_PROM
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        f.write(text)
+    os.replace(tmp_path, path)
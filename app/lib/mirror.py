@@ -0,0 +1,127 @@
+import logging
+import os
+import shutil
+import time
+
+from lib import MIRROR_DIR, budget, metrics
+from lib.transport import read_remote
+
+log = logging.getLogger(__name__)
+
+TAIL_SIZE = 256  # bytes before end of mirrored file compared with source to detect that it was only appended
+EVICTION_PERIOD = 3600  # seconds between scans of the whole mirror for files older than retention
+
+_last_eviction = 0.0  # time.monotonic() of last eviction scan
+
+
+def mirror_path(pod_id: str, filename: str, root: str | None = None) -> str:
+    return os.path.join(root or MIRROR_DIR, pod_id, filename)
+
+
+def is_current(path: str, file_attr) -> bool:
+    """
+    Mirrored file has the same size and mtime as file on sftp
+    """
+    try:
+        local = os.stat(path)
+    except FileNotFoundError:
+        return False
+    return local.st_size == file_attr.st_size and int(local.st_mtime) == int(file_attr.st_mtime)
+
+
+def sync_file(sftp, pod_id: str, file_attr, root: str | None = None) -> str:
+    """
+    Bring mirrored copy of one POD file up to date - sftp must be in directory of the POD
+
+    Unchanged files (size and mtime) are not downloaded at all, a file which grew is appended with new bytes only if
+    its last TAIL_SIZE bytes did not change, any other change downloads whole file to temporary file replaced
+    atomically. Mirrored file gets mtime of the source file
+
+    :return: path of mirrored file
+    """
+    path = mirror_path(pod_id, file_attr.filename, root=root)
+    if is_current(path, file_attr):
+        metrics.count("mirror_hits")
+        return path
+
+    budget.check(f"reading {file_attr.filename}")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    local_size = os.path.getsize(path) if os.path.exists(path) else 0
+    with metrics.stage("download") as timer, sftp.open(file_attr.filename, 'rb') as remote:
+        appended = False
+        if 0 < local_size <= file_attr.st_size:
+            start = max(local_size - TAIL_SIZE, 0)
+            remote.seek(start)
+            data = read_remote(sftp, remote, size=file_attr.st_size)
+            timer.bytes += len(data)
+            with open(path, 'rb') as f:
+                f.seek(start)
+                tail = f.read()
+            if data[:len(tail)] == tail:
+                with open(path, 'ab') as f:
+                    f.write(data[len(tail):])
+                appended = True
+        if not appended:
+            remote.seek(0)
+            data = read_remote(sftp, remote, size=file_attr.st_size)
+            timer.bytes += len(data)
+            tmp_path = f"{path}.part"
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+    os.utime(path, (file_attr.st_mtime, file_attr.st_mtime))
+    metrics.count("mirror_appends" if appended else "mirror_downloads")
+    return path
+
+
+def read_file(sftp, pod_id: str, file_attr, root: str | None = None) -> bytes:
+    """
+    Sync one POD file and read it from the mirror
+    """
+    path = sync_file(sftp, pod_id, file_attr, root=root)
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def evict(retention_days: float, root: str | None = None, now: float | None = None) -> list:
+    """
+    Delete mirrored files whose source mtime is older than retention and POD directories left empty
+
+    :return: paths of deleted files
+    """
+    root = root or MIRROR_DIR
+    if not os.path.isdir(root):
+        return []
+    threshold = (time.time() if now is None else now) - retention_days * 86400
+    removed = []
+    for pod_id in os.listdir(root):
+        pod_dir = os.path.join(root, pod_id)
+        if not os.path.isdir(pod_dir):
+            continue
+        for filename in os.listdir(pod_dir):
+            path = os.path.join(pod_dir, filename)
+            if os.path.getmtime(path) < threshold:
+                if os.path.isdir(path):
+                    shutil.rmtree(path)
+                else:
+                    os.remove(path)
+                removed.append(path)
+        if not os.listdir(pod_dir):
+            os.rmdir(pod_dir)
+    if removed:
+        log.info(f"Evicted {len(removed)} mirrored files older than {retention_days} days")
+    return removed
+
+
+def evict_periodically(retention_days: float, root: str | None = None):
+    """
+    Run evict at most once per EVICTION_PERIOD - called on every POD sync
+    """
+    global _last_eviction
+    if time.monotonic() - _last_eviction < EVICTION_PERIOD and _last_eviction:
+        return
+    _last_eviction = time.monotonic()
+    try:
+        evict(retention_days, root=root)
+    except OSError as e:
+        log.warning(f"Cannot evict mirrored files - {e}")
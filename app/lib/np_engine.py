@@ -0,0 +1,276 @@
+"""
+Datalogger-to-json path on plain NumPy arrays - int64 epoch seconds and float64 energies instead of DataFrames
+
+Output is the same json as huawei_datalogger_csv_parser + handle_missing_intervals + fast serializer, including
+Kahan summation of E-Day per timestamp as pandas groupby sum does and DST handling of tz_localize(ambiguous="infer")
+(which this module extends to files written newest row first)
+"""
+import csv
+import datetime
+import io
+from typing import Iterator, NamedTuple
+from zoneinfo import ZoneInfo
+
+import numpy as np
+
+from lib import TIMEZONE, INTERVAL, metrics
+from lib.json_writer import DataValidity, CHUNK_ROWS, validate_quantities, production_arrays_json_chunks
+
+TIMESTAMP_COL = "#Time"
+E_DAY_COL = "E-Day"
+SLOT = INTERVAL * 60  # seconds
+_EPOCH = datetime.datetime(1970, 1, 1)
+_ZONE = ZoneInfo(TIMEZONE)
+
+
+class Production(NamedTuple):
+    """
+    Interval production of one POD for the day until interval date - one item per day grid slot
+    """
+    start: np.ndarray  # int64 UTC epoch seconds of interval starts
+    quantity: np.ndarray  # float64 kWh
+    valid: np.ndarray  # bool, False for intervals missing in source data (status f)
+
+    def to_json_str(self, compact: bool = False) -> str:
+        return "".join(self.json_chunks(compact=compact, encode=False))
+
+    def to_json_bytes(self, compact: bool = False) -> io.BytesIO:
+        return io.BytesIO(self.to_json_str(compact=compact).encode("utf-8"))
+
+    def json_chunks(self, compact: bool = False, chunk_rows: int = CHUNK_ROWS, encode: bool = True) -> Iterator:
+        """
+        Validate quantities and return generator of CEZ json chunks (see json_writer.production_json_chunks)
+        """
+        with metrics.stage("validate"):
+            validate_quantities(self.quantity)
+        statuses = np.where(self.valid, DataValidity.w.value, DataValidity.f.value)
+        return production_arrays_json_chunks(start_dates=self.start.astype("datetime64[s]"), quantities=self.quantity,
+                                             statuses=statuses.tolist(), compact=compact, chunk_rows=chunk_rows,
+                                             encode=encode)
+
+    def to_df(self):
+        """
+        Same DataFrame as handle_missing_intervals returns
+        """
+        import pandas as pd
+        from lib.json_writer import startDate, quantity, status
+
+        index = pd.DatetimeIndex(self.start.astype("datetime64[s]").astype("datetime64[ns]"), name=startDate).tz_localize("UTC")
+        statuses = np.where(self.valid, DataValidity.w.value, DataValidity.f.value).astype(object)
+        return pd.DataFrame({status: statuses, quantity: self.quantity}, index=index)
+
+
+class InverterRows(NamedTuple):
+    """
+    #Time and E-Day values of all inverter blocks of a datalogger file
+    """
+    times: list  # local time strings
+    e_days: list  # E-Day strings, None if the row is too short
+    blocks: list  # index of inverter block of every row
+    has_blocks: bool  # False if the file had no rows at all
+
+
+def read_inverter_rows(text: str) -> InverterRows:
+    """
+    Split Huawei csv to inverter blocks (header line contains #Time, other lines with # are comments) and keep only
+    #Time and E-Day of every row - blocks without these columns are skipped
+    """
+    times, e_days, blocks = [], [], []
+    lines = text.splitlines()
+    block_lines = []
+    block_count = 0
+
+    def add_block(block: list):
+        nonlocal block_count
+        if not block:
+            return
+        rows = csv.reader(block, delimiter=';')
+        header = next(rows)
+        if TIMESTAMP_COL not in header or E_DAY_COL not in header:
+            block_count += 1
+            return
+        time_index, e_day_index = header.index(TIMESTAMP_COL), header.index(E_DAY_COL)
+        for row in rows:
+            if len(row) > time_index:
+                times.append(row[time_index])
+                e_days.append(row[e_day_index] if len(row) > e_day_index else None)
+                blocks.append(block_count)
+        block_count += 1
+
+    for line in lines:
+        if "#" in line:
+            if TIMESTAMP_COL in line:
+                add_block(block_lines)
+                block_lines = [line]
+        else:
+            block_lines.append(line)
+    add_block(block_lines)
+    return InverterRows(times=times, e_days=e_days, blocks=blocks, has_blocks=block_count > 0)
+
+
+def csv_state_rows(state) -> InverterRows:
+    """
+    #Time and E-Day values kept by HuaweiCsvState of incremental read mode
+    """
+    times, e_days, blocks = [], [], []
+    block_count = 0
+    for block, projection in zip(*state.projected_blocks()):
+        if not block:
+            continue
+        if projection is not None:
+            for time, e_day in block[1:]:
+                if time is not None:
+                    times.append(time)
+                    e_days.append(e_day)
+                    blocks.append(block_count)
+        block_count += 1
+    return InverterRows(times=times, e_days=e_days, blocks=blocks, has_blocks=block_count > 0)
+
+
+def parse_local_seconds(times: list) -> np.ndarray:
+    """
+    Parse local time strings ("%Y-%m-%d %H:%M:%S", or "%y-%m-%d %H:%M:%S" if any value does not match) to naive
+    epoch seconds
+    """
+    values = np.array(times, dtype=str)
+    lengths = np.char.str_len(values)
+    if (lengths == 19).all():
+        parsed = values
+    elif (lengths == 17).all():
+        parsed = np.char.add("20", values)
+    else:
+        raise ValueError(f"Invalid {TIMESTAMP_COL} values in datalogger data")
+    return np.array(parsed, dtype="datetime64[s]").astype(np.int64)
+
+
+def local_to_utc(local: np.ndarray, blocks: np.ndarray) -> np.ndarray:
+    """
+    Convert naive local epoch seconds to UTC epoch seconds - offsets are resolved once per distinct local time,
+    non-existent spring times raise ValueError
+
+    Local time repeated in one inverter block during autumn DST change is summer time at its first occurrence if the
+    block is in ascending order (as tz_localize(ambiguous="infer")) and at its second one if the block is in
+    descending order (newest row first, as Huawei writes accumulated files - pandas cannot infer DST there)
+
+    :param blocks: non-decreasing inverter block index of every value
+    """
+    unique, inverse = np.unique(local, return_inverse=True)
+    offsets = np.empty((2, len(unique)), dtype=np.int64)  # fold 0 and fold 1
+    for i, seconds in enumerate(unique.tolist()):
+        offsets[:, i] = local_offsets(seconds)
+
+    folds = np.zeros(len(local), dtype=np.int64)
+    ambiguous = np.flatnonzero(offsets[0, inverse] != offsets[1, inverse])
+    if len(ambiguous):
+        block_ids, first = np.unique(blocks, return_index=True)
+        last = np.append(first[1:], len(blocks)) - 1
+        descending = dict(zip(block_ids.tolist(), (local[last] < local[first]).tolist()))
+        seen = set()
+        for position in ambiguous.tolist():
+            block = int(blocks[position])
+            key = (block, int(local[position]))
+            folds[position] = int((key in seen) != descending[block])
+            seen.add(key)
+    return local - offsets[folds, inverse]
+
+
+def local_offsets(seconds: int) -> tuple:
+    """
+    UTC offsets in seconds of naive local epoch seconds at fold 0 and fold 1 (different only for autumn DST
+    ambiguous times), non-existent spring times raise ValueError
+    """
+    naive = _EPOCH + datetime.timedelta(seconds=seconds)
+    offsets = tuple(int(naive.replace(tzinfo=_ZONE, fold=fold).utcoffset().total_seconds()) for fold in (0, 1))
+    round_trip = naive.replace(tzinfo=_ZONE).astimezone(datetime.timezone.utc).astimezone(_ZONE)
+    if round_trip.replace(tzinfo=None) != naive:
+        raise ValueError(f"Non-existent local time {naive} in datalogger data")
+    return offsets
+
+
+def grouped_kahan_sum(labels: np.ndarray, values: np.ndarray, groups: int) -> np.ndarray:
+    """
+    Sum values per label in row order with Kahan compensation, NaN skipped - same floats as pandas groupby sum
+    """
+    order = np.argsort(labels, kind="stable")
+    sorted_labels = labels[order]
+    counts = np.bincount(labels, minlength=groups)
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    position = np.arange(len(labels)) - starts[sorted_labels]
+    sums = np.zeros(groups)
+    compensation = np.zeros(groups)
+    for k in range(int(counts.max(initial=0))):  # k-th value of every group at once
+        selected = position == k
+        group = sorted_labels[selected]
+        value = values[order[selected]]
+        present = ~np.isnan(value)
+        group, value = group[present], value[present]
+        y = value - compensation[group]
+        t = sums[group] + y
+        new_compensation = (t - sums[group]) - y
+        compensation[group] = np.where(np.isnan(new_compensation), 0.0, new_compensation)
+        sums[group] = t
+    return sums
+
+
+def day_slots(date: datetime.datetime) -> np.ndarray:
+    """
+    UTC epoch seconds of interval starts from local midnight of date until date (inclusive)
+    """
+    local = date.astimezone(_ZONE) if date.tzinfo is not None else date.replace(tzinfo=_ZONE)
+    midnight = datetime.datetime(local.year, local.month, local.day, tzinfo=_ZONE)
+    start = int(midnight.timestamp())
+    end = int(local.timestamp())
+    return np.arange(start, end + 1, SLOT, dtype=np.int64) if end >= start else np.empty(0, dtype=np.int64)
+
+
+def rows_to_production(rows: InverterRows, date: datetime.datetime) -> Production:
+    """
+    Sum E-Day of all inverters per timestamp, diff, clip at zero, round to 3 decimals and align to day grid
+    """
+    slots = day_slots(date)
+    quantities = np.zeros(len(slots))
+    valid = np.zeros(len(slots), dtype=bool)
+    if not rows.has_blocks:  # no data at all - first interval is sent as measured zero (as pandas engine does)
+        valid[:1] = True
+        return Production(start=slots, quantity=quantities, valid=valid)
+    if not rows.times:
+        return Production(start=slots, quantity=quantities, valid=valid)
+
+    local = parse_local_seconds(rows.times)
+    utc = local_to_utc(local, np.asarray(rows.blocks, dtype=np.int64))
+    e_day = np.fromiter((float("nan") if s is None else float(s) for s in rows.e_days), dtype=float,
+                        count=len(rows.e_days))
+    keys, labels = np.unique(utc, return_inverse=True)
+    return sums_to_production(keys, grouped_kahan_sum(labels, e_day, len(keys)), slots)
+
+
+def sums_to_production(keys: np.ndarray, sums: np.ndarray, slots: np.ndarray) -> Production:
+    """
+    Diff E-Day sums of sorted distinct timestamps, clip at zero, round to 3 decimals and align to day grid slots
+    """
+    quantities = np.zeros(len(slots))
+    valid = np.zeros(len(slots), dtype=bool)
+    increments = np.diff(sums, prepend=sums[:1])
+    increments = np.where(np.isnan(increments), 0.0, increments)
+    increments = np.round(np.where(increments < 0, 0.0, increments), 3)
+
+    positions = np.searchsorted(slots, keys)
+    on_grid = positions < len(slots)
+    on_grid[on_grid] = slots[positions[on_grid]] == keys[on_grid]
+    quantities[positions[on_grid]] = increments[on_grid]
+    valid[positions[on_grid]] = True
+    return Production(start=slots, quantity=quantities, valid=valid)
+
+
+def datalogger_production(text: str, date: datetime.datetime) -> Production:
+    """
+    Parse Huawei datalogger csv text to interval production of the day until date
+    """
+    return rows_to_production(read_inverter_rows(text), date)
+
+
+def csv_state_production(state, date: datetime.datetime) -> Production:
+    """
+    Interval production of the day until date from HuaweiCsvState of incremental read mode
+    """
+    return rows_to_production(csv_state_rows(state), date)
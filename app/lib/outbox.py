@@ -0,0 +1,246 @@
+"""
+Durable outbox of generated CEZ jsons - cycles store json of every POD under OUTBOX_DIR and return, background
+uploader thread writes pending files to target ftp with retries and exponential backoff
+
+One file per POD and day (the same name as on target ftp), a newer json of the same POD and day atomically replaces
+the pending one, so a slow or failing target host never blocks cycles and failed uploads are retried from disk
+without reading and parsing source data again. Pending files survive restart and are sent by the next process
+
+Workers of sharded deployment keep their own OUTBOX_DIR/<worker id>, pending files of a dead worker are adopted by the
+worker which owns their POD after takeover
+"""
+import atexit
+import io
+import logging
+import os
+import threading
+import time
+from typing import NamedTuple
+
+from lib import OUTBOX_DIR, metrics, sharding
+from lib.config import load_app_config, OutboxConfig
+
+log = logging.getLogger(__name__)
+
+_DATE_SUFFIX = len("-YYYY-MM-DD.json")
+
+
+class Retry(NamedTuple):
+    attempts: int  # failed uploads of the pending file
+    due: float  # time.monotonic() of next attempt
+
+
+def json_filename(pod_id: str, date) -> str:
+    return f"{pod_id}-{date.date()}.json"
+
+
+def pod_id_of(filename: str) -> str:
+    return filename[:-_DATE_SUFFIX]
+
+
+def file_signature(st: os.stat_result) -> tuple:
+    """
+    Identity of pending file content - put replaces the file by a new one, so inode changes even within mtime
+    resolution
+    """
+    return st.st_ino, st.st_mtime_ns, st.st_size
+
+
+class Outbox:
+    """
+    Pending jsons in one directory - put is called by cycles, drain by uploader, both in the same process
+    """
+    def __init__(self, config: OutboxConfig | None = None, root: str | None = None):
+        self.config = config or load_app_config().outbox
+        self.root = root or OUTBOX_DIR
+        self.retries = {}  # filename -> Retry, only for files whose upload failed
+        self.wakeup = threading.Event()  # set by put, uploader waits on it
+        self._lock = threading.Lock()  # replace by put and delete by drain of the same file are exclusive
+        os.makedirs(self.root, exist_ok=True)
+
+    def put(self, pod_id: str, date, json_io: io.BytesIO) -> str:
+        """
+        Store json of POD and day - written to temporary file and synced first, so pending file is always complete
+
+        :return: path of pending file
+        """
+        filename = json_filename(pod_id, date)
+        path = os.path.join(self.root, filename)
+        tmp_path = f"{path}.part"
+        with open(tmp_path, 'wb') as f:
+            f.write(json_io.getbuffer())
+            f.flush()
+            os.fsync(f.fileno())
+        with self._lock:
+            replaced = os.path.exists(path)
+            os.replace(tmp_path, path)
+            self.retries.pop(filename, None)  # new content is tried at once
+        metrics.count("outbox_replaced" if replaced else "outbox_queued")
+        self.wakeup.set()
+        return path
+
+    def pending(self) -> list:
+        """
+        Names of pending files, oldest first
+        """
+        entries = [e for e in os.scandir(self.root) if e.is_file() and e.name.endswith(".json")]
+        return [e.name for e in sorted(entries, key=lambda e: e.stat().st_mtime_ns)]
+
+    def next_due(self, now: float | None = None) -> float | None:
+        """
+        Seconds until the first pending file may be tried, None if nothing is pending
+        """
+        now = time.monotonic() if now is None else now
+        pending = self.pending()
+        if not pending:
+            return None
+        return max(min(self.retries[s].due if s in self.retries else now for s in pending) - now, 0.0)
+
+    def drain(self, pool, now: float | None = None) -> tuple:
+        """
+        Write every pending file which is due to target ftp of its POD - uploaded file is deleted unless a newer json
+        replaced it meanwhile, failed file is tried again after retry_min * 2 ** (attempts - 1) seconds (at most
+        retry_max)
+
+        :param pool: FtpPool
+        :return: (uploaded filenames, failed filenames)
+        """
+        now = time.monotonic() if now is None else now
+        uploaded, failed = [], []
+        for filename in self.pending():
+            retry = self.retries.get(filename)
+            if retry is not None and retry.due > now:
+                continue
+            path = os.path.join(self.root, filename)
+            try:
+                with open(path, 'rb') as f:
+                    signature = file_signature(os.fstat(f.fileno()))
+                    data = f.read()
+            except FileNotFoundError:
+                continue
+            pod_id = pod_id_of(filename)
+            with metrics.pod(pod_id), metrics.stage("upload") as timer:
+                timer.bytes = len(data)
+                try:
+                    written = pool.write_file(pod_id=pod_id, filename=filename, binary_data=io.BytesIO(data))
+                except Exception as e:  # e.g. POD removed from ftp config
+                    log.warning(f"Cannot upload {filename} from outbox - {e}")
+                    written = False
+            with self._lock:
+                current = file_signature(os.stat(path)) == signature
+                if written:
+                    if current:
+                        os.remove(path)
+                    uploaded.append(filename)
+                    continue
+                if not current:  # replaced by newer json during upload - tried at once
+                    failed.append(filename)
+                    continue
+                attempts = retry.attempts + 1 if retry is not None else 1
+                delay = min(self.config.retry_min * 2 ** (attempts - 1), self.config.retry_max)
+                self.retries[filename] = Retry(attempts=attempts, due=now + delay)
+            metrics.count("outbox_retries")
+            log.info(f"Upload of {filename} from outbox failed {attempts} times - next attempt in {delay:.0f} s")
+            failed.append(filename)
+        return uploaded, failed
+
+    def adopt_orphans(self, shard) -> list:
+        """
+        Move pending files of dead workers (outbox directories next to this one without live lease) whose POD is owned
+        by this worker now - the new owner of a POD sends the jsons the dead worker did not. A pending file of the same
+        name is replaced only by a newer one
+
+        :param shard: sharding.Shard of this worker
+        :return: adopted filenames
+        """
+        parent = os.path.dirname(os.path.abspath(self.root))
+        live = set(shard.live_workers())
+        adopted = []
+        for entry in os.scandir(parent):
+            if not entry.is_dir() or entry.name in live or os.path.abspath(entry.path) == os.path.abspath(self.root):
+                continue
+            filenames = [s for s in os.listdir(entry.path) if s.endswith(".json")]
+            owned = set(shard.owned([pod_id_of(s) for s in filenames]))
+            for filename in filenames:
+                if pod_id_of(filename) in owned and self._adopt(os.path.join(entry.path, filename)):
+                    adopted.append(filename)
+        if adopted:
+            metrics.count("outbox_adopted", len(adopted))
+            log.info(f"Adopted {len(adopted)} pending jsons of dead workers: {adopted}")
+        return adopted
+
+    def _adopt(self, path: str) -> bool:
+        filename = os.path.basename(path)
+        target = os.path.join(self.root, filename)
+        with self._lock:
+            try:
+                if os.path.exists(target) and os.stat(target).st_mtime_ns >= os.stat(path).st_mtime_ns:
+                    os.remove(path)  # this worker already has a newer json of the POD and day
+                    return False
+                os.replace(path, target)
+            except FileNotFoundError:  # taken by another worker
+                return False
+            self.retries.pop(filename, None)
+        return True
+
+
+class OutboxUploader(threading.Thread):
+    """
+    Daemon thread draining outbox whenever a json is put or a retry is due - with shard, orphaned files of dead workers
+    are adopted before every drain and checked at least every lease_ttl seconds
+    """
+    def __init__(self, outbox: Outbox, pool, shard=None):
+        super().__init__(name="outbox-uploader", daemon=True)
+        self.outbox = outbox
+        self.pool = pool
+        self.shard = shard
+        self._stop_requested = threading.Event()
+
+    def run(self):
+        while True:
+            self.outbox.wakeup.clear()
+            try:
+                if self.shard is not None:
+                    self.outbox.adopt_orphans(self.shard)
+                self.outbox.drain(self.pool)
+            except Exception as e:
+                log.warning(f"Outbox drain failed - {e}")
+            if self._stop_requested.is_set():
+                break
+            delay = self.outbox.next_due()
+            timeout = self.outbox.config.retry_max if delay is None else delay
+            if self.shard is not None:
+                timeout = min(timeout, self.shard.config.lease_ttl)
+            self.outbox.wakeup.wait(timeout=timeout)
+        self.pool.close()
+
+    def stop(self, timeout: float | None = 30):
+        """
+        Finish after one more drain - files still pending are sent by the next process
+        """
+        self._stop_requested.set()
+        self.outbox.wakeup.set()
+        self.join(timeout=timeout)
+
+
+_outbox = None
+_uploader = None
+_start_lock = threading.Lock()
+
+
+def default_outbox() -> Outbox:
+    """
+    Outbox of the process with running uploader - started by first call, stopped at interpreter exit
+    """
+    global _outbox, _uploader
+    with _start_lock:
+        if _outbox is None:
+            from lib.sftp_conn import FtpPool  # sftp_conn imports this module
+
+            worker = sharding.worker_id()  # workers of sharded deployment adopt files of dead workers only
+            _outbox = Outbox(root=os.path.join(OUTBOX_DIR, worker) if worker else None)
+            _uploader = OutboxUploader(_outbox, FtpPool(sessions_per_host=load_app_config().ftp_sessions_per_host),
+                                       shard=sharding.local_shard())
+            _uploader.start()
+            atexit.register(_uploader.stop)
+    return _outbox
@@ -0,0 +1,105 @@
+import asyncio
+import contextvars
+import functools
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+from lib.config import load_app_config, PipelineConfig
+from lib.sftp_conn import SftpConn, FtpPool, list_pod_ids, fetch_pod, parse_pod, send_json, serialize_pod, archive_pod, CycleResult
+
+log = logging.getLogger(__name__)
+
+_STOP = None  # sentinel closing stage queues
+
+
+async def run_pipeline(date: pd.Timestamp, config: PipelineConfig | None = None) -> CycleResult:
+    """
+    Process all PODs with overlapping stages - producers fetch POD files over their own sftp session, workers parse
+    and serialize them to CEZ json and uploaders write jsons to target ftp, so upload of one POD runs while other
+    PODs are still downloading
+
+    Blocking sftp/ftp/pandas calls run in a dedicated thread pool sized by the configured concurrency
+
+    :return: CycleResult with PODs whose json was written to ftp and PODs which failed
+    """
+    config = config or load_app_config().pipeline
+    loop = asyncio.get_running_loop()
+    executor = ThreadPoolExecutor(max_workers=config.producers + config.workers + config.uploaders,
+                                  thread_name_prefix="pipeline")
+
+    def run(func, *args):  # executor threads run in copy of cycle context, so their stages count into the cycle
+        return loop.run_in_executor(executor, functools.partial(contextvars.copy_context().run, func, *args))
+
+    pod_queue = asyncio.Queue()
+    parse_queue = asyncio.Queue(maxsize=config.queue_size)
+    upload_queue = asyncio.Queue(maxsize=config.queue_size)
+    uploaded, failed = [], []
+    sessions = []
+    pool = FtpPool(sessions_per_host=load_app_config().ftp_sessions_per_host)
+    try:
+        sessions.append(await run(SftpConn))
+        pod_ids = await run(list_pod_ids, sessions[0])
+        for pod_id in pod_ids:
+            pod_queue.put_nowait(pod_id)
+        extra = min(config.producers, max(len(pod_ids), 1)) - 1
+        sessions += await asyncio.gather(*[run(SftpConn) for _ in range(extra)])
+
+        async def produce(sftp):
+            while not pod_queue.empty():
+                pod_id = pod_queue.get_nowait()
+                try:
+                    pod_files = await run(fetch_pod, sftp, pod_id, date)
+                except Exception as e:
+                    log.warning(f"Cannot fetch data for pod_id {pod_id} - {e}")
+                    failed.append(pod_id)
+                    continue
+                await parse_queue.put(pod_files)
+
+        def parse_and_serialize(pod_files):
+            production_data = parse_pod(pod_files, date)
+            return serialize_pod(pod_files.pod_id, production_data), production_data
+
+        async def work():
+            while (pod_files := await parse_queue.get()) is not _STOP:
+                try:
+                    json_io, production_data = await run(parse_and_serialize, pod_files)
+                except Exception as e:
+                    log.warning(f"Cannot process data for pod_id {pod_files.pod_id} - {e}")
+                    failed.append(pod_files.pod_id)
+                    continue
+                await upload_queue.put((pod_files.pod_id, pod_files.source, json_io, production_data))
+
+        async def upload():
+            while (item := await upload_queue.get()) is not _STOP:
+                pod_id, source, json_io, production_data = item
+                try:
+                    written = await run(send_json, pod_id, date, json_io, pool)
+                except Exception as e:
+                    log.warning(f"Cannot upload data for pod_id {pod_id} - {e}")
+                    failed.append(pod_id)
+                    continue
+                (uploaded if written else failed).append(pod_id)
+                if written:
+                    try:
+                        await run(archive_pod, pod_id, date, production_data, source)
+                    except Exception as e:  # the json is already sent
+                        log.warning(f"Cannot archive data of pod_id {pod_id} - {e}")
+
+        workers = [asyncio.create_task(work()) for _ in range(config.workers)]
+        uploaders = [asyncio.create_task(upload()) for _ in range(config.uploaders)]
+        await asyncio.gather(*[produce(sftp) for sftp in sessions])
+        for _ in workers:
+            await parse_queue.put(_STOP)
+        await asyncio.gather(*workers)
+        for _ in uploaders:
+            await upload_queue.put(_STOP)
+        await asyncio.gather(*uploaders)
+    finally:
+        for sftp in sessions:
+            sftp.close()
+        pool.close()
+        executor.shutdown(wait=False)
+    log.info(f"Pipeline uploaded {len(uploaded)} of {len(pod_ids)} PODs")
+    return CycleResult(uploaded=uploaded, failed=failed)
@@ -0,0 +1,252 @@
+"""
+On-demand profiling of production cycles - cProfile stats and tracemalloc top allocations of every Nth cycle, of
+cycles slower than threshold or of the next cycle after PROFILE_TRIGGER file is created (touch it on the data volume,
+no restart needed), written to PROFILES_DIR where only the newest profiles are kept
+
+Configured by "profiling" in app.json, PROFILE_* environment variables override it. cProfile profiles only the thread
+which enabled it, so every thread gets its own profiler inside metrics stages (sftp/ftp threads of pipeline and
+deadline modes) and the profilers are merged at the end of the cycle. With stages set, only code inside these
+metrics stages is profiled
+
+Only stdlib is imported here - the module is used by metrics and main.py
+"""
+import cProfile
+import datetime
+import functools
+import io
+import logging
+import os
+import pstats
+import re
+import threading
+import time
+import tracemalloc
+
+from lib import PROFILES_DIR, PROFILE_TRIGGER
+
+log = logging.getLogger(__name__)
+
+PROFILE_EVERY_ENV = "PROFILE_EVERY"
+PROFILE_THRESHOLD_ENV = "PROFILE_THRESHOLD"
+PROFILE_STAGES_ENV = "PROFILE_STAGES"
+PROFILE_FUNCTIONS_ENV = "PROFILE_FUNCTIONS"
+
+_session = None  # ProfileSession of running cycle
+_cycles = 0  # cycles started by profiled jobs of this process
+
+
+def profile_settings():
+    """
+    Profiling options of app.json with PROFILE_* environment variables applied (comma separated lists)
+    """
+    from lib.config import load_app_config, ProfilingConfig
+
+    overrides = {}
+    if os.environ.get(PROFILE_EVERY_ENV):
+        overrides["every"] = os.environ[PROFILE_EVERY_ENV]
+    if os.environ.get(PROFILE_THRESHOLD_ENV):
+        overrides["threshold"] = os.environ[PROFILE_THRESHOLD_ENV]
+    for key, env in (("stages", PROFILE_STAGES_ENV), ("functions", PROFILE_FUNCTIONS_ENV)):
+        if os.environ.get(env):
+            overrides[key] = [s.strip() for s in os.environ[env].split(",") if s.strip()]
+    config = load_app_config().profiling
+    return ProfilingConfig(**(config.model_dump() | overrides)) if overrides else config
+
+
+class ProfileSession:
+    """
+    Profilers of one cycle - one cProfile.Profile per thread, enabled while the thread is inside a profiled stage
+    (or the whole job in the cycle thread if no stages are selected)
+    """
+    def __init__(self, stages: list | None = None, memory: bool = True):
+        self.stages = frozenset(stages or ())
+        self.memory = memory
+        self.started = time.time()
+        self.duration = None
+        self.profilers = []
+        self.peak_bytes = None
+        self.snapshot = None
+        self._start = time.perf_counter()
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._tracing = False
+
+    def start(self):
+        if self.memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._tracing = True
+
+    def enter(self, stage: str | None = None) -> bool:
+        """
+        Enable profiler of current thread if stage is profiled - calls may be nested
+
+        :return: True if exit has to be called
+        """
+        if stage is not None and self.stages and stage not in self.stages:
+            return False
+        depth = getattr(self._local, "depth", 0)
+        if depth == 0:
+            profiler = cProfile.Profile()
+            with self._lock:
+                self.profilers.append(profiler)
+            self._local.profiler = profiler
+            profiler.enable()
+        self._local.depth = depth + 1
+        return True
+
+    def exit(self):
+        self._local.depth -= 1
+        if self._local.depth == 0:
+            self._local.profiler.disable()
+            self._local.profiler = None
+
+    def finish(self):
+        self.duration = time.perf_counter() - self._start
+        if self._tracing:
+            self.peak_bytes = tracemalloc.get_traced_memory()[1]
+            self.snapshot = tracemalloc.take_snapshot().filter_traces(
+                [tracemalloc.Filter(False, tracemalloc.__file__)])
+            tracemalloc.stop()
+
+    def stats(self) -> pstats.Stats | None:
+        """
+        Merged stats of all threads, None if no profiled stage was entered
+        """
+        profilers = [s for s in self.profilers if s.getstats()]
+        if not profilers:
+            return None
+        stats = pstats.Stats(profilers[0])
+        for profiler in profilers[1:]:
+            stats.add(profiler)
+        return stats
+
+
+def current() -> ProfileSession | None:
+    return _session
+
+
+def report(session: ProfileSession, reason: str, functions: list, top: int) -> str:
+    """
+    Text report - cProfile stats sorted by cumulative time (only given functions and their callees if set) and
+    tracemalloc top allocations by line
+    """
+    out = io.StringIO()
+    started = datetime.datetime.fromtimestamp(session.started, tz=datetime.timezone.utc)
+    out.write(f"cycle started {started.isoformat()}, {session.duration:.3f} s, profiled because of {reason}\n")
+    out.write(f"stages: {', '.join(sorted(session.stages)) or 'whole cycle'}, threads: {len(session.profilers)}\n\n")
+    stats = session.stats()
+    if stats is None:
+        out.write("no profiled stage was entered\n")
+    else:
+        stats.stream = out
+        stats.sort_stats(pstats.SortKey.CUMULATIVE)
+        if functions:
+            pattern = "|".join(rf"\({re.escape(s)}\)" for s in functions)
+            stats.print_stats(pattern)
+            stats.print_callees(pattern)
+        else:
+            stats.print_stats(top)
+    if session.snapshot is not None:
+        out.write(f"tracemalloc peak {session.peak_bytes / 2 ** 20:.2f} MiB, top {top} allocations by line:\n")
+        for statistic in session.snapshot.statistics("lineno")[:top]:
+            out.write(f"{statistic}\n")
+    return out.getvalue()
+
+
+def write_profile(session: ProfileSession, reason: str, functions: list, top: int, keep: int,
+                  root: str | None = None) -> str:
+    """
+    Write <UTC start>-<reason>.prof (pstats dump, e.g. for snakeviz) and .txt report, delete all but keep newest
+    profiles
+
+    :return: path of the report
+    """
+    root = root or PROFILES_DIR
+    os.makedirs(root, exist_ok=True)
+    started = datetime.datetime.fromtimestamp(session.started, tz=datetime.timezone.utc)
+    base = os.path.join(root, f"{started:%Y%m%dT%H%M%S}.{started.microsecond // 1000:03d}-{reason}")
+    stats = session.stats()
+    if stats is not None:
+        stats.dump_stats(f"{base}.prof")
+    with open(f"{base}.txt", "w") as f:
+        f.write(report(session, reason=reason, functions=functions, top=top))
+    rotate(keep, root=root)
+    return f"{base}.txt"
+
+
+def rotate(keep: int, root: str | None = None) -> list:
+    """
+    Delete files of all but keep newest profiles
+
+    :return: list of deleted paths
+    """
+    root = root or PROFILES_DIR
+    names = sorted({os.path.splitext(s)[0] for s in os.listdir(root) if s.endswith((".txt", ".prof"))})
+    removed = []
+    for name in names[:max(len(names) - keep, 0)]:
+        for extension in (".txt", ".prof"):
+            path = os.path.join(root, name + extension)
+            if os.path.exists(path):
+                os.remove(path)
+                removed.append(path)
+    return removed
+
+
+def cycle_reason(settings, cycle: int) -> str | None:
+    """
+    Why the cycle is profiled - "trigger" consumes PROFILE_TRIGGER file, "threshold" means the profile is kept only if
+    the cycle is slower than threshold, None if the cycle is not profiled
+    """
+    if os.path.exists(PROFILE_TRIGGER):
+        try:
+            os.remove(PROFILE_TRIGGER)
+        except FileNotFoundError:  # taken by other process
+            pass
+        else:
+            return "trigger"
+    if settings.every and cycle % settings.every == 0:
+        return "every"
+    if settings.threshold is not None:
+        return "threshold"
+    return None
+
+
+def profiled(job):
+    """
+    Wrap cycle job (main, main_pipeline, main_deadline) - profiles cycles selected by profile_settings and
+    PROFILE_TRIGGER, other cycles run without any overhead
+    """
+    @functools.wraps(job)
+    def run(date=None):
+        global _session, _cycles
+        _cycles += 1
+        try:
+            settings = profile_settings()
+            reason = cycle_reason(settings, _cycles)
+        except Exception as e:  # profiling never stops the cycle
+            log.warning(f"Cannot load profiling settings - {e}")
+            reason = None
+        if reason is None or _session is not None:
+            return job(date)
+
+        # tracemalloc slows cycles several times more than cProfile, threshold mode compares profiled durations
+        memory = settings.memory if settings.memory is not None else reason != "threshold"
+        session = ProfileSession(stages=settings.stages, memory=memory)
+        session.start()
+        _session = session
+        whole_cycle = session.enter() if not session.stages else False
+        try:
+            return job(date)
+        finally:
+            if whole_cycle:
+                session.exit()
+            _session = None
+            session.finish()
+            if reason != "threshold" or session.duration > settings.threshold:
+                try:
+                    path = write_profile(session, reason=reason, functions=settings.functions, top=settings.top,
+                                         keep=settings.keep)
+                    log.info(f"Cycle profile ({reason}, {session.duration:.1f} s) written to {path}")
+                except OSError as e:
+                    log.warning(f"Cannot write cycle profile - {e}")
+    return run
@@ -0,0 +1,159 @@
+import logging
+import os
+import signal
+import threading
+import time
+from typing import Callable
+
+import pandas as pd
+
+from lib import INTERVAL, budget, metrics
+from lib.config import load_app_config, SchedulerConfig
+from lib.sftp_conn import SftpConn, FtpPool, CycleResult, list_pod_ids, read_pod, upload_pod
+
+log = logging.getLogger(__name__)
+
+
+class PodOrder:
+    """
+    Processing order of PODs - slowest first by smoothed duration of previous cycles, PODs without history go first
+    so their duration is known in next cycle
+    """
+    def __init__(self, smoothing: float = 0.5):
+        self.smoothing = smoothing
+        self.durations = {}  # pod_id -> seconds
+
+    def update(self, pod_id: str, seconds: float):
+        previous = self.durations.get(pod_id)
+        self.durations[pod_id] = seconds if previous is None else previous + self.smoothing * (seconds - previous)
+
+    def sort(self, pod_ids: list) -> list:
+        return sorted(pod_ids, key=lambda s: -self.durations.get(s, float("inf")))
+
+
+pod_order = PodOrder()
+
+
+def run_cycle(date: pd.Timestamp, config: SchedulerConfig | None = None) -> CycleResult:
+    """
+    Read, serialize and upload PODs one by one, so every finished POD is shipped before the cycle deadline
+
+    Every POD may take pod_budget seconds of wall-clock time at most (less if the deadline is closer) - the limit is
+    checked between file reads and before upload (see lib.budget) and socket timeouts are shortened to the time left,
+    so the cycle ends by its deadline. A POD which fails or runs out of time is given up and sftp session is opened
+    again for the rest. PODs not started before the deadline are skipped and counted in metrics
+    """
+    config = config or load_app_config().scheduler
+    deadline = time.monotonic() + config.cycle_deadline
+    uploaded, failed, skipped = [], [], []
+    sftp = SftpConn()
+    try:
+        with FtpPool(sessions_per_host=load_app_config().ftp_sessions_per_host, timeout=config.pod_budget) as pool:
+            for pod_id in pod_order.sort(list_pod_ids(sftp)):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    skipped.append(pod_id)
+                    continue
+                sftp.timeout = min(config.pod_budget, remaining)
+                start = time.monotonic()
+                try:
+                    with budget.limit(min(config.pod_budget, remaining), on_check=session_timeout(sftp)):
+                        written = process_pod(sftp=sftp, pool=pool, pod_id=pod_id, date=date)
+                except Exception as e:
+                    log.warning(f"Cannot process pod_id {pod_id} - {e}")
+                    written = False
+                    sftp.close()
+                    sftp = SftpConn()
+                pod_order.update(pod_id, time.monotonic() - start)
+                (uploaded if written else failed).append(pod_id)
+    finally:
+        sftp.close()
+
+    metrics.count("pods_uploaded", len(uploaded))
+    metrics.count("pods_failed", len(failed))
+    metrics.count("pods_skipped_deadline", len(skipped))
+    if skipped:
+        log.warning(f"Cycle deadline {config.cycle_deadline} s reached - skipped {len(skipped)} PODs: {skipped}")
+    log.info(f"Cycle uploaded {len(uploaded)} PODs, {len(failed)} failed, {len(skipped)} skipped")
+    return CycleResult(uploaded=uploaded, failed=failed, skipped=skipped)
+
+
+def session_timeout(sftp: SftpConn) -> Callable[[float], None]:
+    """
+    Budget checkpoint callback shortening socket timeout of sftp session to the time left
+    """
+    def set_timeout(remaining: float):
+        sftp.timeout = remaining
+    return set_timeout
+
+
+def process_pod(sftp: SftpConn, pool: FtpPool, pod_id: str, date: pd.Timestamp) -> bool:
+    """
+    Read data of one POD, convert it to CEZ json and write it to target ftp
+
+    :return: True if the file was written
+    """
+    with metrics.pod(pod_id), sftp.cd(pod_id):
+        df = read_pod(sftp=sftp, pod_id=pod_id, date=date)
+    return upload_pod(pod_id=pod_id, date=date, production_data=df, pool=pool)
+
+
+def count_scheduler_event(event):
+    """
+    Scheduler listener - cycles not started because previous one still runs or started too late are counted
+    """
+    from apscheduler.events import EVENT_JOB_MAX_INSTANCES, EVENT_JOB_MISSED
+
+    if event.code == EVENT_JOB_MAX_INSTANCES:
+        log.warning(f"Cycle scheduled at {event.scheduled_run_time} skipped - previous cycle still running")
+        metrics.count("cycles_skipped_running")
+    elif event.code == EVENT_JOB_MISSED:
+        log.warning(f"Cycle scheduled at {event.scheduled_run_time} missed its start")
+        metrics.count("cycles_missed")
+
+
+def stop_on_signals() -> threading.Event:
+    """
+    Event set by SIGINT or SIGTERM - long running modes wait on it instead of being killed in the middle of a cycle
+    """
+    stop = threading.Event()
+
+    def request_stop(signum, frame):
+        log.info(f"Received signal {signal.Signals(signum).name} - exiting")
+        stop.set()
+
+    signal.signal(signal.SIGINT, request_stop)
+    signal.signal(signal.SIGTERM, request_stop)
+    return stop
+
+
+def run_scheduler(job: Callable, misfire_grace_time: int | None = None):
+    """
+    Run job every INTERVAL minutes until SIGINT or SIGTERM is received
+
+    At most one cycle runs at a time - a run coming while previous cycle is still running is skipped and missed runs
+    are coalesced into one, both counted in metrics. Main thread sleeps until a signal arrives instead of polling
+    """
+    # apscheduler is imported only here, one-shot runs (main.py --once) do not need it
+    from apscheduler.events import EVENT_JOB_MAX_INSTANCES, EVENT_JOB_MISSED
+    from apscheduler.schedulers.background import BackgroundScheduler
+    from apscheduler.triggers.cron import CronTrigger
+
+    if misfire_grace_time is None:
+        misfire_grace_time = load_app_config().scheduler.misfire_grace_time
+    stop = stop_on_signals()
+
+    scheduler = BackgroundScheduler()
+    scheduler.add_listener(count_scheduler_event, EVENT_JOB_MAX_INSTANCES | EVENT_JOB_MISSED)
+    scheduler.add_job(job, trigger=CronTrigger(minute=f'*/{INTERVAL}'), max_instances=1, coalesce=True,
+                      misfire_grace_time=misfire_grace_time)
+    scheduler.start()
+    try:
+        if os.name == "nt":  # lock waits cannot be interrupted by Ctrl+C on Windows
+            while not stop.wait(timeout=1):
+                pass
+        else:
+            stop.wait()
+    finally:
+        log.info("Waiting for running cycle to finish")
+        scheduler.shutdown()
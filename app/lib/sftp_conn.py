@@ -1,19 +1,41 @@
 import io
 import json
 import logging
+import os
+import stat
+import threading
+import time
 import warnings
 import ftplib
+from contextlib import contextmanager
+from enum import Enum
+from typing import Callable, Iterable, NamedTuple
 
 import pandas as pd
 import pysftp
-from pydantic import BaseModel, SecretStr
+from pydantic import BaseModel, Field, SecretStr
 
+from lib import metrics
 from lib import SSH_KEY_PATH, SFTP_CONFIG, LOGGER_DT_FMT, FTP_CONFIG, HUB_DT_FMT, INTERVAL, LOGGER_DT_FMT_2
-from lib.csv_reader import huawei_datalogger_csv_parser, replacement_data, handle_missing_intervals, pecom_hub_csv_parser, aggregate_hub_csvs
-from lib.json_writer import production_to_json_bytes
+from lib.config import load_app_config, ReadMode, ParserEngine
+from lib.csv_reader import HUAWEI_PARSERS, replacement_data, handle_missing_intervals, pecom_hub_csv_batch_parser, aggregate_hub_csvs, HuaweiCsvState, HubAggregator
+from lib.json_writer import JSON_SERIALIZERS, production_json_chunks
+from lib import archive, budget, mirror, np_engine, outbox, sharding, slot_reducer
+from lib.transport import TransportProfile, read_remote
 
 log = logging.getLogger(__name__)
 
+# parser state of accumulated datalogger files for incremental read mode - key is (pod_id, filename)
+huawei_csv_states = {}
+# parsed HUB files of current day - key is pod_id
+hub_file_caches = {}
+# directories on root of source sftp between cycles - key is sftp host
+root_listings = {}
+# SourceType selected by the last read of POD files, archived with sent data - key is pod_id
+pod_sources = {}
+# guards changes of the caches above - producer threads of pipeline mode read different PODs at the same time
+_caches_lock = threading.Lock()
+
 
 class FTPConfig(BaseModel):
     host: str
@@ -22,16 +44,21 @@ class FTPConfig(BaseModel):
     password: SecretStr
 
 
+class SftpConfig(FTPConfig):
+    transport: TransportProfile = Field(default_factory=TransportProfile)
+
+
 class FtpConn(ftplib.FTP):
     """
     FTP connection class
     """
-    def __init__(self, ftp_name: str):
-        with open(FTP_CONFIG) as f:
-            data = json.load(f)
+    def __init__(self, ftp_name: str, config: FTPConfig | None = None):
+        if config is None:
+            with open(FTP_CONFIG) as f:
+                data = json.load(f)
 
-        config = data[ftp_name]
-        config = FTPConfig(**config)
+            config = data[ftp_name]
+            config = FTPConfig(**config)
 
         self.host = config.host
         self.port = config.port
@@ -45,22 +72,257 @@ class FtpConn(ftplib.FTP):
         Start connection and login with configured credentials
         """
         try:
-            super().connect(host=self.host, port=self.port)
-            super().login(user=self.username, passwd=self.__password)
+            self.open_session()
         except Exception as e:
             log.warning(f"Cannot start connection to FTP - {e}")
 
-    def write_file(self, filename: str, binary_data: io.BytesIO):
+    def open_session(self):
+        """
+        Connect and login with configured credentials, errors are raised
+        """
+        super().connect(host=self.host, port=self.port)
+        super().login(user=self.username, passwd=self.__password)
+
+    def is_alive(self) -> bool:
+        """
+        Check logged-in session with NOOP command
+        """
+        try:
+            self.voidcmd("NOOP")
+            return True
+        except Exception:
+            return False
+
+    def write_file(self, filename: str, binary_data: io.BytesIO) -> bool:
         """
         Start connection, login, write file and quit connection
         """
         self.start_connection()
+        written = False
         try:
             self.storbinary(f"STOR {filename}", binary_data)
             log.info(f"Successfully created file {filename}")
+            written = True
         except Exception as e:
             log.warning(f"Cannot write file {filename} to FTP - {e}")
         self.quit()
+        return written
+
+    def write_chunks(self, filename: str, chunks: Iterable[bytes]) -> int | None:
+        """
+        Same as write_file, but file content is sent chunk by chunk as chunks are produced
+
+        :return: number of bytes sent, None if the file was not written
+        """
+        self.start_connection()
+        sent = None
+        try:
+            sent = self.store_chunks(filename, chunks)
+            log.info(f"Successfully created file {filename}")
+        except Exception as e:
+            log.warning(f"Cannot write file {filename} to FTP - {e}")
+        self.quit()
+        return sent
+
+    def store_chunks(self, filename: str, chunks: Iterable[bytes]) -> int:
+        """
+        Store file in binary mode writing every chunk straight to data connection (storbinary without file object)
+
+        :return: number of bytes sent
+        """
+        self.voidcmd("TYPE I")
+        sent = 0
+        with self.transfercmd(f"STOR {filename}") as conn:
+            for chunk in chunks:
+                conn.sendall(chunk)
+                sent += len(chunk)
+        self.voidresp()
+        return sent
+
+
+_ftp_configs = (None, {})  # (mtime of ftp config, parsed configs)
+
+
+def load_ftp_configs() -> dict:
+    """
+    Parse ftp config - parsed configs are reused until the file changes
+
+    :return: dictionary with POD as key and FTPConfig as value
+    """
+    global _ftp_configs
+    mtime = os.path.getmtime(FTP_CONFIG)
+    if _ftp_configs[0] != mtime:
+        with open(FTP_CONFIG) as f:
+            data = json.load(f)
+        _ftp_configs = (mtime, {key: FTPConfig(**value) for key, value in data.items()})
+    return _ftp_configs[1]
+
+
+class FtpPool:
+    """
+    Pool of logged-in FTP sessions - PODs sharing (host, port, username) reuse one session instead of connecting and
+    logging in for every file, number of open sessions per host (borrowed and idle of all usernames) is limited
+    """
+    def __init__(self, sessions_per_host: int = 2, timeout: float | None = None):
+        """
+        :param timeout: socket timeout of new sessions in seconds, None means global default
+        """
+        self.sessions_per_host = sessions_per_host
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._idle = {}  # (host, port, username) -> list of idle FtpConn, oldest first
+        self._host_limits = {}  # host -> BoundedSemaphore
+        self._borrowed = {}  # host -> number of borrowed sessions
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    @contextmanager
+    def session(self, pod_id: str, config: FTPConfig):
+        """
+        Borrow logged-in session for given credentials of POD - idle session is checked with NOOP, dead or failed
+        sessions are closed and never returned to the pool. Before a new session is opened, idle sessions of other
+        usernames on the host are quit if the host limit would be exceeded otherwise
+
+        Socket timeout is shortened to the time left if current thread runs under budget.limit
+        """
+        key = (config.host, config.port, config.username)
+        timeout = remaining = budget.check(f"ftp session to {config.host}")
+        if remaining is None or (self.timeout is not None and self.timeout < remaining):
+            timeout = self.timeout
+        with self._host_limit(config.host), self._borrow(config.host):
+            ftp = self._take_idle(key)
+            if ftp is not None and remaining is not None:  # data connections are opened with ftp.timeout
+                ftp.timeout = timeout
+                ftp.sock.settimeout(timeout)
+            if ftp is None:
+                self._close_extra_idle(config.host)
+                ftp = FtpConn(pod_id, config=config)
+                if timeout is not None:
+                    ftp.timeout = timeout
+                try:
+                    ftp.open_session()
+                except Exception:
+                    ftp.close()
+                    raise
+            try:
+                yield ftp
+            except Exception:
+                ftp.close()
+                raise
+            with self._lock:
+                self._idle.setdefault(key, []).append(ftp)
+
+    def write_file(self, pod_id: str, filename: str, binary_data: io.BytesIO) -> bool:
+        """
+        Write file to target ftp of POD, one reconnect is tried if the pooled session fails
+        """
+        config = self._config(pod_id)
+        if config is None:
+            return False
+        for attempt in range(2):
+            try:
+                binary_data.seek(0)
+                with self.session(pod_id, config) as ftp:
+                    ftp.storbinary(f"STOR {filename}", binary_data)
+                log.info(f"Successfully created file {filename}")
+                return True
+            except Exception as e:
+                if attempt == 0:
+                    log.info(f"FTP session for {filename} failed - reconnecting - {e}")
+                else:
+                    log.warning(f"Cannot write file {filename} to FTP - {e}")
+        return False
+
+    def write_chunks(self, pod_id: str, filename: str, chunks: Callable[[], Iterable[bytes]]) -> int | None:
+        """
+        Write file to target ftp of POD chunk by chunk, one reconnect is tried if the pooled session fails
+
+        :param chunks: function returning new iterable of file chunks - called again for retry
+        :return: number of bytes sent, None if the file was not written
+        """
+        config = self._config(pod_id)
+        if config is None:
+            return None
+        for attempt in range(2):
+            try:
+                with self.session(pod_id, config) as ftp:
+                    sent = ftp.store_chunks(filename, chunks())
+                log.info(f"Successfully created file {filename}")
+                return sent
+            except Exception as e:
+                if attempt == 0:
+                    log.info(f"FTP session for {filename} failed - reconnecting - {e}")
+                else:
+                    log.warning(f"Cannot write file {filename} to FTP - {e}")
+        return None
+
+    def close(self):
+        """
+        Quit all idle sessions
+        """
+        with self._lock:
+            sessions = [ftp for idle in self._idle.values() for ftp in idle]
+            self._idle.clear()
+        for ftp in sessions:
+            try:
+                ftp.quit()
+            except Exception:
+                ftp.close()
+
+    @staticmethod
+    def _config(pod_id: str) -> FTPConfig | None:
+        try:
+            return load_ftp_configs()[pod_id]
+        except Exception as e:
+            log.warning(f"Cannot load ftp config of pod_id {pod_id} - {e!r}")
+            return None
+
+    def _host_limit(self, host: str) -> threading.BoundedSemaphore:
+        with self._lock:
+            return self._host_limits.setdefault(host, threading.BoundedSemaphore(self.sessions_per_host))
+
+    @contextmanager
+    def _borrow(self, host: str):
+        with self._lock:
+            self._borrowed[host] = self._borrowed.get(host, 0) + 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._borrowed[host] -= 1
+
+    def _close_extra_idle(self, host: str):
+        """
+        Quit idle sessions of host (oldest of each username first) until borrowed and idle sessions fit the host limit
+        """
+        extra = []
+        with self._lock:
+            idle = [ftp for key, sessions in self._idle.items() if key[0] == host for ftp in sessions]
+            excess = self._borrowed.get(host, 0) + len(idle) - self.sessions_per_host
+            for ftp in idle[:max(excess, 0)]:
+                self._idle[(ftp.host, ftp.port, ftp.username)].remove(ftp)
+                extra.append(ftp)
+        for ftp in extra:
+            try:
+                ftp.quit()
+            except Exception:
+                ftp.close()
+
+    def _take_idle(self, key: tuple) -> FtpConn | None:
+        while True:
+            with self._lock:
+                idle = self._idle.get(key)
+                if not idle:
+                    return None
+                ftp = idle.pop()
+            if ftp.is_alive():
+                return ftp
+            log.info(f"Idle FTP session to {ftp.host} is dead - reconnecting")
+            ftp.close()
 
 
 class SftpConn(pysftp.Connection):
@@ -84,15 +346,18 @@ class SftpConn(pysftp.Connection):
         with open(SFTP_CONFIG) as f:
             data = json.load(f)
 
-        config = FTPConfig(**data)
+        config = SftpConfig(**data)
 
         self.host = config.host
         self.port = config.port
         self.username = config.username
         self.__password = config.password.get_secret_value()
+        self.transport_profile = config.transport
+        self._cnopts.compression = config.transport.compression
 
         super().__init__(host=self.host, port=self.port, username=self.username,
                          password=self.__password, cnopts=self._cnopts)
+        self.transport_profile.apply(self._transport)
 
 
 def read_last_interval(date: pd.Timestamp) -> dict:
@@ -107,94 +372,578 @@ def read_last_interval(date: pd.Timestamp) -> dict:
     """
     project_data = {}
     with SftpConn() as sftp:
-        dirs = [s for s in sftp.listdir() if sftp.isdir(s)]
-        if not dirs:
-            raise ValueError(f"No directories found on sftp {sftp.host} - cannot process and send any data")
-        with open(FTP_CONFIG) as f:
-            ftp_data = json.load(f)
-        configured_dirs = [s for s in dirs if s in ftp_data.keys()]
-        for pod_id in configured_dirs:
-            with sftp.cd(pod_id):
-                files_attrs = sftp.listdir_attr()
-                if not files_attrs:
-                    log.warning(f"No matching files for pod_id {pod_id} - using replacement data")
-                    project_data[pod_id] = replacement_data(date)
-                else:
-                    # in case project receives data from HUB and not logger, add POD ids here
-                    if pod_id == "project":
-                        utc_end = date.tz_convert("UTC").tz_localize(None) + pd.Timedelta(minutes=INTERVAL)
-                        utc_start = date.floor("1D").tz_convert("UTC").tz_localize(None)
-                        files_attrs = [s for s in files_attrs if not "min" in s.filename]
-                        latest_filenames = [s.filename for s in files_attrs if utc_start <= pd.to_datetime(s.filename.split("-", maxsplit=1)[0], format=HUB_DT_FMT) <= utc_end]
-                        if latest_filenames:
-                            df = sftp_read_and_process_hub_csv(sftp=sftp, files=latest_filenames, date=date)
-                            log.info(f"Files for pod_id {pod_id} are correct")
-                            project_data[pod_id] = df
-                        else:
-                            df = replacement_data(date)
-                            project_data[pod_id] = df
-                            log.warning(f"No data for {pod_id} - using replacement data")
-                    else:
-                        files_attrs = [s for s in files_attrs if "min" in s.filename]
-                        latest_filenames = [s.filename for s in files_attrs if date.strftime(LOGGER_DT_FMT) in s.filename or date.strftime(LOGGER_DT_FMT_2) in s.filename]
-                        if len(latest_filenames) == 1:
-                            log.info(f"File for pod_id {pod_id} is correct")
-                            df = sftp_read_and_process_csv(sftp=sftp, filename=latest_filenames[0],
-                                                           date=date)
-                            project_data[pod_id] = df
-                        elif not latest_filenames:
-                            project_data[pod_id] = replacement_data(date)
-                            log.warning(
-                                f"No data for {pod_id} - using replacement data")
-                        else:
-                            log.warning(f"Multiple matching files for {pod_id} - using file with latest time of modification")
-                            files_attr = [s for s in files_attrs if s.filename in latest_filenames]
-                            latest_file = max(files_attr, key=lambda s: s.st_mtime)
-                            df = sftp_read_and_process_csv(sftp=sftp, filename=latest_file.filename,
-                                                           date=date)
-                            project_data[pod_id] = df
+        for pod_id in list_pod_ids(sftp):
+            with metrics.pod(pod_id), sftp.cd(pod_id):
+                project_data[pod_id] = read_pod(sftp=sftp, pod_id=pod_id, date=date)
     return project_data
 
 
-def sftp_read_and_process_csv(sftp: pysftp.Connection, filename: str, date: pd.Timestamp) -> pd.DataFrame:
+def list_pod_ids(sftp: pysftp.Connection, sharded: bool = True) -> list:
+    """
+    List directories on source sftp which are configured in ftp config (directory name = POD of pvp)
+
+    :param sharded: only PODs assigned to this worker if sharding is active (see lib.sharding)
+    """
+    with metrics.stage("list"):
+        listing = root_listing(sftp)
+    if not listing.dirs:
+        raise ValueError(f"No directories found on sftp {sftp.host} - cannot process and send any data")
+    pod_ids = listing.pod_ids(load_ftp_configs())
+    shard = sharding.local_shard() if sharded else None
+    return pod_ids if shard is None else shard.select(pod_ids)
+
+
+class RootListing:
+    """
+    Directories on source sftp root and their intersection with configured PODs
+    """
+    def __init__(self, dirs: list, root_mtime: int | None):
+        self.dirs = dirs
+        self.root_mtime = root_mtime
+        self.listed_at = time.monotonic()
+        self._ftp_configs = None
+        self._pod_ids = []
+
+    def is_current(self, root_mtime: int | None, ttl: float) -> bool:
+        return root_mtime == self.root_mtime and time.monotonic() - self.listed_at < ttl
+
+    def pod_ids(self, ftp_configs: dict) -> list:
+        """
+        Configured PODs with directory on sftp - computed again only when listing or ftp config changes
+        """
+        if ftp_configs is not self._ftp_configs:
+            self._ftp_configs = ftp_configs
+            self._pod_ids = [s for s in self.dirs if s in ftp_configs]
+        return list(self._pod_ids)
+
+
+def root_listing(sftp: pysftp.Connection) -> RootListing:
+    """
+    Directories on current sftp directory from one listdir_attr call classified by st_mode
+
+    Listing is reused between cycles until root_listing_ttl from app config expires or mtime of the root changes
+    (directory was added or removed), so a cycle with valid listing costs one stat instead of listing the root
+    """
+    ttl = load_app_config().root_listing_ttl
+    root_mtime = sftp.stat(".").st_mtime if ttl > 0 else None
+    listing = root_listings.get(sftp.host)
+    if listing is None or not listing.is_current(root_mtime, ttl):
+        dirs = [s.filename for s in sftp.listdir_attr() if is_dir(sftp, s)]
+        listing = RootListing(dirs=dirs, root_mtime=root_mtime)
+        root_listings[sftp.host] = listing
+        log.info(f"Listed {len(dirs)} directories on sftp {sftp.host}")
+    return listing
+
+
+def is_dir(sftp: pysftp.Connection, file_attr) -> bool:
+    """
+    Check directory by st_mode of listing entry - only symlinks need extra stat to resolve their target
+    """
+    mode = file_attr.st_mode or 0
+    if stat.S_ISLNK(mode):
+        return sftp.isdir(file_attr.filename)
+    return stat.S_ISDIR(mode)
+
+
+class SourceType(Enum):
+    logger = 'logger'
+    hub = 'hub'
+    replacement = 'replacement'
+
+
+def select_pod_files(pod_id: str, files_attrs: list, date: pd.Timestamp) -> tuple:
+    """
+    Select files of POD directory which contain data for given date
+
+    :param files_attrs: SFTPAttributes of all files in POD directory
+    :return: tuple of SourceType and list of selected SFTPAttributes
+    """
+    if not files_attrs:
+        log.warning(f"No matching files for pod_id {pod_id} - using replacement data")
+        return SourceType.replacement, []
+
+    # in case project receives data from HUB and not logger, add POD ids here
+    if pod_id == "project":
+        utc_end = date.tz_convert("UTC").tz_localize(None) + pd.Timedelta(minutes=INTERVAL)
+        utc_start = date.floor("1D").tz_convert("UTC").tz_localize(None)
+        file_times = hub_file_times([s.filename for s in files_attrs])
+        selected = ((file_times >= utc_start) & (file_times <= utc_end)).to_numpy()
+        latest_files = [s for s, is_selected in zip(files_attrs, selected) if is_selected]
+        if latest_files:
+            log.info(f"Files for pod_id {pod_id} are correct")
+            return SourceType.hub, latest_files
+        log.warning(f"No data for {pod_id} - using replacement data")
+        return SourceType.replacement, []
+
+    files_attrs = [s for s in files_attrs if "min" in s.filename]
+    latest_files = [s for s in files_attrs if date.strftime(LOGGER_DT_FMT) in s.filename or date.strftime(LOGGER_DT_FMT_2) in s.filename]
+    if len(latest_files) == 1:
+        log.info(f"File for pod_id {pod_id} is correct")
+        return SourceType.logger, latest_files
+    elif not latest_files:
+        log.warning(f"No data for {pod_id} - using replacement data")
+        return SourceType.replacement, []
+    else:
+        log.warning(f"Multiple matching files for {pod_id} - using file with latest time of modification")
+        return SourceType.logger, [max(latest_files, key=lambda s: s.st_mtime)]
+
+
+def hub_file_times(filenames: list) -> pd.Series:
+    """
+    UTC time from names of HUB files ("YYYYmmdd HHMMSS-....csv") parsed in one pass - NaT for datalogger files
+    (containing "min") and names in other format
+    """
+    names = pd.Series(filenames, dtype=object)
+    times = pd.to_datetime(names.str.split("-", n=1).str[0], format=HUB_DT_FMT, errors="coerce")
+    times[names.str.contains("min", regex=False)] = pd.NaT
+    return times
+
+
+def read_pod(sftp: pysftp.Connection, pod_id: str, date: pd.Timestamp) -> pd.DataFrame:
+    """
+    Read and process data of one POD - sftp must be in directory of the POD
+    """
+    source, files = select_pod_files(pod_id=pod_id, files_attrs=list_pod_files(sftp), date=date)
+    with _caches_lock:
+        pod_sources[pod_id] = source
+    config = load_app_config()
+    if source == SourceType.replacement:
+        return replacement_data(date)
+    elif config.mirror.enabled:
+        pod_files = fetch_selected_files(sftp=sftp, pod_id=pod_id, source=source, files=files, date=date)
+        with metrics.stage("parse"):
+            return _parse_pod(pod_files, date)
+    elif source == SourceType.hub:
+        if config.hub_cache:
+            return sftp_read_and_process_hub_csv_cached(sftp=sftp, pod_id=pod_id, files_attrs=files, date=date)
+        return sftp_read_and_process_hub_csv(sftp=sftp, files=[s.filename for s in files], date=date)
+    elif config.huawei_read_mode == ReadMode.incremental.value:
+        return sftp_read_and_process_csv_incremental(sftp=sftp, pod_id=pod_id, file_attr=files[0], date=date)
+    return sftp_read_and_process_csv(sftp=sftp, filename=files[0].filename, date=date)
+
+
+def list_pod_files(sftp: pysftp.Connection) -> list:
+    """
+    SFTPAttributes of all files in current directory
+    """
+    budget.check("listing of POD files")
+    with metrics.stage("list"):
+        return sftp.listdir_attr()
+
+
+def huawei_parser():
+    """
+    Huawei csv parser selected by huawei_parser_engine in app config
+    """
+    return HUAWEI_PARSERS[load_app_config().huawei_parser_engine]
+
+
+def process_datalogger_csv(data: bytes, date: pd.Timestamp) -> pd.DataFrame | np_engine.Production:
+    """
+    Convert datalogger csv to interval data with configured engine - numpy and streaming engines return Production
+    arrays which serialize_pod writes without any DataFrame
+    """
+    engine = load_app_config().huawei_parser_engine
+    if engine == ParserEngine.streaming.value:
+        return slot_reducer.datalogger_production(data, date=date)
+    if engine == ParserEngine.numpy.value:
+        return np_engine.datalogger_production(data.decode('utf-8'), date=date)
+    df = huawei_parser()(io.StringIO(data.decode('utf-8')), date=date)
+    return handle_missing_intervals(df, date=date)
+
+
+def process_csv_state(state: HuaweiCsvState, date: pd.Timestamp) -> pd.DataFrame | np_engine.Production:
+    """
+    Same as process_datalogger_csv for parser state of incremental read mode
+    """
+    engine = load_app_config().huawei_parser_engine
+    if engine == ParserEngine.streaming.value:
+        return slot_reducer.csv_state_production(state, date=date)
+    if engine == ParserEngine.numpy.value:
+        return np_engine.csv_state_production(state, date=date)
+    return handle_missing_intervals(state.to_df(date=date), date=date)
+
+
+def json_serializer():
+    """
+    Production data to CEZ json serializer selected by json_serializer in app config
+    """
+    return JSON_SERIALIZERS[load_app_config().json_serializer]
+
+
+def sftp_read_and_process_csv(sftp: pysftp.Connection, filename: str, date: pd.Timestamp) -> pd.DataFrame | np_engine.Production:
     """
     Read file from sftp and convert it to DataFrame
     """
-    with sftp.open(filename, 'r') as file_handle:
-        file_buffer = io.BytesIO(file_handle.read())
-        file_buffer.seek(0)
-        decoded_file = io.StringIO(file_buffer.read().decode('utf-8'))
-        df = huawei_datalogger_csv_parser(decoded_file, date=date)
-        df = handle_missing_intervals(df, date=date)
-    return df
+    data = sftp_read_bytes(sftp=sftp, filename=filename)
+    with metrics.stage("parse"):
+        return process_datalogger_csv(data, date=date)
 
 
-def sftp_write_jsons(date: pd.Timestamp, data_dict: dict):
+def sftp_read_and_process_csv_incremental(sftp: pysftp.Connection, pod_id: str, file_attr, date: pd.Timestamp) -> pd.DataFrame | np_engine.Production:
+    """
+    Read only bytes appended to accumulated datalogger file since last cycle and merge them with cached parser state
+
+    :param file_attr: SFTPAttributes of the file from listdir_attr (filename, st_size, st_mtime)
+    """
+    state = sftp_update_csv_state(sftp=sftp, pod_id=pod_id, file_attr=file_attr)
+    with metrics.stage("parse"):
+        return process_csv_state(state, date=date)
+
+
+def sftp_update_csv_state(sftp: pysftp.Connection, pod_id: str, file_attr) -> HuaweiCsvState:
+    """
+    Feed bytes appended to accumulated datalogger file to its cached parser state
+
+    Falls back to full read if the file is new, shrank or its already read part was rewritten
+    """
+    filename = file_attr.filename
+    key = (pod_id, filename)
+    with _caches_lock:
+        for old_key in [k for k in huawei_csv_states if k[0] == pod_id and k != key]:  # file of previous day
+            del huawei_csv_states[old_key]
+        state = huawei_csv_states.get(key)
+    if state is not None and file_attr.st_size == state.offset and file_attr.st_mtime == state.mtime:
+        log.info(f"File {filename} for pod_id {pod_id} did not change - using cached data")
+        return state
+
+    budget.check(f"reading {filename}")
+    if load_app_config().mirror.enabled:  # appended bytes are downloaded to mirror and fed from there
+        opened, stage = open(mirror.sync_file(sftp, pod_id, file_attr), 'rb'), "parse"
+    else:
+        opened, stage = sftp.open(filename, 'rb'), "download"
+    with metrics.stage(stage) as timer, opened as file_handle:
+        if state is not None and file_attr.st_size >= state.offset:
+            start = state.offset - len(state.tail)
+            file_handle.seek(start)
+            data = read_remote(sftp, file_handle, size=file_attr.st_size)
+            timer.bytes += len(data)
+            if state.matches_tail(data):
+                state.feed(data[len(state.tail):])
+                log.info(f"Read {len(data) - len(state.tail)} appended bytes of {filename} for pod_id {pod_id}")
+            else:
+                log.warning(f"File {filename} for pod_id {pod_id} was rewritten - reading whole file")
+                state = None
+        elif state is not None:
+            log.warning(f"File {filename} for pod_id {pod_id} shrank - reading whole file")
+            state = None
+        if state is None:
+            state = HuaweiCsvState()
+            file_handle.seek(0)
+            data = read_remote(sftp, file_handle, size=file_attr.st_size)
+            timer.bytes += len(data)
+            state.feed(data)
+    state.mtime = file_attr.st_mtime
+    with _caches_lock:
+        huawei_csv_states[key] = state
+    return state
+
+
+def sftp_write_jsons(date: pd.Timestamp, data_dict: dict) -> "CycleResult":
     """
     Go through data dict (key is POD number and value is DataFrame with interval data - convert it to CEZ json format
-    and write all files to target ftp
+    and write all files to target ftp - PODs with the same ftp credentials share one logged-in session
+    """
+    uploaded, failed = [], []
+    with FtpPool(sessions_per_host=load_app_config().ftp_sessions_per_host) as pool:
+        for key, value in data_dict.items():
+            written = upload_pod(pod_id=key, date=date, production_data=value, pool=pool)
+            (uploaded if written else failed).append(key)
+    return CycleResult(uploaded=uploaded, failed=failed)
+
+
+def serialize_pod(pod_id: str, production_data: pd.DataFrame | np_engine.Production) -> io.BytesIO:
+    """
+    Convert interval data of one POD to CEZ json with configured serializer - Production arrays of numpy engine are
+    always written by its own serializer
     """
-    for key, value in data_dict.items():
-        json_io = production_to_json_bytes(value)
-        filename = f"{key}-{date.date()}.json"
-        json_io.seek(0)
+    with metrics.pod(pod_id), metrics.stage("serialize") as timer:
+        compact = load_app_config().json_compact
+        if isinstance(production_data, np_engine.Production):
+            json_io = production_data.to_json_bytes(compact=compact)
+        else:
+            json_io = json_serializer()(production_data, compact=compact)
+        timer.bytes = json_io.getbuffer().nbytes
+    return json_io
 
-        ftp = FtpConn(key)
-        ftp.write_file(filename=filename, binary_data=json_io)
+
+def upload_pod(pod_id: str, date: pd.Timestamp, production_data: pd.DataFrame | np_engine.Production,
+               pool: FtpPool | None = None) -> bool:
+    """
+    Serialize interval data of one POD and write it to its target ftp - streamed if json_streaming is set in app
+    config, buffered in memory otherwise
+
+    :return: True if the file was written
+    """
+    budget.check(f"upload of pod_id {pod_id}")
+    app_config = load_app_config()
+    if app_config.json_streaming and not app_config.outbox.enabled:
+        written = stream_json(pod_id=pod_id, date=date, production_data=production_data, pool=pool)
+    else:
+        json_io = serialize_pod(pod_id=pod_id, production_data=production_data)
+        written = send_json(pod_id=pod_id, date=date, json_io=json_io, pool=pool)
+    if written:
+        archive_pod(pod_id=pod_id, date=date, production_data=production_data)
+    return written
+
+
+def archive_pod(pod_id: str, date: pd.Timestamp, production_data: pd.DataFrame | np_engine.Production,
+                source: SourceType | None = None, compact: bool = True):
+    """
+    Append interval data of POD sent to target ftp (or stored to outbox) to archive if enabled in app config - a
+    failure is only logged, the json is already sent
+
+    :param source: SourceType of the data, the last one selected for the POD if None
+    :param compact: start compaction of earlier days once the first POD of a new day is archived
+    """
+    if not load_app_config().archive.enabled:
+        return
+    source = source or pod_sources.get(pod_id)
+    try:
+        with metrics.pod(pod_id), metrics.stage("archive"):
+            archive.append(pod_id=pod_id, date=date, production_data=production_data,
+                           source=source.value if source is not None else None)
+    except Exception as e:
+        log.warning(f"Cannot archive data of pod_id {pod_id} - {e}")
+        return
+    if compact:
+        archive.compact_periodically(date.date())
+
+
+def json_chunks(production_data: pd.DataFrame | np_engine.Production) -> Iterable[bytes]:
+    """
+    Validate interval data and return generator of CEZ json chunks - always the fast serializer, compact if set in app
+    config
+    """
+    compact = load_app_config().json_compact
+    if isinstance(production_data, np_engine.Production):
+        return production_data.json_chunks(compact=compact)
+    return production_json_chunks(production_data, compact=compact)
+
+
+def stream_json(pod_id: str, date: pd.Timestamp, production_data: pd.DataFrame | np_engine.Production,
+                pool: FtpPool | None = None) -> bool:
+    """
+    Encode CEZ json of one POD chunk by chunk straight into ftp data connection - the document is never held in
+    memory as a whole, serialization time is measured as part of upload stage
+
+    Data are validated before STOR is sent, invalid data raise ValueError as serialize_pod does
+
+    :return: True if the file was written
+    """
+    filename = f"{pod_id}-{date.date()}.json"
+    first = [json_chunks(production_data)]  # validated before any ftp command, retry encodes the json again
+
+    def chunks():
+        return first.pop() if first else json_chunks(production_data)
+
+    with metrics.pod(pod_id), metrics.stage("upload") as timer:
+        if pool is not None:
+            sent = pool.write_chunks(pod_id=pod_id, filename=filename, chunks=chunks)
+        else:
+            sent = FtpConn(pod_id).write_chunks(filename=filename, chunks=chunks())
+        timer.bytes = sent or 0
+        return sent is not None
+
+
+def send_json(pod_id: str, date: pd.Timestamp, json_io: io.BytesIO, pool: FtpPool | None = None) -> bool:
+    """
+    Store CEZ json of one POD to outbox if enabled in app config (uploaded by background uploader), write it to its
+    target ftp otherwise
+
+    :return: True if the file was stored or written
+    """
+    if load_app_config().outbox.enabled:
+        with metrics.pod(pod_id), metrics.stage("outbox") as timer:
+            timer.bytes = json_io.getbuffer().nbytes
+            outbox.default_outbox().put(pod_id=pod_id, date=date, json_io=json_io)
+        return True
+    return write_json(pod_id=pod_id, date=date, json_io=json_io, pool=pool)
+
+
+def write_json(pod_id: str, date: pd.Timestamp, json_io: io.BytesIO, pool: FtpPool | None = None) -> bool:
+    """
+    Write CEZ json of one POD to its target ftp - over pooled session if pool is given
+
+    :return: True if the file was written
+    """
+    filename = f"{pod_id}-{date.date()}.json"
+    json_io.seek(0)
+
+    with metrics.pod(pod_id), metrics.stage("upload") as timer:
+        timer.bytes = json_io.getbuffer().nbytes
+        if pool is not None:
+            return pool.write_file(pod_id=pod_id, filename=filename, binary_data=json_io)
+        ftp = FtpConn(pod_id)
+        return ftp.write_file(filename=filename, binary_data=json_io)
 
 
 def sftp_read_and_process_hub_csv(sftp: pysftp.Connection, files: list, date: pd.Timestamp) -> pd.DataFrame:
     """
     Some projects receive csv data from HUB, not datalogger - this code handles different source
     """
-    data = []
-    for file in files:
-        with sftp.open(file, 'r') as file_handle:
-            file_buffer = io.BytesIO(file_handle.read())
-            file_buffer.seek(0)
-            decoded_file = io.StringIO(file_buffer.read().decode('utf-8'))
-            df = pecom_hub_csv_parser(decoded_file)
-            data.append(df)
-    all_df = aggregate_hub_csvs(dfs=data, date=date)
-
-    return all_df
+    contents = {file: sftp_read_bytes(sftp=sftp, filename=file).decode('utf-8') for file in files}
+    with metrics.stage("parse"):
+        return aggregate_hub_csvs(dfs=[pecom_hub_csv_batch_parser(contents)], date=date)
+
+
+class HubFileCache:
+    """
+    Parsed HUB files of one POD for one day - file is downloaded again only if its name, size or mtime changes
+    """
+    def __init__(self, day: pd.Timestamp):
+        self.day = day
+        self.signatures = {}  # filename -> (st_size, st_mtime)
+        self.aggregator = HubAggregator()
+
+    def is_current(self, file_attr) -> bool:
+        return self.signatures.get(file_attr.filename) == (file_attr.st_size, file_attr.st_mtime)
+
+    def add(self, file_attr, df: pd.DataFrame):
+        self.signatures[file_attr.filename] = (file_attr.st_size, file_attr.st_mtime)
+        self.aggregator.add(file_attr.filename, df)
+
+    def add_batch(self, files_attrs: list, contents: dict):
+        """
+        Parse downloaded files (filename -> bytes) in one batch and add them to the cache
+        """
+        for file_attr in files_attrs:
+            self.signatures[file_attr.filename] = (file_attr.st_size, file_attr.st_mtime)
+        batch = pecom_hub_csv_batch_parser({name: data.decode('utf-8') for name, data in contents.items()})
+        self.aggregator.add_batch([s.filename for s in files_attrs], batch)
+
+    def retain(self, filenames: set):
+        """
+        Forget files which are no longer selected for the day
+        """
+        for filename in [s for s in self.signatures if s not in filenames]:
+            del self.signatures[filename]
+            self.aggregator.remove(filename)
+
+
+def hub_file_cache(pod_id: str, date: pd.Timestamp, files_attrs: list) -> HubFileCache:
+    """
+    Get HUB file cache of POD for day of given date, files not in files_attrs are dropped from the cache
+    """
+    day = date.floor("1D")
+    with _caches_lock:
+        cache = hub_file_caches.get(pod_id)
+        if cache is None or cache.day != day:
+            cache = HubFileCache(day)
+            hub_file_caches[pod_id] = cache
+    cache.retain({s.filename for s in files_attrs})
+    return cache
+
+
+def sftp_read_and_process_hub_csv_cached(sftp: pysftp.Connection, pod_id: str, files_attrs: list, date: pd.Timestamp) -> pd.DataFrame:
+    """
+    Same as sftp_read_and_process_hub_csv, but only files not seen in previous cycles are downloaded and parsed
+
+    :param files_attrs: SFTPAttributes of selected HUB files (filename, st_size, st_mtime)
+    """
+    cache = hub_file_cache(pod_id=pod_id, date=date, files_attrs=files_attrs)
+    new_files = [s for s in files_attrs if not cache.is_current(s)]
+    contents = {s.filename: sftp_read_bytes(sftp=sftp, filename=s.filename, size=s.st_size) for s in new_files}
+    with metrics.stage("parse"):
+        cache.add_batch(new_files, contents)
+    log.info(f"Read {len(new_files)} new HUB files of {len(files_attrs)} for pod_id {pod_id}")
+
+    with metrics.stage("parse"):
+        return cache.aggregator.to_df(date=date)
+
+
+def sftp_read_bytes(sftp: pysftp.Connection, filename: str, size: int | None = None) -> bytes:
+    """
+    Read whole file from sftp
+
+    :param size: file size from listing if known (used by prefetch)
+    """
+    budget.check(f"reading {filename}")
+    with metrics.stage("download") as timer, sftp.open(filename, 'r') as file_handle:
+        data = read_remote(sftp, file_handle, size=size)
+        timer.bytes = len(data)
+    return data
+
+
+class CycleResult(NamedTuple):
+    """
+    Outcome of one cycle
+    """
+    uploaded: list  # PODs whose json was written to ftp
+    failed: list  # PODs whose read, serialization or upload failed
+    skipped: list | tuple = ()  # PODs not started before cycle deadline, immutable default
+
+
+class PodFiles(NamedTuple):
+    """
+    Raw data of one POD downloaded from sftp - result of fetch_pod, input of parse_pod
+    """
+    pod_id: str
+    source: SourceType
+    files: list  # selected SFTPAttributes
+    contents: dict  # filename -> bytes of downloaded files
+    state: HuaweiCsvState | None = None  # parser state of accumulated datalogger file in incremental mode
+
+
+def fetch_pod(sftp: pysftp.Connection, pod_id: str, date: pd.Timestamp) -> PodFiles:
+    """
+    Download files of one POD without parsing them - same file selection and caching as read_pod
+    """
+    with metrics.pod(pod_id), sftp.cd(pod_id):
+        source, files = select_pod_files(pod_id=pod_id, files_attrs=list_pod_files(sftp), date=date)
+        with _caches_lock:
+            pod_sources[pod_id] = source
+        return fetch_selected_files(sftp=sftp, pod_id=pod_id, source=source, files=files, date=date)
+
+
+def fetch_selected_files(sftp: pysftp.Connection, pod_id: str, source: SourceType, files: list,
+                         date: pd.Timestamp) -> PodFiles:
+    """
+    Download files chosen by select_pod_files - sftp must be in directory of the POD
+    """
+    config = load_app_config()
+    if config.mirror.enabled:
+        mirror.evict_periodically(config.mirror.retention_days)
+    if source == SourceType.logger and config.huawei_read_mode == ReadMode.incremental.value:
+        state = sftp_update_csv_state(sftp=sftp, pod_id=pod_id, file_attr=files[0])
+        return PodFiles(pod_id=pod_id, source=source, files=files, contents={}, state=state)
+    if source == SourceType.hub and config.hub_cache:
+        cache = hub_file_cache(pod_id=pod_id, date=date, files_attrs=files)
+        to_read = [s for s in files if not cache.is_current(s)]
+    else:
+        to_read = files
+    contents = {s.filename: read_source_file(sftp=sftp, pod_id=pod_id, file_attr=s) for s in to_read}
+    return PodFiles(pod_id=pod_id, source=source, files=files, contents=contents)
+
+
+def read_source_file(sftp: pysftp.Connection, pod_id: str, file_attr) -> bytes:
+    """
+    Read one POD file - through local mirror if enabled in app config, straight from sftp otherwise
+    """
+    if load_app_config().mirror.enabled:
+        return mirror.read_file(sftp, pod_id, file_attr)
+    return sftp_read_bytes(sftp=sftp, filename=file_attr.filename, size=file_attr.st_size)
+
+
+def parse_pod(pod_files: PodFiles, date: pd.Timestamp) -> pd.DataFrame:
+    """
+    Convert raw data of one POD downloaded by fetch_pod to DataFrame with interval data
+    """
+    with metrics.pod(pod_files.pod_id), metrics.stage("parse"):
+        return _parse_pod(pod_files, date)
+
+
+def _parse_pod(pod_files: PodFiles, date: pd.Timestamp) -> pd.DataFrame:
+    if pod_files.source == SourceType.replacement:
+        return replacement_data(date)
+    if pod_files.source == SourceType.logger:
+        if pod_files.state is not None:
+            return process_csv_state(pod_files.state, date=date)
+        return process_datalogger_csv(pod_files.contents[pod_files.files[0].filename], date=date)
+
+    if load_app_config().hub_cache:
+        cache = hub_file_caches[pod_files.pod_id]
+        cache.add_batch([s for s in pod_files.files if s.filename in pod_files.contents], pod_files.contents)
+        return cache.aggregator.to_df(date=date)
+    contents = {name: data.decode('utf-8') for name, data in pod_files.contents.items()}
+    return aggregate_hub_csvs(dfs=[pecom_hub_csv_batch_parser(contents)], date=date)
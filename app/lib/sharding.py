@@ -0,0 +1,189 @@
+"""
+Sharded deployment - several worker instances share the PODs of ftp.json, every worker processes PODs which
+consistent hashing assigns to it among live workers
+
+Workers announce themselves by lease files on the shared data volume (LEASES_DIR/<worker id>.lease) renewed by
+a heartbeat thread, a worker whose lease is older than lease_ttl is considered dead and its PODs move to survivors.
+Only PODs of the dead worker move (and move back when it returns), no external coordinator is needed. Sharding is
+active when WORKER_ID environment variable is set
+"""
+import atexit
+import bisect
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+from lib import LEASES_DIR
+from lib.config import load_app_config, ShardingConfig
+
+log = logging.getLogger(__name__)
+
+WORKER_ID_ENV = "WORKER_ID"
+
+
+def worker_id() -> str | None:
+    """
+    Id of this worker, None if sharding is not active
+    """
+    return os.environ.get(WORKER_ID_ENV) or None
+
+
+def ring_hash(key: str) -> int:
+    """
+    Stable across processes and platforms (built-in hash of str is randomized per process)
+    """
+    return int.from_bytes(hashlib.sha1(key.encode("utf-8")).digest()[:8], "big")
+
+
+class HashRing:
+    """
+    Consistent hash ring - every worker is placed on the ring replicas times, POD belongs to the first worker point
+    clockwise from hash of POD id
+    """
+    def __init__(self, workers: list, replicas: int = 64):
+        points = sorted((ring_hash(f"{worker}#{i}"), worker) for worker in set(workers) for i in range(replicas))
+        self._hashes = [s[0] for s in points]
+        self._workers = [s[1] for s in points]
+
+    def owner(self, key: str) -> str | None:
+        if not self._hashes:
+            return None
+        position = bisect.bisect(self._hashes, ring_hash(key)) % len(self._hashes)
+        return self._workers[position]
+
+
+class Lease:
+    """
+    Lease file of one worker - renewed by heartbeat thread, removed on exit so survivors take over immediately
+    """
+    def __init__(self, worker: str, root: str | None = None):
+        self.worker = worker
+        self.root = root or LEASES_DIR
+        self.path = os.path.join(self.root, f"{worker}.lease")
+
+    def renew(self, now: float | None = None):
+        """
+        Write lease with current time - temporary file replaced atomically, readers never see partial lease
+        """
+        os.makedirs(self.root, exist_ok=True)
+        tmp_path = f"{self.path}.{os.getpid()}.part"
+        with open(tmp_path, 'w') as f:
+            json.dump({"worker": self.worker, "heartbeat": time.time() if now is None else now,
+                       "pid": os.getpid()}, f)
+        os.replace(tmp_path, self.path)
+
+    def release(self):
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+
+def live_workers(ttl: float, root: str | None = None, now: float | None = None) -> list:
+    """
+    Workers whose lease was renewed within ttl seconds - unreadable leases (e.g. being replaced) are skipped
+    """
+    root = root or LEASES_DIR
+    now = time.time() if now is None else now
+    if not os.path.isdir(root):
+        return []
+    workers = []
+    for filename in os.listdir(root):
+        if not filename.endswith(".lease"):
+            continue
+        try:
+            with open(os.path.join(root, filename)) as f:
+                lease = json.load(f)
+        except (OSError, ValueError):
+            continue
+        if now - lease["heartbeat"] <= ttl:
+            workers.append(lease["worker"])
+    return sorted(workers)
+
+
+class Shard:
+    """
+    PODs of this worker - the ring is built again from live leases on every call, so takeover happens in the first
+    cycle after lease of dead worker expires
+    """
+    def __init__(self, worker: str, config: ShardingConfig | None = None, root: str | None = None):
+        self.worker = worker
+        self.config = config or load_app_config().sharding
+        self.root = root or LEASES_DIR
+        self.lease = Lease(worker, root=self.root)
+        self._assigned = None  # PODs of last call, for logging of changes
+        self._stop = threading.Event()
+        self._heartbeat = None
+
+    def start(self):
+        """
+        Write lease and start heartbeat thread renewing it every third of lease_ttl
+        """
+        self.lease.renew()
+        self._heartbeat = threading.Thread(target=self._renew_periodically, name="lease-heartbeat", daemon=True)
+        self._heartbeat.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._heartbeat is not None:
+            self._heartbeat.join(timeout=5)
+        self.lease.release()
+
+    def _renew_periodically(self):
+        while not self._stop.wait(self.config.lease_ttl / 3):
+            try:
+                self.lease.renew()
+            except OSError as e:
+                log.warning(f"Cannot renew lease of worker {self.worker} - {e}")
+
+    def live_workers(self, now: float | None = None) -> list:
+        """
+        Workers with live lease - this worker always counts as live
+        """
+        workers = live_workers(self.config.lease_ttl, root=self.root, now=now)
+        if self.worker not in workers:
+            workers.append(self.worker)
+        return workers
+
+    def owned(self, pod_ids: list, now: float | None = None) -> list:
+        """
+        PODs owned by this worker among live workers
+        """
+        ring = HashRing(self.live_workers(now=now), replicas=self.config.replicas)
+        return [s for s in pod_ids if ring.owner(s) == self.worker]
+
+    def select(self, pod_ids: list, now: float | None = None) -> list:
+        """
+        Same as owned, change of assigned PODs is logged - called by cycles
+        """
+        workers = self.live_workers(now=now)
+        ring = HashRing(workers, replicas=self.config.replicas)
+        assigned = [s for s in pod_ids if ring.owner(s) == self.worker]
+        if assigned != self._assigned:
+            log.info(f"Worker {self.worker} owns {len(assigned)} of {len(pod_ids)} PODs, live workers {sorted(workers)}")
+            self._assigned = assigned
+        return assigned
+
+
+_shard = None
+_shard_lock = threading.Lock()
+
+
+def local_shard() -> Shard | None:
+    """
+    Shard of this process if WORKER_ID is set - lease is written and heartbeat started by first call, lease is
+    released at interpreter exit
+    """
+    global _shard
+    worker = worker_id()
+    if worker is None:
+        return None
+    with _shard_lock:
+        if _shard is None:
+            _shard = Shard(worker)
+            _shard.start()
+            atexit.register(_shard.stop)
+    return _shard
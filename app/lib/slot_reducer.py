@@ -0,0 +1,191 @@
+"""
+Streaming datalogger-to-json path with memory independent of number of inverters - the file is read line by line
+once and every row is added right away to running E-Day sum of its 5 minute slot in fixed-size array of the day
+
+Output is the same json as the numpy engine (lib.np_engine) - Kahan summation in file order as pandas groupby sum,
+autumn DST ambiguous times resolved per inverter block (rows of ambiguous hour are held until the block ends)
+"""
+import csv
+import datetime
+import io
+from typing import Iterable
+from zoneinfo import ZoneInfo
+
+import numpy as np
+
+from lib import TIMEZONE
+from lib.np_engine import TIMESTAMP_COL, E_DAY_COL, SLOT, Production, day_slots, local_offsets, sums_to_production
+
+_EPOCH = datetime.datetime(1970, 1, 1)
+_ZONE = ZoneInfo(TIMEZONE)
+
+
+class DaySlotReducer:
+    """
+    Running per-timestamp E-Day sums of one local day - slots of the day are kept in lists of fixed size, timestamps
+    off the 5 minute grid or outside the day (not expected in datalogger files) in a dict
+    """
+    def __init__(self, date: datetime.datetime):
+        local = date.astimezone(_ZONE) if date.tzinfo is not None else date.replace(tzinfo=_ZONE)
+        day = local.date()
+        self.day_start = int(datetime.datetime(day.year, day.month, day.day, tzinfo=_ZONE).timestamp())
+        next_day = day + datetime.timedelta(days=1)
+        day_end = int(datetime.datetime(next_day.year, next_day.month, next_day.day, tzinfo=_ZONE).timestamp())
+        size = (day_end - self.day_start) // SLOT
+        self.sums = [0.0] * size
+        self.compensations = [0.0] * size
+        self.present = bytearray(size)
+        self.extra = {}  # UTC epoch seconds -> [sum, compensation]
+        self.has_blocks = False  # False if the file had no rows at all
+        self._local_seconds = {}  # time string -> naive local epoch seconds
+        self._offsets = {}  # naive local epoch seconds -> (offset at fold 0, offset at fold 1)
+        self._time_lengths = set()
+        self._block_first = None  # local seconds of first and last row of current block
+        self._block_last = None
+        self._ambiguous = []  # (local seconds, E-Day) of current block, resolved by end_block
+
+    def feed_lines(self, lines: Iterable[str]):
+        """
+        Add rows of Huawei csv lines - header line of inverter block contains #Time, other lines with # are comments,
+        blocks without #Time and E-Day columns are skipped
+        """
+        time_index = e_day_index = None
+        in_block = False
+        for line in lines:
+            if "#" in line:
+                if TIMESTAMP_COL in line:
+                    self.end_block()
+                    header = next(csv.reader([line], delimiter=';'))
+                    in_block = self.has_blocks = True
+                    if TIMESTAMP_COL in header and E_DAY_COL in header:
+                        time_index, e_day_index = header.index(TIMESTAMP_COL), header.index(E_DAY_COL)
+                    else:
+                        time_index = e_day_index = None
+                continue
+            if not in_block:  # lines before first header form a block without #Time column
+                self.has_blocks = True
+                continue
+            if time_index is None:
+                continue
+            row = line.rstrip("\r\n").split(";") if '"' not in line else next(csv.reader([line], delimiter=';'))
+            if len(row) > time_index:
+                self.add(row[time_index], row[e_day_index] if len(row) > e_day_index else None)
+        self.end_block()
+
+    def feed_state(self, state):
+        """
+        Add rows kept by HuaweiCsvState of incremental read mode
+        """
+        for block, projection in zip(*state.projected_blocks()):
+            if not block:
+                continue
+            self.has_blocks = True
+            if projection is not None:
+                for time, e_day in block[1:]:
+                    if time is not None:
+                        self.add(time, e_day)
+            self.end_block()
+
+    def add(self, time: str, e_day: str | None):
+        """
+        Add one row of current inverter block
+        """
+        local = self._local_seconds.get(time)
+        if local is None:
+            local = self._local_seconds[time] = self._parse_local(time)
+        if self._block_first is None:
+            self._block_first = local
+        self._block_last = local
+        value = float("nan") if e_day is None else float(e_day)
+        offsets = self._offsets.get(local)
+        if offsets is None:
+            offsets = self._offsets[local] = local_offsets(local)
+        if offsets[0] != offsets[1]:
+            self._ambiguous.append((local, value))
+            return
+        self._accumulate(local - offsets[0], value)
+
+    def end_block(self):
+        """
+        Resolve ambiguous rows of finished block - summer time at first occurrence of a local time if the block is in
+        ascending order, at second one if it is newest row first (as np_engine.local_to_utc)
+        """
+        if self._ambiguous:
+            descending = self._block_last < self._block_first
+            seen = set()
+            for local, value in self._ambiguous:
+                fold = int((local in seen) != descending)
+                seen.add(local)
+                self._accumulate(local - self._offsets[local][fold], value)
+            self._ambiguous = []
+        self._block_first = self._block_last = None
+
+    def _parse_local(self, time: str) -> int:
+        self._time_lengths.add(len(time))
+        if len(time) == 17:
+            time = f"20{time}"
+        elif len(time) != 19:
+            raise ValueError(f"Invalid {TIMESTAMP_COL} values in datalogger data")
+        if len(self._time_lengths) > 1:
+            raise ValueError(f"Invalid {TIMESTAMP_COL} values in datalogger data")
+        return int((datetime.datetime.fromisoformat(time) - _EPOCH).total_seconds())
+
+    def _accumulate(self, utc: int, value: float):
+        """
+        Kahan summation of one value (NaN skipped) - same operations as np_engine.grouped_kahan_sum
+        """
+        slot, remainder = divmod(utc - self.day_start, SLOT)
+        if remainder == 0 and 0 <= slot < len(self.sums):
+            self.present[slot] = 1
+            if value != value:
+                return
+            total, compensation = self.sums[slot], self.compensations[slot]
+        else:
+            entry = self.extra.setdefault(utc, [0.0, 0.0])
+            if value != value:
+                return
+            total, compensation = entry
+        y = value - compensation
+        t = total + y
+        compensation = (t - total) - y
+        if compensation != compensation:
+            compensation = 0.0
+        if remainder == 0 and 0 <= slot < len(self.sums):
+            self.sums[slot], self.compensations[slot] = t, compensation
+        else:
+            self.extra[utc] = [t, compensation]
+
+    def production(self, date: datetime.datetime) -> Production:
+        """
+        Interval production of the day until date
+        """
+        slots = day_slots(date)
+        if not self.has_blocks:  # no data at all - first interval is sent as measured zero (as pandas engine does)
+            valid = np.zeros(len(slots), dtype=bool)
+            valid[:1] = True
+            return Production(start=slots, quantity=np.zeros(len(slots)), valid=valid)
+        present = np.flatnonzero(np.frombuffer(self.present, dtype=np.uint8))
+        keys = np.concatenate((self.day_start + present.astype(np.int64) * SLOT,
+                               np.fromiter(self.extra, dtype=np.int64, count=len(self.extra))))
+        sums = np.concatenate((np.asarray(self.sums)[present], [s[0] for s in self.extra.values()]))
+        order = np.argsort(keys, kind="stable")
+        return sums_to_production(keys[order], sums[order], slots)
+
+
+def datalogger_production(data: bytes, date: datetime.datetime) -> Production:
+    """
+    Interval production of the day until date from Huawei datalogger csv - decoded and reduced line by line, the text
+    and rows of the file are never held as a whole
+    """
+    reducer = DaySlotReducer(date)
+    reducer.feed_lines(io.TextIOWrapper(io.BytesIO(data), encoding="utf-8"))
+    return reducer.production(date)
+
+
+def csv_state_production(state, date: datetime.datetime) -> Production:
+    """
+    Interval production of the day until date from HuaweiCsvState of incremental read mode
+    """
+    reducer = DaySlotReducer(date)
+    reducer.feed_state(state)
+    return reducer.production(date)
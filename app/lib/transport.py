@@ -0,0 +1,42 @@
+"""
+SSH transport profile of source sftp session - "transport" object of sftp.json
+
+    {"host": ..., "transport": {"compression": true, "window_size": 8388608, "prefetch": true}}
+
+CSV text compresses several times, so compression saves most of the bytes on a slow WAN link, larger window lets
+more data be in flight before the server waits for window adjust, prefetch sends read requests of the whole file at
+once instead of one round trip per 8 KiB read (paramiko read of whole file)
+"""
+from pydantic import BaseModel, ConfigDict, Field
+
+
+class TransportProfile(BaseModel):
+    model_config = ConfigDict(extra='forbid')
+
+    compression: bool = False  # zlib compression of ssh transport (used only if server supports it)
+    window_size: int | None = Field(default=None, ge=32768)  # bytes, None = paramiko default 2 MiB
+    max_packet_size: int | None = Field(default=None, ge=4096)  # bytes, None = paramiko default 32 KiB
+    prefetch: bool = False  # pipelined read requests when whole file (or its rest) is downloaded
+    prefetch_requests: int | None = Field(default=None, ge=1)  # max concurrent prefetch requests, None = unlimited
+
+    def apply(self, transport):
+        """
+        Set window and packet size of channels opened later on paramiko Transport (sftp channel is opened lazily by
+        first sftp operation) - compression has to be set before connect, see SftpConn
+        """
+        if self.window_size is not None:
+            transport.default_window_size = self.window_size
+        if self.max_packet_size is not None:
+            transport.default_max_packet_size = self.max_packet_size
+
+
+def read_remote(sftp, file_handle, size: int | None = None) -> bytes:
+    """
+    Read the rest of file opened on sftp - prefetched if enabled in transport profile of the session
+
+    :param size: file size from listing, saves stat of the file before prefetch
+    """
+    profile = getattr(sftp, "transport_profile", None)
+    if isinstance(profile, TransportProfile) and profile.prefetch and hasattr(file_handle, "prefetch"):
+        file_handle.prefetch(file_size=size, max_concurrent_requests=profile.prefetch_requests)
+    return file_handle.read()
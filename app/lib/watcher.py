@@ -0,0 +1,161 @@
+import logging
+import time
+import zlib
+
+import pandas as pd
+
+from lib import INTERVAL, TIMEZONE, metrics
+from lib.config import load_app_config, WatcherConfig
+from lib.scheduler import process_pod, stop_on_signals
+from lib.sftp_conn import SftpConn, FtpPool, CycleResult, list_pod_ids, list_pod_files
+
+log = logging.getLogger(__name__)
+
+
+class PodWatch:
+    """
+    What the watcher knows about one POD directory
+    """
+    def __init__(self, signature: frozenset):
+        self.signature = signature  # (filename, size, mtime) of all files in the directory
+        self.changed_at = None  # monotonic time of last change not processed yet
+        self.pending_since = None  # monotonic time of first change not processed yet
+        self.processed_at = None  # monotonic time of last processing (successful or not)
+        self.sent_date = None  # interval date of last uploaded json
+
+
+class Watcher:
+    """
+    Change-driven processing - POD directories are listed every poll_period and a POD is parsed and uploaded when its
+    files change, instead of all PODs at once every INTERVAL minutes
+
+    A changed POD waits until its files are quiet for debounce seconds (or changes are pending longer than
+    min_upload_interval), one POD is never uploaded more often than once per min_upload_interval. PODs which did not
+    change are still sent once per interval as in scheduled mode, spread over force_spread seconds after interval
+    start by a stable hash of POD id
+    """
+    def __init__(self, config: WatcherConfig | None = None, pool: FtpPool | None = None):
+        self.config = config or load_app_config().watcher
+        self.pool = pool
+        self.pods = {}  # pod_id -> PodWatch
+        self.sftp = None
+
+    def observe(self, pod_id: str, files_attrs: list, t: float):
+        """
+        Record listing of POD directory taken at monotonic time t
+        """
+        signature = frozenset((s.filename, s.st_size, s.st_mtime) for s in files_attrs)
+        watch = self.pods.get(pod_id)
+        if watch is None:  # first listing - sent by interval rule, spread after start
+            self.pods[pod_id] = PodWatch(signature)
+        elif signature != watch.signature:
+            watch.signature = signature
+            watch.changed_at = t
+            if watch.pending_since is None:
+                watch.pending_since = t
+
+    def due_date(self, pod_id: str, t: float, now: pd.Timestamp) -> pd.Timestamp | None:
+        """
+        Interval date POD should be processed with now, None if it is not due
+
+        Changed POD is sent with current interval (its newest rows included as soon as they land), POD not sent for
+        the last finished interval is sent with it as scheduled mode would
+        """
+        config = self.config
+        watch = self.pods[pod_id]
+        if watch.processed_at is not None and t - watch.processed_at < config.min_upload_interval:
+            return None
+        current = now.floor(f"{INTERVAL}min")
+        if watch.changed_at is not None and (t - watch.changed_at >= config.debounce or
+                                             t - watch.pending_since >= config.min_upload_interval):
+            return current
+        last = current - pd.Timedelta(minutes=INTERVAL)
+        if (watch.sent_date is None or watch.sent_date < last) and \
+                (now - current).total_seconds() >= self.spread_offset(pod_id):
+            return last
+        return None
+
+    def spread_offset(self, pod_id: str) -> float:
+        """
+        Seconds after interval start when unchanged POD is due - stable across restarts
+        """
+        if self.config.force_spread <= 0:
+            return 0.0
+        return zlib.crc32(pod_id.encode()) % 1000 / 1000 * self.config.force_spread
+
+    def processed(self, pod_id: str, t: float, date: pd.Timestamp, written: bool):
+        watch = self.pods[pod_id]
+        watch.processed_at = t
+        if written:
+            watch.changed_at = watch.pending_since = None
+            watch.sent_date = date
+
+    def retain(self, pod_ids: list):
+        """
+        Forget PODs whose directory disappeared
+        """
+        for pod_id in set(self.pods) - set(pod_ids):
+            del self.pods[pod_id]
+
+    def poll(self, t: float | None = None, now: pd.Timestamp | None = None) -> CycleResult:
+        """
+        List all POD directories once and process PODs which are due - processing is recorded as one metrics cycle
+        """
+        t = time.monotonic() if t is None else t
+        now = pd.Timestamp.now(tz=TIMEZONE) if now is None else now
+        if self.sftp is None:
+            self.sftp = SftpConn()
+        pod_ids = list_pod_ids(self.sftp)
+        self.retain(pod_ids)
+        due = []
+        for pod_id in pod_ids:
+            with metrics.pod(pod_id), self.sftp.cd(pod_id):
+                self.observe(pod_id, list_pod_files(self.sftp), t)
+            date = self.due_date(pod_id, t, now)
+            if date is not None:
+                due.append((pod_id, date))
+        if not due:
+            return CycleResult(uploaded=[], failed=[])
+
+        uploaded, failed = [], []
+        with metrics.cycle(date=now.floor(f"{INTERVAL}min")):
+            for pod_id, date in due:
+                changed = self.pods[pod_id].changed_at is not None
+                metrics.count("watch_changed" if changed else "watch_interval")
+                try:
+                    written = process_pod(sftp=self.sftp, pool=self.pool, pod_id=pod_id, date=date)
+                except Exception as e:
+                    log.warning(f"Cannot process pod_id {pod_id} - {e}")
+                    written = False
+                    self.close()
+                    self.sftp = SftpConn()
+                self.processed(pod_id, t, date, written)
+                (uploaded if written else failed).append(pod_id)
+        log.info(f"Watch uploaded {len(uploaded)} PODs, {len(failed)} failed")
+        return CycleResult(uploaded=uploaded, failed=failed)
+
+    def close(self):
+        if self.sftp is not None:
+            self.sftp.close()
+            self.sftp = None
+
+
+def run_watcher(config: WatcherConfig | None = None):
+    """
+    Poll POD directories every poll_period seconds until SIGINT or SIGTERM is received
+    """
+    config = config or load_app_config().watcher
+    stop = stop_on_signals()
+    with FtpPool(sessions_per_host=load_app_config().ftp_sessions_per_host) as pool:
+        watcher = Watcher(config=config, pool=pool)
+        try:
+            while not stop.is_set():
+                start = time.monotonic()
+                try:
+                    watcher.poll()
+                except Exception as e:
+                    log.warning(f"Watch poll failed - {e}")
+                    watcher.close()
+                stop.wait(max(config.poll_period - (time.monotonic() - start), 0))
+        finally:
+            watcher.close()
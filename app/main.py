@@ -1,29 +1,108 @@
+import argparse
+import datetime
 import logging
 import os
 import sys
-import time
 from logging.handlers import RotatingFileHandler
 
-from apscheduler.schedulers.background import BackgroundScheduler
-from apscheduler.triggers.cron import CronTrigger
-
-from lib import LOGS_DIR, INTERVAL
-from lib.csv_reader import last_interval_date
-from lib.sftp_conn import read_last_interval, sftp_write_jsons
+# only stdlib and lib constants are imported here - pandas, pydantic, pysftp and apscheduler are imported by the
+# functions which need them, so one-shot runs (--once) load only the modules of the selected cycle
+from lib import LOGS_DIR
 
 log = logging.getLogger(__name__)
 
 logging_filename = os.path.splitext(os.path.basename(__file__))[0]
 logging_file = os.path.join(LOGS_DIR, f'log_{logging_filename}.log')
 
+# exit codes of one-shot run
+EXIT_OK = 0  # all PODs uploaded
+EXIT_PODS_FAILED = 1  # cycle finished, some PODs failed or were skipped
+EXIT_CYCLE_FAILED = 2  # cycle did not finish (e.g. source sftp unreachable)
+
+
+def main(date=None):
+    from lib import metrics
+    from lib.csv_reader import last_interval_date
+    from lib.sftp_conn import read_last_interval, sftp_write_jsons
+
+    date = date or last_interval_date()
+    with metrics.cycle(date=date):
+        data = read_last_interval(date=date)
+        return sftp_write_jsons(date=date, data_dict=data)
+
+
+def main_pipeline(date=None):
+    """
+    Same cycle as main, but sftp reads, parsing and ftp uploads of different PODs overlap (see app.json pipeline)
+    """
+    import asyncio
+    from lib import metrics
+    from lib.csv_reader import last_interval_date
+    from lib.pipeline import run_pipeline
+
+    date = date or last_interval_date()
+    with metrics.cycle(date=date):
+        return asyncio.run(run_pipeline(date=date))
+
+
+def main_deadline(date=None):
+    """
+    Same cycle as main, but PODs are uploaded one by one (slowest first) within cycle deadline and per-POD time budget
+    (see app.json scheduler)
+    """
+    from lib import metrics
+    from lib.csv_reader import last_interval_date
+    from lib.scheduler import run_cycle
 
-def main():
-    date = last_interval_date()
-    data = read_last_interval(date=date)
-    sftp_write_jsons(date=date, data_dict=data)
+    date = date or last_interval_date()
+    with metrics.cycle(date=date):
+        return run_cycle(date=date)
+
+
+def run_once(job, date: str | None = None) -> int:
+    """
+    Run exactly one cycle - for system cron or container jobs instead of the scheduler
+
+    :param date: local time of the interval to send (e.g. "2024-03-04 10:00"), last finished interval if None
+    :return: exit code
+    """
+    try:
+        if date is not None:
+            from lib.csv_reader import interval_date
+            date = interval_date(date)
+        result = job(date)
+    except Exception:
+        log.exception("Cycle failed")
+        return EXIT_CYCLE_FAILED
+    if result.failed or result.skipped:
+        log.warning(f"Cycle finished - {len(result.failed)} PODs failed, {len(result.skipped)} skipped")
+        return EXIT_PODS_FAILED
+    return EXIT_OK
 
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Send interval data from Huawei dataloggers to CEZ ftp")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument("--pipeline", action="store_true", help="run cycles as asyncio pipeline")
+    mode.add_argument("--deadline", action="store_true", help="upload PODs one by one within cycle deadline")
+    mode.add_argument("--watch", action="store_true", help="poll POD directories and upload PODs when they change")
+    parser.add_argument("--once", action="store_true", help="run one cycle and exit with status code")
+    parser.add_argument("--date", help="with --once: local time of the interval to send, e.g. '2024-03-04 10:00'")
+    mode.add_argument("--backfill", nargs=2, metavar=("START", "END"), type=datetime.date.fromisoformat,
+                      help="resend whole days from START to END (YYYY-MM-DD, inclusive) and exit")
+    backfill = parser.add_argument_group("backfill")
+    backfill.add_argument("--pods", nargs="+", help="PODs to backfill (default all configured PODs)")
+    backfill.add_argument("--output", help="write jsons to this directory instead of uploading them")
+    backfill.add_argument("--workers", type=int, default=4, help="backfill processes (0 = current process)")
+    backfill.add_argument("--no-resume", action="store_true", help="run also tasks finished by previous backfill")
+    args = parser.parse_args()
+    if args.date and not args.once:
+        parser.error("--date requires --once")
+    if args.once and args.backfill:
+        parser.error("--once cannot be combined with --backfill")
+    if args.once and args.watch:
+        parser.error("--once cannot be combined with --watch")
+
     # logger configuration
     def log_unhandled_exceptions(exc_type, exc_value, exc_traceback):
         log.critical("Unhandled exception", exc_info=(exc_type, exc_value, exc_traceback))
@@ -37,13 +116,29 @@ if __name__ == '__main__':
     log = logging.getLogger(__name__)
     sys.excepthook = log_unhandled_exceptions
 
-    scheduler = BackgroundScheduler()
-    trigger = CronTrigger(minute=f'*/{INTERVAL}')
-    scheduler.add_job(main, trigger=trigger, misfire_grace_time=10)
-    scheduler.start()
-    try:
-        while True:
-            time.sleep(0.2)
-    except (KeyboardInterrupt, SystemExit):
+    if args.backfill:
+        from lib.backfill import run_backfill
+        results = run_backfill(start=args.backfill[0], end=args.backfill[1], pod_ids=args.pods,
+                               output_dir=args.output, workers=args.workers, resume=not args.no_resume)
+        sys.exit(1 if any(s.status == "failed" for s in results) else 0)
+
+    if args.watch:
+        from lib.watcher import run_watcher
+        run_watcher()
         log.info("Exiting")
-        scheduler.shutdown()
+        sys.exit(0)
+
+    if args.pipeline:
+        job = main_pipeline
+    elif args.deadline:
+        job = main_deadline
+    else:
+        job = main
+    from lib.profiling import profiled
+    job = profiled(job)
+    if args.once:
+        sys.exit(run_once(job, date=args.date))
+
+    from lib.scheduler import run_scheduler
+    run_scheduler(job)
+    log.info("Exiting")
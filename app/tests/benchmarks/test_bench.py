@@ -0,0 +1,53 @@
+import json
+
+from benchmarks.bench import BASELINE_PATH, build_stages, compare, main, run_benchmarks
+
+
+def test_compare():
+    baseline = {"stage": {"seconds": 1.0, "peak_bytes": 1000}}
+
+    assert compare({"stage": {"seconds": 1.4, "peak_bytes": 1400}}, baseline, threshold=1.5) == []
+    assert compare({"other": {"seconds": 10, "peak_bytes": 10}}, baseline, threshold=1.5) == []
+    regressions = compare({"stage": {"seconds": 1.6, "peak_bytes": 1600}}, baseline, threshold=1.5)
+    assert len(regressions) == 2
+
+
+def test_run_benchmarks():
+    results = run_benchmarks(inverters=2, repeat=1, stages=["huawei_datalogger_csv_parser", "handle_missing_intervals"])
+
+    assert set(results) == {"huawei_datalogger_csv_parser", "handle_missing_intervals"}
+    assert all(s["seconds"] > 0 and s["peak_bytes"] > 0 for s in results.values())
+
+
+def test_main_fails_on_regression(tmp_path):
+    baseline = tmp_path / "baseline.json"
+    args = ["--inverters", "2", "--repeat", "1", "--stage", "handle_missing_intervals", "--baseline", str(baseline)]
+
+    assert main(args + ["--save-baseline"]) == 0
+    data = json.loads(baseline.read_text())
+    data["handle_missing_intervals"]["seconds"] = 1e-9
+    baseline.write_text(json.dumps(data))
+    assert main(args) == 1
+
+
+def test_main_fails_without_baseline(tmp_path):
+    args = ["--inverters", "2", "--repeat", "1", "--stage", "handle_missing_intervals"]
+
+    assert main(args + ["--baseline", str(tmp_path / "missing.json")]) == 2
+
+
+def test_committed_baseline_has_all_stages():
+    with open(BASELINE_PATH) as f:
+        baseline = json.load(f)
+
+    assert set(baseline) == set(build_stages(inverters=2))
+
+
+def test_streaming_engine_memory_is_flat():
+    small = run_benchmarks(inverters=5, repeat=1, stages=["datalogger_to_json_streaming"])
+    large = run_benchmarks(inverters=100, repeat=1, stages=["datalogger_to_json_streaming"])
+
+    peak_small = small["datalogger_to_json_streaming"]["peak_bytes"]
+    peak_large = large["datalogger_to_json_streaming"]["peak_bytes"]
+    assert peak_large < peak_small * 1.25
+    assert peak_large < 512 * 1024
@@ -0,0 +1,66 @@
+import io
+import json
+import os
+from unittest.mock import patch
+
+import pandas as pd
+import pytest
+
+from benchmarks.load_test import run_load_test
+from benchmarks.servers import LocalFtpServer
+from lib import TIMEZONE
+from lib.config import AppConfig
+from lib.sftp_conn import FtpPool, FTPConfig
+
+
+@pytest.mark.parametrize("mode", ["main", "pipeline", "deadline"])
+@pytest.mark.parametrize("streaming", [False, True])
+def test_run_load_test(mode, streaming):
+    date = pd.Timestamp("2024-06-01 12:00", tz=TIMEZONE)
+
+    with patch("lib.sftp_conn.load_app_config", return_value=AppConfig(json_streaming=streaming)):
+        reports = run_load_test(pods=3, inverters=2, cycles=2, mode=mode, date=date)
+
+    assert len(reports) == 2
+    for report in reports:
+        assert report["uploaded_files"] == 3
+        assert report["sftp"]["requests"] > 0
+        assert report["sftp"]["bytes"] > 0
+        assert report["ftp"]["bytes"] > 0
+        assert report["stages"]["download"]["bytes"] == report["sftp"]["bytes"]
+        assert report["stages"]["upload"]["bytes"] == report["ftp"]["bytes"]
+
+
+def test_run_load_test_mirror():
+    date = pd.Timestamp("2024-06-01 12:00", tz=TIMEZONE)
+
+    with patch("lib.sftp_conn.load_app_config", return_value=AppConfig(mirror={"enabled": True})):
+        reports = run_load_test(pods=3, inverters=2, cycles=2, mode="main", date=date)
+
+    assert reports[0]["uploaded_files"] == reports[1]["uploaded_files"] == 3
+    assert reports[0]["stages"]["download"]["bytes"] > 0
+    assert "download" not in reports[1]["stages"]  # unchanged files are parsed from mirror
+
+
+def test_local_ftp_server(tmp_path):
+    with LocalFtpServer(str(tmp_path)) as server:
+        config = FTPConfig(host=server.host, port=server.port, username=server.username, password=server.password)
+        with FtpPool() as pool, pytest.MonkeyPatch.context() as monkeypatch:
+            monkeypatch.setattr("lib.sftp_conn.load_ftp_configs", lambda: {"pod": config})
+            assert pool.write_file("pod", "a.json", io.BytesIO(b'{"a": 1}'))
+            assert pool.write_file("pod", "b.json", io.BytesIO(b'{"b": 2}'))
+
+        assert server.stats.as_dict()["sessions"] == 1
+        assert server.stats.as_dict()["bytes"] == 16
+    assert json.loads((tmp_path / "b.json").read_text()) == {"b": 2}
+    assert sorted(os.listdir(tmp_path)) == ["a.json", "b.json"]
+
+
+def test_local_ftp_server_chunks(tmp_path):
+    with LocalFtpServer(str(tmp_path)) as server:
+        config = FTPConfig(host=server.host, port=server.port, username=server.username, password=server.password)
+        with FtpPool() as pool, pytest.MonkeyPatch.context() as monkeypatch:
+            monkeypatch.setattr("lib.sftp_conn.load_ftp_configs", lambda: {"pod": config})
+            assert pool.write_chunks("pod", "a.json", lambda: iter([b'{"a"', b": ", b"1}"])) == 8
+
+    assert json.loads((tmp_path / "a.json").read_text()) == {"a": 1}
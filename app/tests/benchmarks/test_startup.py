@@ -0,0 +1,14 @@
+from benchmarks.startup import parse_importtime
+
+IMPORTTIME = """\
+import time: self [us] | cumulative | imported package
+import time:       120 |        120 |   _io
+import time:       300 |        420 | io
+import time:        50 |         50 |     lib.budget
+import time:      1000 |       1200 |   lib
+import time:       800 |       2000 | main
+"""
+
+
+def test_parse_importtime_keeps_top_level_imports():
+    assert parse_importtime(IMPORTTIME + "other stderr line\n") == {"io": 420, "main": 2000}
@@ -0,0 +1,38 @@
+import io
+
+import pandas as pd
+import pytest
+
+from benchmarks.synthetic import huawei_accumulated_csv, hub_minute_files, local_intervals
+from lib import TIMEZONE
+from lib.csv_reader import (huawei_datalogger_csv_parser, huawei_datalogger_csv_parser_vectorized,
+                            pecom_hub_csv_parser, quantity)
+
+
+@pytest.mark.parametrize("day, intervals", [("2024-06-01", 288), ("2024-03-31", 276), ("2024-10-27", 300)])
+def test_local_intervals(day, intervals):
+    assert len(local_intervals(day)) == intervals
+
+
+@pytest.mark.parametrize("day", ["2024-06-01", "2024-10-27"])
+def test_huawei_accumulated_csv(day):
+    date = pd.Timestamp(f"{day} 12:00", tz=TIMEZONE)
+    text = huawei_accumulated_csv(day, inverters=3, until=date)
+
+    df = huawei_datalogger_csv_parser(io.StringIO(text), date)
+
+    assert text.count("#Time") == 3
+    assert df.index[0] == pd.Timestamp(f"{day} 06:00", tz=TIMEZONE).tz_convert("UTC")
+    assert df.index[-1] == date.tz_convert("UTC")
+    assert (df[quantity] >= 0).all()
+    pd.testing.assert_frame_equal(df, huawei_datalogger_csv_parser_vectorized(io.StringIO(text), date))
+
+
+def test_hub_minute_files():
+    date = pd.Timestamp("2024-06-01 01:00", tz=TIMEZONE)
+    files = hub_minute_files("2024-06-01", until=date)
+
+    assert len(files) == 65
+    for content in files.values():
+        df = pecom_hub_csv_parser(io.StringIO(content))
+        assert len(df) == 5
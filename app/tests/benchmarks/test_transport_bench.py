@@ -0,0 +1,10 @@
+from benchmarks.transport_bench import run_transport_bench, PROFILES
+
+
+def test_run_transport_bench():
+    results = run_transport_bench(files=2, inverters=2, latency=0.0, bandwidth=None)
+
+    assert set(results) == set(PROFILES)
+    assert len({s["payload_bytes"] for s in results.values()}) == 1
+    assert results["compression"]["wire_bytes_down"] < results["default"]["wire_bytes_down"] / 2
+    assert results["wan"]["wire_bytes_down"] < results["default"]["wire_bytes_down"] / 2
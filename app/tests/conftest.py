@@ -0,0 +1,35 @@
+from contextlib import ExitStack
+from unittest.mock import patch
+
+import pytest
+
+# data and log paths imported by modules from lib - redirected under tmp_path of every test
+DATA_PATHS = {
+    "lib.metrics.METRICS_JSONL": "metrics.jsonl",
+    "lib.metrics.METRICS_PROM": "metrics.prom",
+    "lib.profiling.PROFILES_DIR": "profiles",
+    "lib.profiling.PROFILE_TRIGGER": "profile.trigger",
+    "lib.backfill.BACKFILL_DIR": "backfill",
+    "lib.mirror.MIRROR_DIR": "mirror",
+    "lib.outbox.OUTBOX_DIR": "outbox",
+    "lib.sharding.LEASES_DIR": "leases",
+    "lib.archive.ARCHIVE_DIR": "archive",
+}
+# module state kept between cycles of the process - reset for every test
+MODULE_STATE = {
+    "lib.archive._compacted_before": None,
+    "lib.profiling._cycles": 0,
+}
+
+
+@pytest.fixture(autouse=True)
+def data_paths(tmp_path):
+    """
+    Files written by tests go to temporary directory, not to DATA_PATH or LOGS_DIR
+    """
+    with ExitStack() as stack:
+        for target, name in DATA_PATHS.items():
+            stack.enter_context(patch(target, str(tmp_path / name)))
+        for target, value in MODULE_STATE.items():
+            stack.enter_context(patch(target, value))
+        yield
@@ -0,0 +1,170 @@
+import asyncio
+import datetime
+import os
+import time
+from unittest.mock import patch
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from lib import TIMEZONE, archive
+from lib.config import AppConfig, PipelineConfig
+from lib.csv_reader import replacement_data
+from lib.np_engine import Production
+from lib.pipeline import run_pipeline
+from lib.sftp_conn import PodFiles, SourceType, upload_pod, pod_sources
+
+DATE = pd.Timestamp("2024-03-04 10:00", tz=TIMEZONE)
+ARCHIVE_ENABLED = AppConfig(archive={"enabled": True})
+
+
+def production(date: pd.Timestamp, value: float) -> pd.DataFrame:
+    df = replacement_data(date)
+    df["quantity"] = value
+    df["status"] = "w"
+    return df
+
+
+def sent(minutes: int) -> pd.Timestamp:
+    return pd.Timestamp("2024-03-04 09:00", tz="UTC") + pd.Timedelta(minutes=minutes)
+
+
+def test_append_and_query():
+    archive.append("pod_a", DATE, production(DATE, 1.5), source="logger", sent_at=sent(0))
+    archive.append("pod_b", DATE, replacement_data(DATE), source="replacement", sent_at=sent(0))
+    archive.append("pod_a", DATE + pd.Timedelta(days=1), production(DATE, 2.0), source="logger", sent_at=sent(0))
+
+    df = archive.query("2024-03-04", "2024-03-04")
+
+    assert list(df.columns) == ["pod", "startDate", "quantity", "status", "source", "sentAt"]
+    assert df.groupby("pod").size().to_dict() == {"pod_a": 121, "pod_b": 121}
+    pod_a = df[df.pod == "pod_a"]
+    assert (pod_a.quantity == 1.5).all() and (pod_a.status == "w").all() and (pod_a.source == "logger").all()
+    assert pod_a.startDate.tolist() == replacement_data(DATE).index.tolist()
+    assert archive.query("2024-03-04", "2024-03-05", pod_ids=["pod_a"]).shape[0] == 242
+
+
+def test_append_production_arrays():
+    start = np.array([1709542800, 1709543100], dtype=np.int64)
+    archive.append("pod_a", DATE, Production(start=start, quantity=np.array([0.5, 0.0]), valid=np.array([True, False])),
+                   source="logger")
+
+    df = archive.query(DATE, DATE)
+
+    assert df.startDate.tolist() == [pd.Timestamp(1709542800, unit="s", tz="UTC"), pd.Timestamp(1709543100, unit="s", tz="UTC")]
+    assert df.quantity.tolist() == [0.5, 0.0]
+    assert df.status.tolist() == ["w", "f"]
+
+
+def test_compact_keeps_changes_only():
+    later = DATE + pd.Timedelta(minutes=5)
+    archive.append("pod_a", DATE, production(DATE, 1.0), source="logger", sent_at=sent(0))
+    archive.append("pod_a", later, production(later, 1.0), source="logger", sent_at=sent(5))
+    corrected = production(later, 1.0)
+    corrected.iloc[0, corrected.columns.get_loc("quantity")] = 3.0
+    archive.append("pod_a", later, corrected, source="logger", sent_at=sent(10))
+    before = archive.query(DATE, DATE)
+
+    assert archive.compact("2024-03-04", "pod_a")
+
+    directory = archive.partition_dir("2024-03-04", "pod_a")
+    assert os.listdir(directory) == [archive.DATA_FILE]
+    pd.testing.assert_frame_equal(archive.query(DATE, DATE), before)
+    history = archive.query(DATE, DATE, history=True)
+    assert len(history) == 123  # 121 intervals of first cycle, 1 new interval, 1 correction
+    first = history[history.startDate == history.startDate.min()]
+    assert first.quantity.tolist() == [1.0, 3.0]
+    assert first.sentAt.tolist() == [sent(0), sent(10)]
+    assert not archive.compact("2024-03-04", "pod_a")  # nothing to merge
+
+
+def test_compact_skips_locked_partition():
+    archive.append("pod_a", DATE, production(DATE, 1.0), source="logger")
+    lock = os.path.join(archive.partition_dir("2024-03-04", "pod_a"), archive.LOCK_FILE)
+    open(lock, "w").close()
+
+    assert not archive.compact("2024-03-04", "pod_a")
+
+    stale = time.time() - archive.LOCK_TTL - 1
+    os.utime(lock, (stale, stale))
+    assert archive.compact("2024-03-04", "pod_a")
+    assert not os.path.exists(lock)
+
+
+def test_compact_before():
+    archive.append("pod_a", DATE - pd.Timedelta(days=1), production(DATE, 1.0), source="logger")
+    archive.append("pod_a", DATE, production(DATE, 1.0), source="logger")
+
+    assert archive.compact_before(datetime.date(2024, 3, 4)) == [("2024-03-03", "pod_a")]
+    assert any(s.startswith(archive.PART_PREFIX) for s in os.listdir(archive.partition_dir("2024-03-04", "pod_a")))
+
+
+def test_compact_periodically_once_per_day():
+    archive.append("pod_a", DATE - pd.Timedelta(days=1), production(DATE, 1.0), source="logger")
+
+    thread = archive.compact_periodically(DATE.date())
+    thread.join(timeout=5)
+
+    assert os.listdir(archive.partition_dir("2024-03-03", "pod_a")) == [archive.DATA_FILE]
+    assert archive.compact_periodically(DATE.date()) is None
+
+
+def test_query_empty_archive():
+    df = archive.query(DATE, DATE)
+
+    assert df.empty
+    assert list(df.columns) == ["pod", "startDate", "quantity", "status", "source", "sentAt"]
+
+
+def test_upload_pod_archives_sent_data():
+    with patch.dict(pod_sources, {"pod_a": SourceType.hub}), \
+            patch("lib.sftp_conn.load_app_config", return_value=ARCHIVE_ENABLED), \
+            patch("lib.sftp_conn.send_json", side_effect=[True, False]):
+        assert upload_pod("pod_a", DATE, production(DATE, 1.0))
+        assert not upload_pod("pod_b", DATE, production(DATE, 1.0))
+
+    df = archive.query(DATE, DATE)
+    assert df.pod.unique().tolist() == ["pod_a"]
+    assert (df.source == "hub").all()
+
+
+def test_upload_pod_archive_failure_is_not_upload_failure():
+    with patch("lib.sftp_conn.load_app_config", return_value=ARCHIVE_ENABLED), \
+            patch("lib.sftp_conn.send_json", return_value=True), \
+            patch("lib.archive.append", side_effect=OSError("disk full")):
+        assert upload_pod("pod_a", DATE, production(DATE, 1.0))
+
+
+def test_run_pipeline_archives_source():
+    def fetch(sftp, pod_id, date):
+        return PodFiles(pod_id=pod_id, source=SourceType.replacement, files=[], contents={})
+
+    with patch("lib.pipeline.SftpConn"), patch("lib.pipeline.list_pod_ids", return_value=["pod_a"]), \
+            patch("lib.pipeline.fetch_pod", side_effect=fetch), patch("lib.pipeline.send_json", return_value=True), \
+            patch("lib.sftp_conn.load_app_config", return_value=ARCHIVE_ENABLED):
+        asyncio.run(run_pipeline(DATE, PipelineConfig(producers=1, workers=1, uploaders=1)))
+
+    df = archive.query(DATE, DATE)
+    assert len(df) == 121
+    assert (df.source == "replacement").all() and (df.status == "f").all()
+
+
+@pytest.fixture(autouse=True)
+def join_compaction():
+    """
+    Compaction started by archived uploads is joined before tmp_path is removed
+    """
+    threads = []
+    compact_periodically = archive.compact_periodically
+
+    def record(*args, **kwargs):
+        thread = compact_periodically(*args, **kwargs)
+        threads.append(thread)
+        return thread
+
+    with patch("lib.archive.compact_periodically", side_effect=record):
+        yield
+    for thread in threads:
+        if thread is not None:
+            thread.join(timeout=5)
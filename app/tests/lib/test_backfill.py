@@ -0,0 +1,132 @@
+import datetime
+import json
+import os
+from contextlib import ExitStack
+from unittest.mock import patch
+
+import pandas as pd
+import pytest
+
+from benchmarks.load_test import write_configs
+from benchmarks.servers import LocalSftpServer, LocalFtpServer
+from benchmarks.synthetic import huawei_accumulated_csv
+from lib import TIMEZONE, archive
+from lib.backfill import day_end, backfill_tasks, run_backfill, BackfillTask, load_progress, progress_key
+from lib.config import AppConfig
+from lib.csv_reader import replacement_data
+from lib.sftp_conn import PodFiles, SourceType
+
+
+def test_day_end():
+    assert day_end(datetime.date(2024, 3, 4)) == pd.Timestamp("2024-03-04 23:55", tz=TIMEZONE)
+    assert day_end(datetime.date(2024, 10, 27)) == pd.Timestamp("2024-10-27 23:55", tz=TIMEZONE)
+
+
+def test_backfill_tasks():
+    tasks = backfill_tasks(["pod_a", "pod_b"], datetime.date(2024, 2, 28), datetime.date(2024, 3, 1))
+
+    assert len(tasks) == 6
+    assert tasks[:3] == [BackfillTask("pod_a", "2024-02-28"), BackfillTask("pod_b", "2024-02-28"),
+                         BackfillTask("pod_a", "2024-02-29")]
+
+
+@pytest.fixture
+def mock_sources():
+    def fetch(sftp, pod_id, date):
+        source = SourceType.replacement if pod_id == "pod_missing" else SourceType.logger
+        return PodFiles(pod_id=pod_id, source=source, files=[], contents={})
+
+    with patch("lib.backfill.SftpConn"), patch("lib.backfill.fetch_pod", side_effect=fetch) as mock_fetch, \
+            patch("lib.backfill.parse_pod", side_effect=lambda pod_files, date: replacement_data(date)):
+        yield mock_fetch
+
+
+def test_run_backfill_writes_output_and_resumes(tmp_path, mock_sources):
+    output, progress = tmp_path / "out", str(tmp_path / "progress.jsonl")
+    start, end = datetime.date(2024, 3, 4), datetime.date(2024, 3, 5)
+
+    results = run_backfill(start, end, pod_ids=["pod_a", "pod_missing"], output_dir=str(output), workers=0,
+                           progress_path=progress)
+
+    assert sorted((s.pod_id, s.day, s.status) for s in results) == [
+        ("pod_a", "2024-03-04", "done"), ("pod_a", "2024-03-05", "done"),
+        ("pod_missing", "2024-03-04", "missing"), ("pod_missing", "2024-03-05", "missing")]
+    assert sorted(os.listdir(output)) == ["pod_a-2024-03-04.json", "pod_a-2024-03-05.json"]
+    data = json.loads((output / "pod_a-2024-03-04.json").read_text())
+    assert len(data["production"]) == 288
+    assert progress_key("pod_a", "2024-03-04", str(output)) in load_progress(progress)
+
+    mock_sources.reset_mock()
+    results = run_backfill(start, end, pod_ids=["pod_a", "pod_missing"], output_dir=str(output), workers=0,
+                           progress_path=progress)
+
+    assert [s.pod_id for s in results] == ["pod_missing", "pod_missing"]  # only missing days are tried again
+    assert mock_sources.call_count == 2
+
+
+def test_run_backfill_reports_failed_fetch(tmp_path, mock_sources):
+    mock_sources.side_effect = IOError("connection lost")
+
+    results = run_backfill(datetime.date(2024, 3, 4), datetime.date(2024, 3, 4), pod_ids=["pod_a"],
+                           output_dir=str(tmp_path), workers=0, progress_path=str(tmp_path / "progress.jsonl"))
+
+    assert results[0].status == "failed"
+    assert "connection lost" in results[0].error
+    assert not load_progress(str(tmp_path / "progress.jsonl"))
+
+
+def test_run_backfill_archives_uploaded_days(tmp_path, mock_sources):
+    config = AppConfig(archive={"enabled": True})
+    with patch("lib.backfill.write_json", return_value=True), patch("lib.backfill.FtpPool"), \
+            patch("lib.backfill.load_app_config", return_value=config), \
+            patch("lib.sftp_conn.load_app_config", return_value=config):
+        run_backfill(datetime.date(2024, 3, 4), datetime.date(2024, 3, 5), pod_ids=["pod_a", "pod_missing"], workers=0,
+                     progress_path=str(tmp_path / "progress.jsonl"))
+
+    df = archive.query("2024-03-04", "2024-03-05")
+    assert df.pod.unique().tolist() == ["pod_a"]
+    assert len(df) == 576 and (df.source == "logger").all()
+    assert os.listdir(archive.partition_dir("2024-03-05", "pod_a")) == [archive.DATA_FILE]  # compacted at the end
+
+
+def test_run_backfill_process_pool_uploads(tmp_path):
+    days = [datetime.date(2024, 6, 1), datetime.date(2024, 6, 2)]
+    pod_ids = ["pod_a", "pod_b", "pod_c"]
+    source, target, config_dir = tmp_path / "source", tmp_path / "target", tmp_path / "config"
+    for path in (source, target, config_dir):
+        path.mkdir()
+    for pod_id in pod_ids:
+        (source / pod_id).mkdir()
+        for day in days[:1] if pod_id == "pod_c" else days:
+            text = huawei_accumulated_csv(day.isoformat(), inverters=2, until=day_end(day))
+            (source / pod_id / f"min{day:%Y%m%d}.csv").write_text(text)
+
+    with ExitStack() as stack:
+        sftp = stack.enter_context(LocalSftpServer(str(source)))
+        ftp = stack.enter_context(LocalFtpServer(str(target)))
+        for target_name, path in write_configs(str(config_dir), sftp, ftp, pod_ids).items():
+            stack.enter_context(patch(target_name, path))
+        results = run_backfill(days[0], days[1], workers=2, progress_path=str(tmp_path / "progress.jsonl"))
+
+    assert sorted(s.status for s in results) == ["done"] * 5 + ["missing"]
+    assert len(os.listdir(target)) == 5
+    data = json.loads((target / "pod_a-2024-06-02.json").read_text())
+    assert len(data["production"]) == 288
+    assert any(s["quantity"] > 0 for s in data["production"])
+
+
+def test_process_pool_workers_close_sessions(tmp_path):
+    closed = tmp_path / "closed"
+    closed.mkdir()
+
+    def fetch(sftp, pod_id, date):
+        return PodFiles(pod_id=pod_id, source=SourceType.replacement, files=[], contents={})
+
+    with patch("lib.backfill.SftpConn"), patch("lib.backfill.fetch_pod", side_effect=fetch), \
+            patch("lib.backfill.close_worker", side_effect=lambda: (closed / str(os.getpid())).touch()):
+        results = run_backfill(datetime.date(2024, 6, 1), datetime.date(2024, 6, 2), pod_ids=["pod_a", "pod_b"],
+                               workers=2, progress_path=str(tmp_path / "progress.jsonl"))
+
+    assert [s.status for s in results] == ["missing"] * 4
+    assert 1 <= len(os.listdir(closed)) <= 2  # every worker process which was started
+    assert str(os.getpid()) not in os.listdir(closed)
@@ -0,0 +1,28 @@
+import time
+
+import pytest
+
+from lib import budget
+
+
+def test_check_without_limit_passes():
+    assert budget.check("reading file.csv") is None
+
+
+def test_check_past_limit_raises():
+    remaining = []
+    with budget.limit(0.1, on_check=remaining.append):
+        assert 0 < budget.check("reading a.csv") <= 0.1
+        time.sleep(0.1)
+        with pytest.raises(budget.BudgetExceeded, match="before reading b.csv"):
+            budget.check("reading b.csv")
+
+    assert len(remaining) == 1
+    assert budget.check("reading c.csv") is None
+
+
+def test_limits_nest():
+    with budget.limit(5):
+        with budget.limit(0.1):
+            assert budget.check("upload") <= 0.1
+        assert budget.check("upload") > 1
@@ -4,10 +4,13 @@ import os
 import pandas as pd
 import pytest
 
+from benchmarks.synthetic import hub_minute_files
 from lib import INTERVAL, TIMEZONE, TEST_DATA
 from lib.csv_reader import (last_interval_date, huawei_datalogger_csv_parser,
                             startDate, quantity, status, replacement_data, handle_missing_intervals,
-                            pecom_hub_csv_parser, aggregate_hub_csvs)
+                            pecom_hub_csv_parser, aggregate_hub_csvs, HuaweiCsvState,
+                            HubAggregator, huawei_datalogger_csv_parser_vectorized, split_inverter_blocks, day_grid,
+                            pecom_hub_csv_batch_parser, SOURCE_COL)
 from lib.json_writer import DataValidity
 
 
@@ -218,3 +221,157 @@ def test_aggregate_hub_csvs():
     assert df[quantity].isna().sum() == 0
     assert df[quantity].sum() == 0
     assert df[status].isin([e.value for e in DataValidity]).all()
+
+
+@pytest.mark.parametrize("csv_file", ['huawei_datalogger_csv_parser_valid.csv',
+                                      'huawei_datalogger_csv_parser_invalid.csv'])
+@pytest.mark.parametrize("chunk_size", [1, 7, 100, 100000])
+def test_huawei_csv_state_matches_full_parser(csv_file, chunk_size):
+    with open(os.path.join(TEST_DATA, csv_file), 'rb') as f:
+        raw = f.read()
+
+    date = pd.Timestamp('2023-01-28 12:25:00', tz=TIMEZONE)
+    expected_df = huawei_datalogger_csv_parser(io.StringIO(raw.decode('utf-8')), date)
+
+    state = HuaweiCsvState()
+    for i in range(0, len(raw), chunk_size):
+        state.feed(raw[i:i + chunk_size])
+    result_df = state.to_df(date)
+
+    pd.testing.assert_frame_equal(result_df, expected_df)
+    assert state.offset == len(raw)
+
+
+def test_huawei_csv_state_tail():
+    with open(os.path.join(TEST_DATA, 'huawei_datalogger_csv_parser_valid.csv'), 'rb') as f:
+        raw = f.read()
+
+    state = HuaweiCsvState()
+    state.feed(raw)
+
+    assert state.matches_tail(raw[-len(state.tail):] + b"\nnew row")
+    assert not state.matches_tail(b"rewritten" + raw[-len(state.tail):])
+    assert state.pending  # last line of the file has no line ending yet
+
+
+def test_hub_aggregator_replace_source():
+    date = pd.Timestamp("2024-03-03 00:20", tz=TIMEZONE)
+
+    def hub_df(start, values):
+        return pd.DataFrame({startDate: pd.date_range(start, periods=len(values), freq="1min", tz="UTC"),
+                             quantity: values})
+
+    first = hub_df("2024-03-02 23:06", [10, 11, 12, 13, 14])
+    second = hub_df("2024-03-02 23:11", [15, 16, 17, 18, 19])
+    second_changed = hub_df("2024-03-02 23:11", [15, 16, 17, 18, 25])
+
+    aggregator = HubAggregator()
+    aggregator.add("first", first)
+    aggregator.add("second", second)
+    pd.testing.assert_frame_equal(aggregator.to_df(date), aggregate_hub_csvs([first, second], date))
+
+    aggregator.add("second", second_changed)
+    pd.testing.assert_frame_equal(aggregator.to_df(date), aggregate_hub_csvs([first, second_changed], date))
+    assert aggregator.to_df(date)[quantity].sum() == 11
+
+    aggregator.remove("second")
+    aggregator.remove("first")
+    pd.testing.assert_frame_equal(aggregator.to_df(date), replacement_data(date))
+
+
+@pytest.mark.parametrize("csv_file", ['huawei_datalogger_csv_parser_valid.csv',
+                                      'huawei_datalogger_csv_parser_invalid.csv',
+                                      'huawei_datalogger_csv_parser_empty.csv'])
+def test_huawei_datalogger_csv_parser_vectorized(csv_file):
+    with open(os.path.join(TEST_DATA, csv_file), 'rb') as f:
+        text = f.read().decode('utf-8')
+
+    date = pd.Timestamp('2023-01-28 12:25:00', tz=TIMEZONE)
+
+    result_df = huawei_datalogger_csv_parser_vectorized(io.StringIO(text), date)
+    expected_df = huawei_datalogger_csv_parser(io.StringIO(text), date)
+
+    pd.testing.assert_frame_equal(result_df, expected_df)
+
+
+@pytest.mark.parametrize("e_day", ["", "n/a"])
+def test_huawei_parsers_reject_invalid_e_day(e_day):
+    text = f"#INV1\n#Time;E-Day\n2023-01-28 12:20:00;10.5\n2023-01-28 12:25:00;{e_day}\n"
+    date = pd.Timestamp('2023-01-28 12:25:00', tz=TIMEZONE)
+
+    for parser in (huawei_datalogger_csv_parser, huawei_datalogger_csv_parser_vectorized):
+        with pytest.raises(ValueError, match="could not convert string to float"):
+            parser(io.StringIO(text), date)
+
+
+def test_split_inverter_blocks():
+    text = "#Logger\n#INV1\n#Time;E-Day\n2025-03-03 12:20:00;22;\n#INV2\n#Time;E-Day\n\n2025-03-03 12:20:00;20"
+
+    blocks = split_inverter_blocks(text)
+
+    assert len(blocks) == 2
+    assert all(block.startswith("#Time;E-Day") for block in blocks)
+    assert "22" in blocks[0] and "20" in blocks[1]
+    assert split_inverter_blocks("") == []
+    assert split_inverter_blocks("Nodata;1\n#comment") == ["Nodata;1\n"]
+
+
+@pytest.mark.parametrize("day, intervals", [("2024-03-30", 288), ("2024-03-31", 276), ("2024-10-27", 300)])
+def test_day_grid(day, intervals):
+    grid = day_grid(pd.Timestamp(day).date())
+    start_utc = pd.Timestamp(day, tz=TIMEZONE).tz_convert("UTC")
+    next_day_utc = (pd.Timestamp(day) + pd.Timedelta(days=1)).tz_localize(TIMEZONE).tz_convert("UTC")
+
+    assert len(grid) == intervals
+    assert grid.index[0] == start_utc
+    assert grid.index[-1] == next_day_utc - pd.Timedelta(minutes=INTERVAL)
+    assert day_grid(pd.Timestamp(day).date()) is grid
+
+    date = pd.Timestamp(f"{day} 23:55", tz=TIMEZONE)
+    assert len(replacement_data(date)) == intervals
+    assert replacement_data(date).index[-1] == date.tz_convert("UTC")
+
+
+def hub_files_with_test_data() -> dict:
+    files = hub_minute_files("2024-06-01", until=pd.Timestamp("2024-06-01 03:00", tz=TIMEZONE))
+    for csv_file in ['pecom_hub_csv_parser_valid.csv', 'pecom_hub_csv_parser_invalid.csv',
+                     'pecom_hub_csv_parser_empty.csv']:
+        with open(os.path.join(TEST_DATA, csv_file), 'rb') as f:
+            files[csv_file] = f.read().decode('utf-8')
+    files["narrow.csv"] = "id;a;b\n" + "".join(f"2024-06-01T00:0{i}:00;{i};1.5\n\n" for i in range(5))
+    files["short.csv"] = "id;a\n2024-06-01T00:00:00;1\n"
+    return files
+
+
+def test_pecom_hub_csv_batch_parser_matches_single_files():
+    files = hub_files_with_test_data()
+
+    batch = pecom_hub_csv_batch_parser(files)
+
+    for filename, text in files.items():
+        expected = pecom_hub_csv_parser(io.StringIO(text))
+        result = batch[batch[SOURCE_COL] == filename].drop(columns=[SOURCE_COL]).reset_index(drop=True)
+        if expected.empty:
+            assert result.empty, filename
+        else:
+            pd.testing.assert_frame_equal(result, expected, check_dtype=False)
+    assert set(batch[SOURCE_COL]) == set(files) - {"pecom_hub_csv_parser_invalid.csv",
+                                                   "pecom_hub_csv_parser_empty.csv", "short.csv"}
+    assert pecom_hub_csv_batch_parser({}).empty
+
+
+def test_hub_aggregator_add_batch():
+    files = hub_files_with_test_data()
+    date = pd.Timestamp("2024-06-01 03:00", tz=TIMEZONE)
+    expected = HubAggregator()
+    for filename, text in files.items():
+        expected.add(filename, pecom_hub_csv_parser(io.StringIO(text)))
+
+    aggregator = HubAggregator()
+    names = list(files)
+    aggregator.add_batch(names[:10], pecom_hub_csv_batch_parser({s: files[s] for s in names[:10]}))
+    aggregator.add_batch(names[5:], pecom_hub_csv_batch_parser({s: files[s] for s in names[5:]}))  # 5 replaced
+
+    assert aggregator.sources == expected.sources
+    pd.testing.assert_frame_equal(aggregator.to_df(date), expected.to_df(date))
+    pd.testing.assert_frame_equal(aggregate_hub_csvs([pecom_hub_csv_batch_parser(files)], date), expected.to_df(date))
@@ -7,7 +7,8 @@ from pydantic import ValidationError
 
 from lib import TIMEZONE
 from lib.csv_reader import quantity, status, startDate
-from lib.json_writer import (DataValidity, TimeSeries, JsonDataCEZ, dump_df, production_to_json_bytes)
+from lib.json_writer import (DataValidity, TimeSeries, JsonDataCEZ, dump_df, production_to_json_bytes,
+                             production_to_json_bytes_fast, validate_production, format_float, production_json_chunks)
 
 
 def test_parse_timestamp_validator():
@@ -104,3 +105,64 @@ def test_production_to_json_bytes_valid():
     json_dict = json.loads(json_bytes_io.getvalue().decode("utf-8"))
     class_json = JsonDataCEZ(**json_dict)
     assert class_json.production[0].quantity == 100
+
+
+def test_production_to_json_bytes_fast_matches_pydantic():
+    index = pd.date_range("2024-03-31 00:00", "2024-03-31 23:55", freq="5min", tz=TIMEZONE).tz_convert("UTC")
+    df = pd.DataFrame(data={quantity: [0.001 * i for i in range(len(index))], status: ["w", "f"] * (len(index) // 2)},
+                      index=index)
+    df.index.name = startDate
+
+    assert production_to_json_bytes_fast(df).getvalue() == production_to_json_bytes(df).getvalue()
+    assert production_to_json_bytes_fast(df.iloc[:0]).getvalue() == production_to_json_bytes(df.iloc[:0]).getvalue()
+
+
+@pytest.mark.parametrize("rows", [0, 1, 288])
+def test_production_json_chunks(rows):
+    index = pd.date_range("2024-06-01 00:00", periods=288, freq="5min", tz=TIMEZONE).tz_convert("UTC")[:rows]
+    df = pd.DataFrame(data={quantity: [0.125 * i for i in range(rows)], status: ["w"] * rows}, index=index)
+    df.index.name = startDate
+
+    chunks = list(production_json_chunks(df, chunk_rows=100))
+    compact_chunks = list(production_json_chunks(df, compact=True, chunk_rows=100))
+
+    assert all(isinstance(s, bytes) for s in chunks)
+    assert len(chunks) == 2 + (rows + 99) // 100  # head, items, tail
+    assert b"".join(chunks) == production_to_json_bytes(df).getvalue()
+    assert b"".join(compact_chunks) == production_to_json_bytes(df, compact=True).getvalue()
+    assert production_to_json_bytes_fast(df, compact=True).getvalue() == b"".join(compact_chunks)
+
+
+def test_production_json_chunks_validates_eagerly():
+    index = pd.DatetimeIndex([pd.Timestamp("2024-03-03 00:00", tz="UTC")], name=startDate)
+
+    with pytest.raises(ValueError, match="negative"):
+        production_json_chunks(pd.DataFrame(data={quantity: [-1], status: ["w"]}, index=index))
+
+
+@pytest.mark.parametrize("value", [0.0, 100.0, 8.13, 0.001, 1e-5, 1e-6, 1.5e-7, 1e16, 1.2345e17, 123456789.123])
+def test_format_float(value):
+    df = pd.DataFrame(data={quantity: [value], status: ["w"]}, index=[pd.Timestamp("2024-03-03 00:00", tz="UTC")])
+    df.index.name = startDate
+
+    expected = JsonDataCEZ(production=dump_df(df, TimeSeries)).model_dump_json()
+    assert f'"quantity":{format_float(value)},' in expected
+
+
+def test_validate_production_invalid():
+    index = pd.DatetimeIndex([pd.Timestamp("2024-03-03 00:00", tz=TIMEZONE).tz_convert("UTC")], name=startDate)
+
+    with pytest.raises(ValueError, match="negative"):
+        validate_production(pd.DataFrame(data={quantity: [-1], status: ["w"]}, index=index))
+    with pytest.raises(ValueError, match="NaN"):
+        validate_production(pd.DataFrame(data={quantity: [float("nan")], status: ["w"]}, index=index))
+    with pytest.raises(ValueError, match="invalid status"):
+        validate_production(pd.DataFrame(data={quantity: [1], status: ["h"]}, index=index))
+    with pytest.raises(ValueError, match="UTC"):
+        validate_production(pd.DataFrame(data={quantity: [1], status: ["w"]}, index=index.tz_localize(None)))
+    with pytest.raises(ValueError, match="DatetimeIndex"):
+        validate_production(pd.DataFrame(data={quantity: [1], status: ["w"]}, index=["2024-03-03 00:00"]))
+    with pytest.raises(ValueError, match="named"):
+        validate_production(pd.DataFrame(data={quantity: [1], status: ["w"]}, index=index.rename(None)))
+    with pytest.raises(ValueError, match="columns"):
+        validate_production(pd.DataFrame(data={quantity: [1], status: ["w"], "other": [1]}, index=index))
@@ -0,0 +1,128 @@
+import contextvars
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch
+
+import pandas as pd
+import pytest
+
+from lib import TIMEZONE, metrics
+from lib.metrics import Histogram, CycleMetrics, MetricsTotals, CYCLE_BUDGET
+
+
+@pytest.fixture
+def metrics_files(tmp_path):
+    jsonl, prom = tmp_path / "metrics.jsonl", tmp_path / "metrics.prom"
+    with patch("lib.metrics.METRICS_JSONL", str(jsonl)), patch("lib.metrics.METRICS_PROM", str(prom)), \
+            patch("lib.metrics.totals", MetricsTotals()):
+        yield jsonl, prom
+
+
+def test_histogram_cumulative_buckets():
+    histogram = Histogram(buckets=(0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 2.0):
+        histogram.observe(value)
+
+    assert histogram.cumulative() == [("0.1", 2), ("1", 3), ("+Inf", 4)]
+    assert histogram.sum == pytest.approx(2.65)
+    assert histogram.max == 2.0
+
+
+def test_stage_outside_cycle_is_added_to_totals_only(metrics_files):
+    with metrics.stage("parse") as timer:
+        timer.bytes = 10
+
+    assert not metrics_files[0].exists()
+    assert metrics.totals.stage_bytes == {"parse": 10}
+
+
+def test_cycle_writes_jsonl_record_and_prometheus(metrics_files):
+    jsonl, prom = metrics_files
+    date = pd.Timestamp("2024-03-04 10:00", tz=TIMEZONE)
+
+    for _ in range(2):
+        with metrics.cycle(date=date):
+            with metrics.pod("pod_a"):
+                with metrics.stage("download") as timer:
+                    timer.bytes = 100
+                with metrics.stage("parse"):
+                    pass
+            with metrics.stage("upload", pod_id="pod_b") as timer:
+                timer.bytes = 50
+
+    records = [json.loads(s) for s in jsonl.read_text().splitlines()]
+    assert len(records) == 2
+    record = records[-1]
+    assert record["date"] == date.isoformat()
+    assert record["budget_seconds"] == CYCLE_BUDGET
+    assert record["over_budget"] is False
+    assert record["pods"] == 2
+    assert list(record["stages"]) == ["download", "parse", "upload"]
+    assert record["stages"]["download"]["count"] == 1
+    assert record["stages"]["download"]["bytes"] == 100
+    assert record["stages"]["download"]["buckets"]["+Inf"] == 1
+    assert record["per_pod"]["pod_a"]["download"]["bytes"] == 100
+    assert record["per_pod"]["pod_b"]["upload"]["bytes"] == 50
+
+    text = prom.read_text()
+    assert 'cez_ftp_stage_duration_seconds_count{stage="download"} 2' in text
+    assert 'cez_ftp_stage_duration_seconds_bucket{stage="parse",le="+Inf"} 2' in text
+    assert 'cez_ftp_stage_bytes_total{stage="upload"} 100' in text
+    assert "cez_ftp_cycles_total 2" in text
+    assert "cez_ftp_last_cycle_pods 2" in text
+
+
+def test_cycle_over_budget(metrics_files):
+    cycle_metrics = CycleMetrics()
+    cycle_metrics.duration = CYCLE_BUDGET + 1
+
+    assert cycle_metrics.over_budget
+    assert cycle_metrics.to_record()["budget_used"] > 1
+
+
+def test_pod_is_attributed_per_thread(metrics_files):
+    with metrics.cycle() as cycle_metrics:
+        def work(pod_id):
+            with metrics.pod(pod_id), metrics.stage("parse"):
+                pass
+
+        with ThreadPoolExecutor(max_workers=4) as executor:  # like pipeline mode, threads run copy of cycle context
+            for i in range(4):
+                executor.submit(contextvars.copy_context().run, work, f"pod_{i}")
+
+    assert sorted(cycle_metrics.pods) == ["pod_0", "pod_1", "pod_2", "pod_3"]
+    assert cycle_metrics.stages["parse"].count == 4
+
+
+def test_background_thread_is_not_counted_in_cycle(metrics_files):
+    def background():
+        with metrics.pod("pod_a"), metrics.stage("upload") as timer:
+            timer.bytes = 10
+
+    with metrics.cycle() as cycle_metrics:
+        with metrics.stage("parse"):
+            pass
+        thread = threading.Thread(target=background)  # e.g. outbox uploader started by the cycle
+        thread.start()
+        thread.join()
+
+    assert list(cycle_metrics.stages) == ["parse"]
+    assert not cycle_metrics.pods
+    assert metrics.totals.stages["upload"].count == 1
+    assert metrics.totals.stage_bytes == {"upload": 10, "parse": 0}
+    assert 'cez_ftp_stage_bytes_total{stage="upload"} 10' in metrics_files[1].read_text()
+
+
+def test_write_jsonl_rotates_by_size(tmp_path):
+    path = str(tmp_path / "metrics.jsonl")
+    for i in range(7):
+        metrics.write_jsonl({"cycle": i}, path=path, max_bytes=30, backups=2)
+
+    def records(name):
+        return [json.loads(s)["cycle"] for s in (tmp_path / name).read_text().splitlines()]
+
+    assert sorted(s.name for s in tmp_path.iterdir()) == ["metrics.jsonl", "metrics.jsonl.1", "metrics.jsonl.2"]
+    assert records("metrics.jsonl") == [6]
+    assert records("metrics.jsonl.1") == [4, 5]
+    assert records("metrics.jsonl.2") == [2, 3]
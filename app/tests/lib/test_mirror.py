@@ -0,0 +1,78 @@
+import io
+import os
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from lib import mirror
+
+
+class FakeSftp:
+    """
+    Files of one POD directory - every open is recorded
+    """
+    def __init__(self, files: dict):
+        self.files = files
+        self.opened = []
+
+    def open(self, filename: str, mode: str = 'r'):
+        self.opened.append(filename)
+        return io.BytesIO(self.files[filename])
+
+    def attr(self, filename: str, mtime: int):
+        return SimpleNamespace(filename=filename, st_size=len(self.files[filename]), st_mtime=mtime)
+
+
+@pytest.fixture
+def root(tmp_path):
+    return str(tmp_path / "mirror")
+
+
+def test_sync_file_skips_unchanged(root):
+    sftp = FakeSftp({"min20240601.csv": b"header\nrow 1\n"})
+
+    path = mirror.sync_file(sftp, "pod", sftp.attr("min20240601.csv", 1000), root=root)
+    mirror.sync_file(sftp, "pod", sftp.attr("min20240601.csv", 1000), root=root)
+
+    assert sftp.opened == ["min20240601.csv"]
+    assert path == os.path.join(root, "pod", "min20240601.csv")
+    assert os.path.getmtime(path) == 1000
+    assert open(path, 'rb').read() == b"header\nrow 1\n"
+
+
+def test_sync_file_appends_new_bytes(root):
+    old = b"header\n" + b"row\n" * 100
+    sftp = FakeSftp({"min20240601.csv": old})
+    path = mirror.sync_file(sftp, "pod", sftp.attr("min20240601.csv", 1000), root=root)
+
+    sftp.files["min20240601.csv"] = old + b"new row\n"
+    mirror.sync_file(sftp, "pod", sftp.attr("min20240601.csv", 1060), root=root)
+
+    assert open(path, 'rb').read() == old + b"new row\n"
+    assert os.path.getmtime(path) == 1060
+
+
+def test_sync_file_rewritten(root):
+    sftp = FakeSftp({"min20240601.csv": b"header\nrow 1\n"})
+    path = mirror.sync_file(sftp, "pod", sftp.attr("min20240601.csv", 1000), root=root)
+
+    sftp.files["min20240601.csv"] = b"header\nrow X\nrow 2\n"  # grew, but already mirrored part changed
+    mirror.sync_file(sftp, "pod", sftp.attr("min20240601.csv", 1060), root=root)
+    assert open(path, 'rb').read() == b"header\nrow X\nrow 2\n"
+
+    sftp.files["min20240601.csv"] = b"short\n"
+    assert mirror.read_file(sftp, "pod", sftp.attr("min20240601.csv", 1120), root=root) == b"short\n"
+    assert not os.path.exists(f"{path}.part")
+
+
+def test_evict(root):
+    sftp = FakeSftp({"old.csv": b"old", "new.csv": b"new"})
+    now = time.time()
+    mirror.sync_file(sftp, "pod_a", sftp.attr("old.csv", int(now - 10 * 86400)), root=root)
+    mirror.sync_file(sftp, "pod_b", sftp.attr("new.csv", int(now)), root=root)
+
+    removed = mirror.evict(retention_days=7, root=root, now=now)
+
+    assert removed == [os.path.join(root, "pod_a", "old.csv")]
+    assert sorted(os.listdir(root)) == ["pod_b"]
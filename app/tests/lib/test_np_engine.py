@@ -0,0 +1,144 @@
+import io
+import os
+from unittest.mock import patch
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from benchmarks.synthetic import huawei_accumulated_csv
+from lib import TIMEZONE, TEST_DATA
+from lib.config import AppConfig
+from lib.csv_reader import huawei_datalogger_csv_parser, handle_missing_intervals, HuaweiCsvState
+from lib.json_writer import production_to_json_str
+from lib.np_engine import (Production, datalogger_production, csv_state_production, grouped_kahan_sum,
+                           parse_local_seconds, local_to_utc, day_slots)
+from lib.sftp_conn import serialize_pod, process_datalogger_csv
+
+
+def pandas_json(text: str, date: pd.Timestamp) -> str:
+    df = huawei_datalogger_csv_parser(io.StringIO(text), date)
+    return production_to_json_str(handle_missing_intervals(df, date))
+
+
+def ascending(text: str) -> str:
+    """
+    Reverse rows inside every inverter block, so the file is written oldest row first
+    """
+    lines, block = [], []
+    for line in text.splitlines():
+        if line.startswith("#"):
+            lines += block[::-1] + [line]
+            block = []
+        else:
+            block.append(line)
+    return "\n".join(lines + block[::-1]) + "\n"
+
+
+@pytest.mark.parametrize("csv_file", ['huawei_datalogger_csv_parser_valid.csv',
+                                      'huawei_datalogger_csv_parser_invalid.csv',
+                                      'huawei_datalogger_csv_parser_empty.csv'])
+@pytest.mark.parametrize("until", ["12:20", "23:55"])
+def test_datalogger_production_test_data(csv_file, until):
+    with open(os.path.join(TEST_DATA, csv_file)) as f:
+        text = f.read()
+    date = pd.Timestamp(f"2025-03-03 {until}", tz=TIMEZONE)
+
+    assert datalogger_production(text, date).to_json_str() == pandas_json(text, date)
+
+
+@pytest.mark.parametrize("day", ["2024-06-01", "2024-01-15", "2024-03-31"])
+@pytest.mark.parametrize("inverters", [1, 17])
+@pytest.mark.parametrize("until", ["00:00", "12:35", "23:55"])
+def test_datalogger_production_synthetic(day, inverters, until):
+    date = pd.Timestamp(f"{day} {until}").tz_localize(TIMEZONE, nonexistent="shift_forward")
+    text = huawei_accumulated_csv(day, inverters=inverters, until=date, seed=inverters)
+
+    assert datalogger_production(text, date).to_json_str() == pandas_json(text, date)
+
+
+def test_datalogger_production_autumn_dst():
+    date = pd.Timestamp("2024-10-27 23:55", tz=TIMEZONE)
+    text = huawei_accumulated_csv("2024-10-27", inverters=2, until=date, sunrise=0, sunset=24, seed=2)
+
+    production = datalogger_production(text, date)
+
+    assert len(production.start) == 25 * 12
+    assert production.valid.all()
+    # rows oldest first are localized as pandas does, newest first (pandas cannot infer DST) give the same result
+    assert production.to_json_str() == pandas_json(ascending(text), date)
+    assert datalogger_production(ascending(text), date).to_json_str() == production.to_json_str()
+
+
+def test_local_to_utc_ambiguous():
+    local = parse_local_seconds(["2024-10-27 02:00:00", "2024-10-27 02:30:00", "2024-10-27 02:00:00",
+                                 "2024-10-27 02:30:00", "2024-10-27 03:00:00"])
+    utc = local_to_utc(local, np.zeros(len(local), dtype=np.int64))
+    expected = pd.DatetimeIndex(["2024-10-27 00:00", "2024-10-27 00:30", "2024-10-27 01:00", "2024-10-27 01:30",
+                                 "2024-10-27 02:00"]).asi8 // 10 ** 9
+
+    np.testing.assert_array_equal(utc, expected)
+    np.testing.assert_array_equal(local_to_utc(local[::-1], np.zeros(len(local), dtype=np.int64)), expected[::-1])
+
+
+def test_local_to_utc_non_existent():
+    local = parse_local_seconds(["2024-03-31 02:30:00"])
+
+    with pytest.raises(ValueError):
+        local_to_utc(local, np.zeros(1, dtype=np.int64))
+
+
+def test_parse_local_seconds_formats():
+    np.testing.assert_array_equal(parse_local_seconds(["24-06-01 10:00:00"]),
+                                  parse_local_seconds(["2024-06-01 10:00:00"]))
+    with pytest.raises(ValueError):
+        parse_local_seconds(["2024-06-01 10:00:00", "24-06-01 10:05:00"])
+
+
+def test_grouped_kahan_sum_matches_pandas():
+    rng = np.random.default_rng(0)
+    labels = rng.integers(0, 20, size=1000)
+    values = rng.random(1000) * rng.choice([0.001, 1.0, 1000.0], size=1000)
+    values[rng.integers(0, 1000, size=50)] = np.nan
+
+    expected = pd.Series(values).groupby(labels).sum().to_numpy()
+
+    np.testing.assert_array_equal(grouped_kahan_sum(labels, values, 20), expected)
+
+
+def test_day_slots():
+    assert len(day_slots(pd.Timestamp("2024-06-01 23:55", tz=TIMEZONE))) == 288
+    assert len(day_slots(pd.Timestamp("2024-03-31 23:55", tz=TIMEZONE))) == 276
+    assert len(day_slots(pd.Timestamp("2024-06-01 00:00", tz=TIMEZONE))) == 1
+
+
+def test_production_to_df():
+    date = pd.Timestamp("2024-06-01 12:35", tz=TIMEZONE)
+    text = huawei_accumulated_csv("2024-06-01", inverters=3, until=date)
+    expected_df = handle_missing_intervals(huawei_datalogger_csv_parser(io.StringIO(text), date), date)
+
+    pd.testing.assert_frame_equal(datalogger_production(text, date).to_df(), expected_df, check_freq=False)
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 100000])
+def test_csv_state_production(chunk_size):
+    date = pd.Timestamp("2024-06-01 12:35", tz=TIMEZONE)
+    raw = huawei_accumulated_csv("2024-06-01", inverters=3, until=date).encode("utf-8")[:-1]  # last line pending
+
+    state = HuaweiCsvState()
+    for i in range(0, len(raw), chunk_size):
+        state.feed(raw[i:i + chunk_size])
+
+    assert csv_state_production(state, date).to_json_str() == pandas_json(raw.decode("utf-8"), date)
+
+
+def test_serialize_pod_numpy_engine():
+    date = pd.Timestamp("2024-06-01 12:35", tz=TIMEZONE)
+    text = huawei_accumulated_csv("2024-06-01", inverters=3, until=date)
+
+    with patch("lib.sftp_conn.load_app_config", return_value=AppConfig(huawei_parser_engine="numpy")):
+        production = process_datalogger_csv(text.encode("utf-8"), date)
+    json_io = serialize_pod("pod_123", production)
+
+    assert isinstance(production, Production)
+    assert json_io.getvalue().decode("utf-8") == pandas_json(text, date)
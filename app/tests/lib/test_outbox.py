@@ -0,0 +1,176 @@
+import io
+import os
+import threading
+from unittest.mock import patch, MagicMock
+
+import pandas as pd
+import pytest
+
+from lib import TIMEZONE
+from lib.config import AppConfig, OutboxConfig, ShardingConfig
+from lib.outbox import Outbox, OutboxUploader, pod_id_of
+from lib.sharding import Lease, Shard
+from lib.sftp_conn import send_json
+
+DATE = pd.Timestamp("2024-03-04 10:00", tz=TIMEZONE)
+
+
+@pytest.fixture
+def outbox(tmp_path):
+    return Outbox(config=OutboxConfig(retry_min=10, retry_max=25), root=str(tmp_path / "outbox"))
+
+
+class FakePool:
+    """
+    FtpPool writing files to dict - results of consecutive writes are given in advance
+    """
+    def __init__(self, results: list | None = None):
+        self.results = results
+        self.files = {}
+
+    def write_file(self, pod_id: str, filename: str, binary_data: io.BytesIO) -> bool:
+        written = self.results.pop(0) if self.results else True
+        if written:
+            self.files[filename] = binary_data.read()
+        return written
+
+    def close(self):
+        pass
+
+
+def test_put_replaces_pending_json_of_same_pod_and_day(outbox):
+    outbox.put("pod_a", DATE, io.BytesIO(b"old"))
+    outbox.put("pod_a", DATE + pd.Timedelta(minutes=5), io.BytesIO(b"new"))
+    outbox.put("pod_b", DATE, io.BytesIO(b"other"))
+
+    assert sorted(outbox.pending()) == ["pod_a-2024-03-04.json", "pod_b-2024-03-04.json"]
+    with open(os.path.join(outbox.root, "pod_a-2024-03-04.json"), 'rb') as f:
+        assert f.read() == b"new"
+    assert not [s for s in os.listdir(outbox.root) if s.endswith(".part")]
+
+
+def test_pod_id_of():
+    assert pod_id_of("EU-POD-1-2024-03-04.json") == "EU-POD-1"
+
+
+def test_drain_uploads_and_deletes(outbox):
+    outbox.put("pod_a", DATE, io.BytesIO(b"json a"))
+    outbox.put("pod_b", DATE, io.BytesIO(b"json b"))
+    pool = FakePool()
+
+    uploaded, failed = outbox.drain(pool, now=0)
+
+    assert sorted(uploaded) == ["pod_a-2024-03-04.json", "pod_b-2024-03-04.json"]
+    assert not failed
+    assert pool.files == {"pod_a-2024-03-04.json": b"json a", "pod_b-2024-03-04.json": b"json b"}
+    assert outbox.pending() == []
+
+
+def test_drain_backoff(outbox):
+    outbox.put("pod_a", DATE, io.BytesIO(b"json a"))
+    pool = FakePool(results=[False, False, False, True])
+
+    assert outbox.drain(pool, now=0) == ([], ["pod_a-2024-03-04.json"])
+    assert outbox.drain(pool, now=5) == ([], [])  # first retry after 10 s
+    assert outbox.drain(pool, now=10) == ([], ["pod_a-2024-03-04.json"])
+    assert outbox.next_due(now=10) == 20  # doubled
+    assert outbox.drain(pool, now=30) == ([], ["pod_a-2024-03-04.json"])
+    assert outbox.next_due(now=30) == 25  # retry_max
+    assert outbox.drain(pool, now=55) == (["pod_a-2024-03-04.json"], [])
+    assert outbox.next_due(now=55) is None
+
+
+def test_newer_json_is_tried_at_once(outbox):
+    outbox.put("pod_a", DATE, io.BytesIO(b"old"))
+    outbox.drain(FakePool(results=[False]), now=0)
+    outbox.put("pod_a", DATE, io.BytesIO(b"new"))
+    pool = FakePool()
+
+    assert outbox.drain(pool, now=1) == (["pod_a-2024-03-04.json"], [])
+    assert pool.files == {"pod_a-2024-03-04.json": b"new"}
+
+
+def test_json_replaced_during_upload_stays_pending(outbox):
+    outbox.put("pod_a", DATE, io.BytesIO(b"old"))
+
+    class ReplacingPool(FakePool):
+        def write_file(self, pod_id, filename, binary_data):
+            outbox.put("pod_a", DATE, io.BytesIO(b"new"))
+            return super().write_file(pod_id, filename, binary_data)
+
+    pool = ReplacingPool()
+    outbox.drain(pool, now=0)
+
+    assert pool.files == {"pod_a-2024-03-04.json": b"old"}
+    assert outbox.pending() == ["pod_a-2024-03-04.json"]
+    pool = FakePool()
+    outbox.drain(pool, now=0)
+    assert pool.files == {"pod_a-2024-03-04.json": b"new"}
+    assert outbox.pending() == []
+
+
+def test_pending_survives_restart(outbox):
+    outbox.put("pod_a", DATE, io.BytesIO(b"json a"))
+    pool = FakePool()
+
+    Outbox(config=outbox.config, root=outbox.root).drain(pool, now=0)
+
+    assert pool.files == {"pod_a-2024-03-04.json": b"json a"}
+
+
+def test_uploader_drains_on_put(outbox):
+    uploaded = threading.Event()
+
+    class SignallingPool(FakePool):
+        def write_file(self, pod_id, filename, binary_data):
+            written = super().write_file(pod_id, filename, binary_data)
+            uploaded.set()
+            return written
+
+    pool = SignallingPool()
+    uploader = OutboxUploader(outbox, pool)
+    uploader.start()
+    try:
+        outbox.put("pod_a", DATE, io.BytesIO(b"json a"))
+        assert uploaded.wait(timeout=5)
+    finally:
+        uploader.stop(timeout=5)
+
+    assert not uploader.is_alive()
+    assert pool.files == {"pod_a-2024-03-04.json": b"json a"}
+
+
+def test_owner_adopts_pending_jsons_of_dead_worker(tmp_path):
+    config = OutboxConfig(retry_min=10, retry_max=25)
+    shard = Shard("worker_1", config=ShardingConfig(lease_ttl=60), root=str(tmp_path / "leases"))
+    shard.lease.renew()
+    Lease("worker_2", root=shard.root).renew()
+    own, live, dead = (Outbox(config=config, root=str(tmp_path / "outbox" / s))
+                       for s in ("worker_1", "worker_2", "worker_3"))
+    pod_ids = [f"pod_{i}" for i in range(20)]
+    owned = shard.owned(pod_ids)
+    assert 0 < len(owned) < len(pod_ids)
+    for pod_id in pod_ids:
+        dead.put(pod_id, DATE, io.BytesIO(b"dead"))
+        live.put(pod_id, DATE, io.BytesIO(b"live"))
+    own.put(owned[0], DATE, io.BytesIO(b"newer"))  # written after the dead worker's json
+
+    adopted = own.adopt_orphans(shard)
+
+    assert sorted(adopted) == sorted(f"{s}-2024-03-04.json" for s in owned[1:])
+    assert sorted(own.pending()) == sorted(f"{s}-2024-03-04.json" for s in owned)
+    with open(os.path.join(own.root, f"{owned[0]}-2024-03-04.json"), 'rb') as f:
+        assert f.read() == b"newer"
+    assert sorted(dead.pending()) == sorted(f"{s}-2024-03-04.json" for s in pod_ids if s not in owned)
+    assert len(live.pending()) == len(pod_ids)
+
+
+def test_send_json_to_outbox(outbox):
+    pool = MagicMock()
+
+    with patch("lib.sftp_conn.load_app_config", return_value=AppConfig(outbox={"enabled": True})), \
+            patch("lib.outbox.default_outbox", return_value=outbox):
+        assert send_json("pod_a", DATE, io.BytesIO(b"json a"), pool=pool)
+
+    pool.write_file.assert_not_called()
+    assert outbox.pending() == ["pod_a-2024-03-04.json"]
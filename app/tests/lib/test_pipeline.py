@@ -0,0 +1,84 @@
+import asyncio
+import io
+import threading
+from unittest.mock import patch
+
+import pandas as pd
+import pytest
+
+from lib import TIMEZONE
+from lib.config import PipelineConfig
+from lib.pipeline import run_pipeline
+from lib.sftp_conn import PodFiles, SourceType
+
+
+@pytest.fixture
+def mock_sftp():
+    with patch("lib.pipeline.SftpConn") as MockSftp:
+        yield MockSftp
+
+
+def test_run_pipeline_overlaps_upload_and_fetch(mock_sftp):
+    date = pd.Timestamp("2024-03-04 10:00", tz=TIMEZONE)
+    first_uploaded = threading.Event()
+
+    def fetch(sftp, pod_id, date):
+        if pod_id == "pod_b":  # second POD is downloaded only after first POD upload started
+            assert first_uploaded.wait(timeout=5)
+        return PodFiles(pod_id=pod_id, source=SourceType.replacement, files=[], contents={})
+
+    def write(pod_id, date, json_io, pool):
+        assert isinstance(json_io, io.BytesIO)
+        first_uploaded.set()
+        return True
+
+    with patch("lib.pipeline.list_pod_ids", return_value=["pod_a", "pod_b"]), \
+            patch("lib.pipeline.fetch_pod", side_effect=fetch), \
+            patch("lib.pipeline.send_json", side_effect=write) as mock_write:
+        result = asyncio.run(run_pipeline(date, PipelineConfig(producers=1, workers=1, uploaders=1)))
+
+    assert result.uploaded == ["pod_a", "pod_b"]
+    assert not result.failed
+    assert mock_write.call_count == 2
+    mock_sftp.return_value.close.assert_called()
+
+
+def test_run_pipeline_skips_failed_pod(mock_sftp):
+    date = pd.Timestamp("2024-03-04 10:00", tz=TIMEZONE)
+
+    def fetch(sftp, pod_id, date):
+        if pod_id == "pod_a":
+            raise IOError("connection lost")
+        return PodFiles(pod_id=pod_id, source=SourceType.replacement, files=[], contents={})
+
+    with patch("lib.pipeline.list_pod_ids", return_value=["pod_a", "pod_b", "pod_c"]), \
+            patch("lib.pipeline.fetch_pod", side_effect=fetch), \
+            patch("lib.pipeline.send_json") as mock_write:
+        result = asyncio.run(run_pipeline(date, PipelineConfig(producers=2, workers=2, uploaders=2)))
+
+    assert sorted(result.uploaded) == ["pod_b", "pod_c"]
+    assert result.failed == ["pod_a"]
+    assert mock_write.call_count == 2
+    assert mock_sftp.call_count == 2
+
+
+def test_run_pipeline_survives_failed_upload(mock_sftp):
+    date = pd.Timestamp("2024-03-04 10:00", tz=TIMEZONE)
+
+    def fetch(sftp, pod_id, date):
+        return PodFiles(pod_id=pod_id, source=SourceType.replacement, files=[], contents={})
+
+    def write(pod_id, date, json_io, pool):
+        if pod_id == "pod_a":
+            raise OSError("outbox full")
+        return True
+
+    with patch("lib.pipeline.list_pod_ids", return_value=["pod_a", "pod_b", "pod_c"]), \
+            patch("lib.pipeline.fetch_pod", side_effect=fetch), \
+            patch("lib.pipeline.send_json", side_effect=write), \
+            patch("lib.pipeline.archive_pod", side_effect=KeyError("pod_b")):
+        result = asyncio.run(asyncio.wait_for(run_pipeline(date, PipelineConfig(producers=1, workers=1, uploaders=1)),
+                                              timeout=10))
+
+    assert result.uploaded == ["pod_b", "pod_c"]
+    assert result.failed == ["pod_a"]
@@ -0,0 +1,146 @@
+import os
+import pstats
+import threading
+import time
+from unittest.mock import patch
+
+import pytest
+
+from lib import metrics, profiling
+from lib.config import AppConfig
+
+
+def parse_block():
+    return sum(i * i for i in range(1000))
+
+
+def upload_block():
+    return sorted(range(1000), reverse=True)
+
+
+def job(date=None):
+    with metrics.cycle(date=date):
+        with metrics.stage("parse"):
+            parse_block()
+        worker = threading.Thread(target=stage_in_thread)
+        worker.start()
+        worker.join()
+    return "done"
+
+
+def stage_in_thread():
+    with metrics.stage("upload"):
+        upload_block()
+
+
+def profiles() -> list:
+    return sorted(os.listdir(profiling.PROFILES_DIR)) if os.path.isdir(profiling.PROFILES_DIR) else []
+
+
+def function_names(path: str) -> set:
+    return {name for _, _, name in pstats.Stats(path).stats}
+
+
+@pytest.fixture
+def settings():
+    def configure(**profiling_config):
+        return patch("lib.config.load_app_config", return_value=AppConfig(profiling=profiling_config))
+    return configure
+
+
+def test_not_profiled_by_default():
+    assert profiling.profiled(job)() == "done"
+    assert profiles() == []
+
+
+def test_every_nth_cycle(settings):
+    with settings(every=2):
+        for _ in range(4):
+            assert profiling.profiled(job)() == "done"
+
+    assert len(profiles()) == 4  # .prof and .txt of cycles 2 and 4
+    prof = [s for s in profiles() if s.endswith(".prof")][0]
+    names = function_names(os.path.join(profiling.PROFILES_DIR, prof))
+    assert {"parse_block", "upload_block"} <= names  # stage of other thread included
+    with open(os.path.join(profiling.PROFILES_DIR, prof.replace(".prof", ".txt"))) as f:
+        text = f.read()
+    assert "profiled because of every" in text and "tracemalloc peak" in text
+
+
+def test_selected_stages_only(settings):
+    with settings(every=1, stages=["upload"], memory=False):
+        profiling.profiled(job)()
+
+    prof = [s for s in profiles() if s.endswith(".prof")][0]
+    names = function_names(os.path.join(profiling.PROFILES_DIR, prof))
+    assert "upload_block" in names
+    assert "parse_block" not in names
+
+
+def test_report_of_selected_functions(settings):
+    with settings(every=1, functions=["parse_block"], memory=False):
+        profiling.profiled(job)()
+
+    with open(os.path.join(profiling.PROFILES_DIR, [s for s in profiles() if s.endswith(".txt")][0])) as f:
+        text = f.read()
+    assert "(parse_block)" in text
+    assert "(upload_block)" not in text
+
+
+def test_threshold_keeps_slow_cycles_only(settings):
+    def slow_job(date=None):
+        with metrics.stage("parse"):
+            time.sleep(0.3)
+
+    with settings(threshold=0.2):
+        profiling.profiled(job)()
+        assert profiles() == []
+        profiling.profiled(slow_job)()
+
+    assert [s.split("-", 1)[1] for s in profiles()] == ["threshold.prof", "threshold.txt"]
+    with open(os.path.join(profiling.PROFILES_DIR, profiles()[1])) as f:
+        assert "tracemalloc" not in f.read()  # memory is off in threshold mode by default
+
+
+def test_trigger_file_profiles_next_cycle(settings):
+    open(profiling.PROFILE_TRIGGER, "w").close()
+
+    profiling.profiled(job)()
+    profiling.profiled(job)()
+
+    assert not os.path.exists(profiling.PROFILE_TRIGGER)
+    assert [s.split("-", 1)[1] for s in profiles()] == ["trigger.prof", "trigger.txt"]
+
+
+def test_environment_overrides_config(settings, monkeypatch):
+    monkeypatch.setenv(profiling.PROFILE_EVERY_ENV, "1")
+    monkeypatch.setenv(profiling.PROFILE_STAGES_ENV, "parse, upload")
+
+    with settings(every=0):
+        config = profiling.profile_settings()
+
+    assert config.every == 1
+    assert config.stages == ["parse", "upload"]
+
+
+def test_rotate_keeps_newest(tmp_path):
+    for name in ["20240304T100000-every", "20240304T100500-every", "20240304T101000-trigger"]:
+        for extension in (".prof", ".txt"):
+            (tmp_path / (name + extension)).write_text("")
+
+    removed = profiling.rotate(keep=2, root=str(tmp_path))
+
+    assert sorted(os.path.basename(s) for s in removed) == ["20240304T100000-every.prof", "20240304T100000-every.txt"]
+    assert len(os.listdir(tmp_path)) == 4
+
+
+def test_failing_cycle_is_profiled(settings):
+    def failing_job(date=None):
+        with metrics.stage("parse"):
+            raise IOError("connection lost")
+
+    with settings(every=1, memory=False), pytest.raises(IOError):
+        profiling.profiled(failing_job)()
+
+    assert len(profiles()) == 2
+    assert profiling.current() is None
@@ -0,0 +1,138 @@
+import os
+import signal
+import threading
+import time
+from unittest.mock import patch, MagicMock
+
+import pandas as pd
+import pytest
+from apscheduler.events import EVENT_JOB_MAX_INSTANCES, EVENT_JOB_MISSED
+
+from lib import TIMEZONE
+from lib.config import SchedulerConfig
+from lib.metrics import MetricsTotals
+from lib.scheduler import PodOrder, run_cycle, count_scheduler_event, run_scheduler
+from lib.sftp_conn import sftp_read_bytes
+
+
+@pytest.fixture
+def mock_sftp():
+    with patch("lib.scheduler.SftpConn") as MockSftp, patch("lib.scheduler.FtpPool"):
+        yield MockSftp
+
+
+@pytest.fixture
+def pod_order():
+    with patch("lib.scheduler.pod_order", PodOrder()) as order:
+        yield order
+
+
+def test_pod_order_slowest_first_unknown_first():
+    order = PodOrder(smoothing=0.5)
+    order.update("pod_a", 1.0)
+    order.update("pod_b", 3.0)
+    order.update("pod_c", 2.0)
+    order.update("pod_b", 0.0)  # smoothed to 1.5
+
+    assert order.sort(["pod_a", "pod_b", "pod_c", "pod_new"]) == ["pod_new", "pod_c", "pod_b", "pod_a"]
+
+
+def test_run_cycle_skips_pods_after_deadline(mock_sftp, pod_order):
+    date = pd.Timestamp("2024-03-04 10:00", tz=TIMEZONE)
+    pod_order.update("pod_slow", 10)
+    pod_order.update("pod_fast", 1)
+
+    def process(sftp, pool, pod_id, date):
+        time.sleep(0.2)
+        return True
+
+    with patch("lib.scheduler.list_pod_ids", return_value=["pod_fast", "pod_slow"]), \
+            patch("lib.scheduler.process_pod", side_effect=process):
+        result = run_cycle(date, SchedulerConfig(cycle_deadline=0.1, pod_budget=5))
+
+    assert result.uploaded == ["pod_slow"]
+    assert result.skipped == ["pod_fast"]
+    assert mock_sftp.return_value.timeout == pytest.approx(0.1, abs=0.05)
+
+
+def slow_read_pod(sftp, pod_id, date):
+    """
+    POD of five files, every read takes 0.1 s
+    """
+    sftp.open.return_value.__enter__.return_value.read.side_effect = lambda: time.sleep(0.1) or b"data"
+    for i in range(5):
+        sftp_read_bytes(sftp=sftp, filename=f"{pod_id}-{i}.csv")
+    return pd.DataFrame()
+
+
+@pytest.mark.parametrize("config, pods_timed_out", [
+    (SchedulerConfig(cycle_deadline=0.25, pod_budget=5), 1),
+    (SchedulerConfig(cycle_deadline=5, pod_budget=0.25), 2),
+])
+def test_run_cycle_gives_up_slow_pod(mock_sftp, pod_order, config, pods_timed_out):
+    date = pd.Timestamp("2024-03-04 10:00", tz=TIMEZONE)
+
+    start = time.monotonic()
+    with patch("lib.scheduler.list_pod_ids", return_value=["pod_a", "pod_b"]), \
+            patch("lib.scheduler.read_pod", side_effect=slow_read_pod), \
+            patch("lib.scheduler.upload_pod", return_value=True) as upload_pod:
+        result = run_cycle(date, config)
+    elapsed = time.monotonic() - start
+
+    assert elapsed < pods_timed_out * (0.25 + 0.1) + 0.1  # limit plus one read in flight per POD
+    assert result.failed == ["pod_a", "pod_b"][:pods_timed_out]
+    assert result.skipped == ["pod_a", "pod_b"][pods_timed_out:]
+    upload_pod.assert_not_called()
+    assert 0 < mock_sftp.return_value.timeout < 0.25  # shortened to the time left at each read
+
+
+def test_run_cycle_reconnects_after_failed_pod(mock_sftp, pod_order):
+    date = pd.Timestamp("2024-03-04 10:00", tz=TIMEZONE)
+    sessions = [MagicMock(name="first"), MagicMock(name="second")]
+    mock_sftp.side_effect = sessions
+
+    def process(sftp, pool, pod_id, date):
+        if pod_id == "pod_a":
+            raise TimeoutError("read timed out")
+        assert sftp is sessions[1]
+        return pod_id == "pod_b"
+
+    with patch("lib.scheduler.list_pod_ids", return_value=["pod_a", "pod_b", "pod_c"]), \
+            patch("lib.scheduler.process_pod", side_effect=process):
+        result = run_cycle(date, SchedulerConfig())
+
+    assert result.uploaded == ["pod_b"]
+    assert result.failed == ["pod_a", "pod_c"]
+    assert not result.skipped
+    sessions[0].close.assert_called()
+    sessions[1].close.assert_called()
+
+
+def test_count_scheduler_event(tmp_path):
+    totals = MetricsTotals()
+    with patch("lib.metrics.totals", totals), patch("lib.metrics.METRICS_PROM", str(tmp_path / "metrics.prom")):
+        count_scheduler_event(MagicMock(code=EVENT_JOB_MAX_INSTANCES))
+        count_scheduler_event(MagicMock(code=EVENT_JOB_MISSED))
+        count_scheduler_event(MagicMock(code=EVENT_JOB_MISSED))
+
+    assert totals.events == {"cycles_skipped_running": 1, "cycles_missed": 2}
+    assert 'cez_ftp_events_total{event="cycles_missed"} 2' in (tmp_path / "metrics.prom").read_text()
+
+
+def test_run_scheduler_stops_on_sigterm():
+    handlers = {s: signal.getsignal(s) for s in (signal.SIGINT, signal.SIGTERM)}
+    timer = threading.Timer(0.2, os.kill, args=(os.getpid(), signal.SIGTERM))
+    try:
+        with patch("apscheduler.schedulers.background.BackgroundScheduler") as MockScheduler:
+            timer.start()
+            run_scheduler(MagicMock(), misfire_grace_time=10)
+    finally:
+        timer.cancel()
+        for signum, handler in handlers.items():
+            signal.signal(signum, handler)
+
+    scheduler = MockScheduler.return_value
+    assert scheduler.add_job.call_args.kwargs["max_instances"] == 1
+    assert scheduler.add_job.call_args.kwargs["coalesce"] is True
+    scheduler.start.assert_called_once()
+    scheduler.shutdown.assert_called_once()
@@ -1,4 +1,9 @@
+import ftplib
 import io
+import os
+import stat
+import threading
+import time
 from unittest.mock import MagicMock, patch
 import unittest
 
@@ -6,9 +11,15 @@ import pandas as pd
 import pytest
 from pydantic import ValidationError
 
-from lib import LOGGER_DT_FMT
-from lib.csv_reader import replacement_data, startDate, quantity, status
-from lib.sftp_conn import SftpConn, read_last_interval, sftp_write_jsons, FTPConfig, FtpConn
+from lib import LOGGER_DT_FMT, TEST_DATA, TIMEZONE, metrics
+from lib.csv_reader import (replacement_data, startDate, quantity, status, huawei_datalogger_csv_parser,
+                            handle_missing_intervals)
+from lib.config import AppConfig
+from lib.sftp_conn import (SftpConn, read_last_interval, sftp_write_jsons, FTPConfig, FtpConn, FtpPool,
+                           sftp_read_and_process_csv_incremental, huawei_csv_states, hub_file_caches,
+                           sftp_read_and_process_hub_csv, sftp_read_and_process_hub_csv_cached, PodFiles,
+                           SourceType, parse_pod, list_pod_ids, root_listings, stream_json, hub_file_times,
+                           select_pod_files, CycleResult)
 
 
 def test_data_sources_config():
@@ -41,22 +52,38 @@ def test_invalid_data_sources_config():
 
 @pytest.fixture
 def mock_sftp():
+    root_listings.clear()
     with patch("lib.sftp_conn.SftpConn") as MockSftp:
         sftp = MockSftp.return_value.__enter__.return_value
+        sftp.stat.return_value.st_mtime = 1000
         yield sftp
+    root_listings.clear()
+
+
+@pytest.fixture
+def pod_ftp_configs():
+    configs = {"pod_123": FTPConfig(host="localhost", port=21, username="pod_123", password="password")}
+    with patch("lib.sftp_conn.load_ftp_configs", return_value=configs):
+        yield configs
+
+
+def dir_entry(name: str) -> MagicMock:
+    return MagicMock(filename=name, st_mode=stat.S_IFDIR | 0o755)
+
+
+def file_entry(name: str, st_mtime: int = 12345) -> MagicMock:
+    return MagicMock(filename=name, st_mode=stat.S_IFREG | 0o644, st_mtime=st_mtime)
 
 
 def test_no_directories(mock_sftp):
-    mock_sftp.listdir.return_value = []
+    mock_sftp.listdir_attr.return_value = [file_entry("readme.txt")]
 
     with pytest.raises(ValueError, match="No directories found on sftp"):
         read_last_interval(pd.Timestamp("2024-03-04 00:00"))
 
 
-def test_read_last_interval_empty_dir(mock_sftp):
-    mock_sftp.listdir.return_value = ["pod_123"]
-    mock_sftp.isdir.return_value = True
-    mock_sftp.listdir_attr.return_value = []
+def test_read_last_interval_empty_dir(mock_sftp, pod_ftp_configs):
+    mock_sftp.listdir_attr.side_effect = [[dir_entry("pod_123")], []]
 
     date = pd.Timestamp("2024-03-04 00:00")
     replacement_df = replacement_data(date)
@@ -67,13 +94,11 @@ def test_read_last_interval_empty_dir(mock_sftp):
     mock_replacement.assert_called_once_with(date)
 
 
-def test_read_last_interval_single_file(mock_sftp):
+def test_read_last_interval_single_file(mock_sftp, pod_ftp_configs):
     date = pd.Timestamp("2024-03-04")
-    mock_sftp.listdir.return_value = ["pod_123"]
-    mock_sftp.isdir.return_value = True
-    mock_sftp.listdir_attr.return_value = [
-        MagicMock(filename=f"{date.strftime(LOGGER_DT_FMT)}.csv", st_mtime=12345)
-    ]
+    filename = f"min{date.strftime(LOGGER_DT_FMT)}.csv"
+    mock_sftp.listdir_attr.side_effect = [[dir_entry("pod_123"), dir_entry("pod_unknown"), file_entry("readme.txt")],
+                                          [file_entry(filename)]]
 
     sftp_processed_data = pd.DataFrame([
         {startDate: pd.Timestamp('2025-03-03 23:00:00+0000', tz='UTC'), status: 'w', quantity: 0.0},
@@ -83,20 +108,18 @@ def test_read_last_interval_single_file(mock_sftp):
     with patch("lib.sftp_conn.sftp_read_and_process_csv", return_value=sftp_processed_data) as mock_csv_reader:
         result = read_last_interval(date)
 
-    assert "pod_123" in result
+    assert list(result) == ["pod_123"]
     assert not result["pod_123"].empty
     assert isinstance(result["pod_123"], pd.DataFrame)
-    mock_csv_reader.assert_called_once_with(sftp=mock_sftp, filename=f"{date.strftime(LOGGER_DT_FMT)}.csv", date=date)
+    mock_csv_reader.assert_called_once_with(sftp=mock_sftp, filename=filename, date=date)
+    mock_sftp.isdir.assert_not_called()
 
 
-def test_read_last_interval_multiple_files(mock_sftp):
+def test_read_last_interval_multiple_files(mock_sftp, pod_ftp_configs):
     date = pd.Timestamp("2024-03-04")
-    mock_sftp.listdir.return_value = ["pod_123"]
-    mock_sftp.isdir.return_value = True
-    mock_sftp.listdir_attr.return_value = [
-        MagicMock(filename=f"{date.strftime(LOGGER_DT_FMT)}.csv", st_mtime=12345),
-        MagicMock(filename=f"{date.strftime(LOGGER_DT_FMT)}.csv", st_mtime=23456),
-    ]
+    filename = f"min{date.strftime(LOGGER_DT_FMT)}.csv"
+    mock_sftp.listdir_attr.side_effect = [[dir_entry("pod_123")],
+                                          [file_entry(filename, st_mtime=12345), file_entry(filename, st_mtime=23456)]]
 
     sftp_processed_data = pd.DataFrame([
         {startDate: pd.Timestamp('2025-03-03 23:00:00+0000', tz='UTC'), status: 'w', quantity: 0.0},
@@ -109,7 +132,41 @@ def test_read_last_interval_multiple_files(mock_sftp):
     assert "pod_123" in result
     assert len(result) == 1
     assert not result["pod_123"].empty
-    mock_csv_reader.assert_called_once_with(sftp=mock_sftp, filename=f"{date.strftime(LOGGER_DT_FMT)}.csv", date=date)
+    mock_csv_reader.assert_called_once_with(sftp=mock_sftp, filename=filename, date=date)
+
+
+def test_list_pod_ids_reuses_root_listing(mock_sftp, pod_ftp_configs):
+    mock_sftp.listdir_attr.return_value = [dir_entry("pod_123"), dir_entry("pod_unknown")]
+
+    assert list_pod_ids(mock_sftp) == ["pod_123"]
+    assert list_pod_ids(mock_sftp) == ["pod_123"]
+    assert mock_sftp.listdir_attr.call_count == 1
+
+    mock_sftp.stat.return_value.st_mtime = 2000  # directory added or removed
+    mock_sftp.listdir_attr.return_value = [dir_entry("pod_123"), dir_entry("pod_456")]
+    ftp_configs_2 = dict(pod_ftp_configs, pod_456=pod_ftp_configs["pod_123"])
+    with patch("lib.sftp_conn.load_ftp_configs", return_value=ftp_configs_2):
+        assert list_pod_ids(mock_sftp) == ["pod_123", "pod_456"]
+    assert mock_sftp.listdir_attr.call_count == 2
+
+
+def test_list_pod_ids_ttl_expired(mock_sftp, pod_ftp_configs):
+    mock_sftp.listdir_attr.return_value = [dir_entry("pod_123")]
+
+    with patch("lib.sftp_conn.load_app_config", return_value=AppConfig(root_listing_ttl=0)):
+        list_pod_ids(mock_sftp)
+        list_pod_ids(mock_sftp)
+
+    assert mock_sftp.listdir_attr.call_count == 2
+    mock_sftp.stat.assert_not_called()
+
+
+def test_list_pod_ids_resolves_symlinks(mock_sftp, pod_ftp_configs):
+    mock_sftp.listdir_attr.return_value = [MagicMock(filename="pod_123", st_mode=stat.S_IFLNK | 0o777)]
+    mock_sftp.isdir.return_value = True
+
+    assert list_pod_ids(mock_sftp) == ["pod_123"]
+    mock_sftp.isdir.assert_called_once_with("pod_123")
 
 
 @pytest.fixture
@@ -155,3 +212,264 @@ def test_write_file(mock_quit, mock_storbinary, mock_open):
     mock_storbinary.assert_called_once_with(f"STOR {filename}", binary_data)
 
     mock_quit.assert_called_once()
+
+
+def test_sftp_read_and_process_csv_incremental():
+    with open(os.path.join(TEST_DATA, 'huawei_datalogger_csv_parser_valid.csv'), 'rb') as f:
+        raw = f.read()
+    date = pd.Timestamp('2025-03-03 12:20:00', tz=TIMEZONE)
+    filename = f"min{date.strftime(LOGGER_DT_FMT)}.csv"
+    split = raw.index(b"#INV2")
+
+    remote = io.BytesIO(raw[:split])
+    mock_sftp = MagicMock()
+    mock_sftp.open.return_value.__enter__.return_value = remote
+
+    huawei_csv_states.clear()
+    file_attr = MagicMock(filename=filename, st_size=split, st_mtime=1)
+    sftp_read_and_process_csv_incremental(sftp=mock_sftp, pod_id="pod_123", file_attr=file_attr, date=date)
+    assert huawei_csv_states[("pod_123", filename)].offset == split
+
+    remote.write(raw[split:])  # datalogger appended data of second inverter
+    file_attr = MagicMock(filename=filename, st_size=len(raw), st_mtime=2)
+    result = sftp_read_and_process_csv_incremental(sftp=mock_sftp, pod_id="pod_123", file_attr=file_attr, date=date)
+
+    expected = handle_missing_intervals(huawei_datalogger_csv_parser(io.StringIO(raw.decode('utf-8')), date), date)
+    pd.testing.assert_frame_equal(result, expected)
+    assert huawei_csv_states[("pod_123", filename)].offset == len(raw)
+
+    # unchanged file is not opened again
+    mock_sftp.open.reset_mock()
+    sftp_read_and_process_csv_incremental(sftp=mock_sftp, pod_id="pod_123", file_attr=file_attr, date=date)
+    mock_sftp.open.assert_not_called()
+
+    # shrunk file falls back to full read
+    remote.seek(0)
+    remote.truncate()
+    remote.write(raw[:split])
+    file_attr = MagicMock(filename=filename, st_size=split, st_mtime=3)
+    sftp_read_and_process_csv_incremental(sftp=mock_sftp, pod_id="pod_123", file_attr=file_attr, date=date)
+    assert huawei_csv_states[("pod_123", filename)].offset == split
+
+
+def test_sftp_read_and_process_hub_csv_cached():
+    with open(os.path.join(TEST_DATA, 'pecom_hub_csv_parser_valid.csv'), 'rb') as f:
+        raw = f.read()
+    date = pd.Timestamp('2025-04-09 16:00:00', tz=TIMEZONE)
+    mock_sftp = MagicMock()
+    mock_sftp.open.side_effect = lambda *args, **kwargs: MagicMock(
+        __enter__=MagicMock(return_value=io.BytesIO(raw)))
+
+    hub_file_caches.clear()
+    files = [MagicMock(filename="20250409 135000-hub.csv", st_size=len(raw), st_mtime=1)]
+    result = sftp_read_and_process_hub_csv_cached(sftp=mock_sftp, pod_id="project", files_attrs=files, date=date)
+    expected = sftp_read_and_process_hub_csv(sftp=mock_sftp, files=[s.filename for s in files], date=date)
+    pd.testing.assert_frame_equal(result, expected)
+    assert mock_sftp.open.call_count == 2
+
+    mock_sftp.open.reset_mock()
+    sftp_read_and_process_hub_csv_cached(sftp=mock_sftp, pod_id="project", files_attrs=files, date=date)
+    mock_sftp.open.assert_not_called()
+
+    files[0].st_mtime = 2
+    sftp_read_and_process_hub_csv_cached(sftp=mock_sftp, pod_id="project", files_attrs=files, date=date)
+    mock_sftp.open.assert_called_once()
+
+
+def test_parse_pod_logger():
+    with open(os.path.join(TEST_DATA, 'huawei_datalogger_csv_parser_valid.csv'), 'rb') as f:
+        raw = f.read()
+    date = pd.Timestamp('2025-03-03 12:20:00', tz=TIMEZONE)
+    file_attr = MagicMock(filename="min20250303.csv", st_size=len(raw), st_mtime=1)
+    pod_files = PodFiles(pod_id="pod_123", source=SourceType.logger, files=[file_attr],
+                         contents={file_attr.filename: raw})
+
+    result = parse_pod(pod_files, date)
+
+    expected = handle_missing_intervals(huawei_datalogger_csv_parser(io.StringIO(raw.decode('utf-8')), date), date)
+    pd.testing.assert_frame_equal(result, expected)
+
+
+@pytest.fixture
+def ftp_configs():
+    config = FTPConfig(host="localhost", port=21, username="user", password="password")
+    other = FTPConfig(host="localhost", port=21, username="other", password="password")
+    configs = {"pod_a": config, "pod_b": config, "pod_c": other}
+    with patch("lib.sftp_conn.load_ftp_configs", return_value=configs):
+        yield configs
+
+
+@patch('ftplib.FTP.quit')
+@patch('ftplib.FTP.voidcmd')
+@patch('ftplib.FTP.storbinary')
+@patch('lib.sftp_conn.FtpConn.open_session')
+def test_ftp_pool_reuses_session(mock_open_session, mock_storbinary, mock_voidcmd, mock_quit, ftp_configs):
+    with FtpPool() as pool:
+        for pod_id in ["pod_a", "pod_b", "pod_c"]:
+            assert pool.write_file(pod_id, f"{pod_id}.json", io.BytesIO(b"{}"))
+
+    assert mock_open_session.call_count == 2  # pod_a and pod_b share credentials
+    assert mock_storbinary.call_count == 3
+    mock_voidcmd.assert_called_once_with("NOOP")
+    assert mock_quit.call_count == 2
+
+
+@patch('ftplib.FTP.close')
+@patch('ftplib.FTP.voidcmd', side_effect=ftplib.error_temp("421 timeout"))
+@patch('ftplib.FTP.storbinary')
+@patch('lib.sftp_conn.FtpConn.open_session')
+def test_ftp_pool_reconnects_dead_session(mock_open_session, mock_storbinary, mock_voidcmd, mock_close, ftp_configs):
+    pool = FtpPool()
+    pool.write_file("pod_a", "pod_a.json", io.BytesIO(b"{}"))
+    pool.write_file("pod_b", "pod_b.json", io.BytesIO(b"{}"))
+
+    assert mock_open_session.call_count == 2
+    mock_close.assert_called_once()
+
+
+@patch('ftplib.FTP.close')
+@patch('ftplib.FTP.storbinary', side_effect=[EOFError(), None])
+@patch('lib.sftp_conn.FtpConn.open_session')
+def test_ftp_pool_retries_failed_write(mock_open_session, mock_storbinary, mock_close, ftp_configs):
+    pool = FtpPool()
+
+    assert pool.write_file("pod_a", "pod_a.json", io.BytesIO(b"{}"))
+    assert mock_open_session.call_count == 2
+    assert mock_storbinary.call_count == 2
+
+
+@patch('lib.sftp_conn.FtpConn.open_session')
+def test_ftp_pool_limits_sessions_per_host(mock_open_session, ftp_configs):
+    active = []
+    peak = []
+    lock = threading.Lock()
+
+    def store(*args, **kwargs):
+        with lock:
+            active.append(1)
+            peak.append(len(active))
+        time.sleep(0.05)
+        with lock:
+            active.pop()
+
+    pool = FtpPool(sessions_per_host=2)
+    with patch('ftplib.FTP.storbinary', side_effect=store), patch('ftplib.FTP.voidcmd'):
+        threads = [threading.Thread(target=pool.write_file, args=("pod_a", "a.json", io.BytesIO(b"{}")))
+                   for _ in range(6)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    assert max(peak) == 2
+    assert mock_open_session.call_count == 2
+
+
+@patch('ftplib.FTP.quit')
+@patch('ftplib.FTP.voidcmd')
+@patch('ftplib.FTP.storbinary')
+@patch('lib.sftp_conn.FtpConn.open_session')
+def test_ftp_pool_idle_sessions_count_against_host_limit(mock_open_session, mock_storbinary, mock_voidcmd, mock_quit,
+                                                         ftp_configs):
+    pool = FtpPool(sessions_per_host=1)
+    with patch('lib.sftp_conn.FtpConn', wraps=FtpConn) as MockFtpConn:
+        assert pool.write_file("pod_a", "pod_a.json", io.BytesIO(b"{}"))
+        assert pool.write_file("pod_c", "pod_c.json", io.BytesIO(b"{}"))  # other username on the same host
+
+    assert [s.args[0] for s in MockFtpConn.call_args_list] == ["pod_a", "pod_c"]
+    mock_quit.assert_called_once()  # idle session of pod_a closed before session of pod_c was opened
+    assert [(key[2], len(idle)) for key, idle in pool._idle.items()] == [("user", 0), ("other", 1)]
+
+
+@patch('lib.sftp_conn.FtpConn.open_session')
+def test_ftp_pool_write_chunks_retries_with_new_chunks(mock_open_session, ftp_configs):
+    calls = []
+
+    def store(filename, chunks):
+        chunks = list(chunks)
+        calls.append(chunks)
+        if len(calls) == 1:
+            raise EOFError()
+        return sum(len(s) for s in chunks)
+
+    pool = FtpPool()
+    with patch('lib.sftp_conn.FtpConn.store_chunks', side_effect=store), patch('ftplib.FTP.close'):
+        sent = pool.write_chunks("pod_a", "pod_a.json", lambda: iter([b"{", b"}"]))
+
+    assert sent == 2
+    assert calls == [[b"{", b"}"], [b"{", b"}"]]
+    assert mock_open_session.call_count == 2
+
+
+@patch('lib.sftp_conn.FtpConn.open_session')
+def test_ftp_pool_pod_without_config(mock_open_session, ftp_configs):
+    pool = FtpPool()
+
+    assert not pool.write_file("pod_x", "pod_x.json", io.BytesIO(b"{}"))
+    assert pool.write_chunks("pod_x", "pod_x.json", lambda: iter([b"{}"])) is None
+    mock_open_session.assert_not_called()
+
+
+@patch('ftplib.FTP.quit')
+@patch('lib.sftp_conn.FtpConn.start_connection')
+def test_write_chunks_returns_bytes_sent(mock_start_connection, mock_quit, mock_open):
+    ftp_conn = FtpConn('ftp_name')
+
+    with patch('lib.sftp_conn.FtpConn.store_chunks', return_value=2) as mock_store:
+        assert ftp_conn.write_chunks("test.json", iter([b"{", b"}"])) == 2
+    with patch('lib.sftp_conn.FtpConn.store_chunks', side_effect=EOFError()):
+        assert ftp_conn.write_chunks("test.json", iter([b"{}"])) is None
+    mock_store.assert_called_once()
+
+
+@pytest.mark.parametrize("pooled", [True, False])
+def test_stream_json_records_upload_bytes(pooled, ftp_configs):
+    def write_chunks(*args, chunks, **kwargs):
+        return sum(len(s) for s in (chunks() if callable(chunks) else chunks))
+
+    date = pd.Timestamp("2024-03-03 00:20", tz=TIMEZONE)
+    pool = MagicMock(write_chunks=MagicMock(side_effect=write_chunks)) if pooled else None
+    with metrics.cycle() as cycle_metrics, \
+            patch('lib.sftp_conn.FtpConn') as MockFtpConn:
+        MockFtpConn.return_value.write_chunks.side_effect = write_chunks
+        assert stream_json(pod_id="pod_a", date=date, production_data=replacement_data(date), pool=pool)
+
+    assert cycle_metrics.stage_bytes["upload"] > 0
+    assert cycle_metrics.pods["pod_a"]["upload"]["bytes"] == cycle_metrics.stage_bytes["upload"]
+
+
+def test_stream_json_invalid_data_never_connects(ftp_configs):
+    index = pd.DatetimeIndex([pd.Timestamp("2024-03-03 00:00", tz="UTC")], name=startDate)
+    df = pd.DataFrame(data={quantity: [float("nan")], status: ["w"]}, index=index)
+
+    with patch('lib.sftp_conn.FtpPool.session') as mock_session, pytest.raises(ValueError):
+        stream_json(pod_id="pod_a", date=pd.Timestamp("2024-03-03 00:00", tz=TIMEZONE), production_data=df,
+                    pool=FtpPool())
+    mock_session.assert_not_called()
+
+
+def test_hub_file_times():
+    times = hub_file_times(["20240601 101500-hub.csv", "min20240601.csv", "notes.txt", "20240601 101500-min.csv"])
+
+    assert times[0] == pd.Timestamp("2024-06-01 10:15:00")
+    assert times[1:].isna().all()
+
+
+def test_select_pod_files_hub():
+    date = pd.Timestamp("2024-06-01 12:00", tz=TIMEZONE)
+    names = ["20240531 215900-hub.csv", "20240531 220000-hub.csv", "20240601 100500-hub.csv",
+             "20240601 100600-hub.csv", "notes.txt", "min20240601.csv"]
+    files_attrs = [MagicMock(filename=s) for s in names]
+
+    source, files = select_pod_files(pod_id="project", files_attrs=files_attrs, date=date)
+
+    assert source == SourceType.hub
+    assert [s.filename for s in files] == ["20240531 220000-hub.csv", "20240601 100500-hub.csv"]
+
+
+def test_cycle_result_default_skipped_is_not_shared():
+    first, second = CycleResult(uploaded=[], failed=[]), CycleResult(uploaded=[], failed=[])
+
+    assert first.skipped == () and second.skipped == ()
+    with pytest.raises(AttributeError):
+        first.skipped.append("pod_a")
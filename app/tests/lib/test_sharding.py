@@ -0,0 +1,90 @@
+import os
+from collections import Counter
+from unittest.mock import patch, MagicMock
+
+import pytest
+
+from lib.config import ShardingConfig
+from lib.sharding import HashRing, Lease, Shard, live_workers, local_shard
+from lib.sftp_conn import list_pod_ids
+
+POD_IDS = [f"EU-POD-{i:04d}" for i in range(600)]
+
+
+@pytest.fixture
+def root(tmp_path):
+    return str(tmp_path / "leases")
+
+
+def test_hash_ring_is_stable_and_balanced():
+    ring = HashRing(["worker_1", "worker_2", "worker_3"])
+    owners = {pod_id: ring.owner(pod_id) for pod_id in POD_IDS}
+
+    assert owners == {pod_id: HashRing(["worker_3", "worker_1", "worker_2"]).owner(pod_id) for pod_id in POD_IDS}
+    assert all(120 < n < 280 for n in Counter(owners.values()).values())
+
+
+def test_hash_ring_moves_only_pods_of_removed_worker():
+    before = HashRing(["worker_1", "worker_2", "worker_3"])
+    after = HashRing(["worker_1", "worker_3"])
+
+    moved = [s for s in POD_IDS if before.owner(s) != after.owner(s)]
+
+    assert moved
+    assert all(before.owner(s) == "worker_2" for s in moved)
+    assert HashRing([]).owner("pod") is None
+
+
+def test_live_workers_ignore_expired_and_broken_leases(root):
+    Lease("worker_1", root=root).renew(now=1000)
+    Lease("worker_2", root=root).renew(now=900)
+    with open(os.path.join(root, "worker_3.lease"), 'w') as f:
+        f.write("{")
+
+    assert live_workers(60, root=root, now=1030) == ["worker_1"]
+    assert live_workers(200, root=root, now=1030) == ["worker_1", "worker_2"]
+    assert live_workers(60, root=os.path.join(root, "missing")) == []
+
+
+def test_surviving_worker_takes_over(root):
+    config = ShardingConfig(lease_ttl=60)
+    shard_1 = Shard("worker_1", config=config, root=root)
+    shard_2 = Shard("worker_2", config=config, root=root)
+    shard_1.lease.renew(now=1000)
+    shard_2.lease.renew(now=1000)
+
+    part_1 = shard_1.select(POD_IDS, now=1030)
+    part_2 = shard_2.select(POD_IDS, now=1030)
+
+    assert sorted(part_1 + part_2) == sorted(POD_IDS)
+    assert not set(part_1) & set(part_2)
+    shard_1.lease.renew(now=1060)
+    assert shard_1.select(POD_IDS, now=1090) == POD_IDS  # lease of worker_2 expired
+
+
+def test_shard_start_and_stop(root):
+    shard = Shard("worker_1", config=ShardingConfig(lease_ttl=60), root=root)
+
+    shard.start()
+    assert live_workers(60, root=root) == ["worker_1"]
+    shard.stop()
+
+    assert live_workers(60, root=root) == []
+    assert not shard._heartbeat.is_alive()
+
+
+def test_local_shard_without_worker_id():
+    with patch.dict(os.environ, {}, clear=True):
+        assert local_shard() is None
+
+
+def test_list_pod_ids_sharded():
+    shard = MagicMock()
+    shard.select.return_value = ["pod_123"]
+    listing = MagicMock(dirs=["pod_123", "pod_456"])
+    listing.pod_ids.return_value = ["pod_123", "pod_456"]
+
+    with patch("lib.sftp_conn.root_listing", return_value=listing), patch("lib.sftp_conn.load_ftp_configs"), \
+            patch("lib.sharding.local_shard", return_value=shard):
+        assert list_pod_ids(MagicMock()) == ["pod_123"]
+        assert list_pod_ids(MagicMock(), sharded=False) == ["pod_123", "pod_456"]
@@ -0,0 +1,86 @@
+import os
+from unittest.mock import patch
+
+import pandas as pd
+import pytest
+
+from benchmarks.synthetic import huawei_accumulated_csv
+from lib import TIMEZONE, TEST_DATA, np_engine
+from lib.config import AppConfig
+from lib.csv_reader import HuaweiCsvState
+from lib.slot_reducer import DaySlotReducer, datalogger_production, csv_state_production
+from lib.sftp_conn import process_datalogger_csv
+
+
+@pytest.mark.parametrize("csv_file", ['huawei_datalogger_csv_parser_valid.csv',
+                                      'huawei_datalogger_csv_parser_invalid.csv',
+                                      'huawei_datalogger_csv_parser_empty.csv'])
+@pytest.mark.parametrize("until", ["12:20", "23:55"])
+def test_datalogger_production_test_data(csv_file, until):
+    with open(os.path.join(TEST_DATA, csv_file), 'rb') as f:
+        data = f.read()
+    date = pd.Timestamp(f"2025-03-03 {until}", tz=TIMEZONE)
+
+    expected = np_engine.datalogger_production(data.decode("utf-8"), date).to_json_str()
+    assert datalogger_production(data, date).to_json_str() == expected
+
+
+@pytest.mark.parametrize("day", ["2024-06-01", "2024-03-31", "2024-10-27"])
+@pytest.mark.parametrize("inverters", [1, 17])
+@pytest.mark.parametrize("until", ["00:00", "12:35", "23:55"])
+def test_datalogger_production_synthetic(day, inverters, until):
+    date = pd.Timestamp(f"{day} {until}").tz_localize(TIMEZONE, nonexistent="shift_forward", ambiguous=False)
+    text = huawei_accumulated_csv(day, inverters=inverters, until=date, sunrise=0, sunset=24, seed=inverters)
+
+    expected = np_engine.datalogger_production(text, date)
+    production = datalogger_production(text.encode("utf-8"), date)
+
+    assert production.to_json_str() == expected.to_json_str()
+    assert production.valid.sum() == expected.valid.sum()
+
+
+@pytest.mark.parametrize("text", ["", "\n", "no header\n1;2\n", "#Time;Other\n2024-06-01 10:00:00;1\n"])
+def test_datalogger_production_without_rows(text):
+    date = pd.Timestamp("2024-06-01 12:35", tz=TIMEZONE)
+
+    expected = np_engine.datalogger_production(text, date).to_json_str()
+    assert datalogger_production(text.encode("utf-8"), date).to_json_str() == expected
+
+
+def test_mixed_time_formats_raise():
+    reducer = DaySlotReducer(pd.Timestamp("2024-06-01 12:35", tz=TIMEZONE))
+
+    with pytest.raises(ValueError):
+        reducer.feed_lines(["#Time;E-Day\n", "2024-06-01 10:00:00;1\n", "24-06-01 10:05:00;2\n"])
+
+
+def test_off_grid_timestamp_kept_aside():
+    date = pd.Timestamp("2024-06-01 10:10", tz=TIMEZONE)
+    text = "#Time;E-Day\n2024-06-01 10:00:00;1\n2024-06-01 10:02:30;1.5\n2024-06-01 10:05:00;2\n"
+    reducer = DaySlotReducer(date)
+    reducer.feed_lines(text.splitlines(keepends=True))
+
+    assert len(reducer.extra) == 1
+    assert reducer.production(date).to_json_str() == np_engine.datalogger_production(text, date).to_json_str()
+
+
+@pytest.mark.parametrize("chunk_size", [1, 100000])
+def test_csv_state_production(chunk_size):
+    date = pd.Timestamp("2024-06-01 12:35", tz=TIMEZONE)
+    raw = huawei_accumulated_csv("2024-06-01", inverters=3, until=date).encode("utf-8")[:-1]  # last line pending
+
+    state = HuaweiCsvState()
+    for i in range(0, len(raw), chunk_size):
+        state.feed(raw[i:i + chunk_size])
+
+    assert csv_state_production(state, date).to_json_str() == np_engine.csv_state_production(state, date).to_json_str()
+
+
+def test_process_datalogger_csv_streaming_engine():
+    date = pd.Timestamp("2024-06-01 12:35", tz=TIMEZONE)
+    text = huawei_accumulated_csv("2024-06-01", inverters=3, until=date)
+
+    with patch("lib.sftp_conn.load_app_config", return_value=AppConfig(huawei_parser_engine="streaming")):
+        production = process_datalogger_csv(text.encode("utf-8"), date)
+
+    assert production.to_json_str() == np_engine.datalogger_production(text, date).to_json_str()
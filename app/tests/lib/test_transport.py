@@ -0,0 +1,36 @@
+from types import SimpleNamespace
+from unittest.mock import MagicMock
+
+import pytest
+from pydantic import ValidationError
+
+from lib.transport import TransportProfile, read_remote
+
+
+def test_apply_sets_channel_defaults():
+    transport = SimpleNamespace(default_window_size=2097152, default_max_packet_size=32768)
+
+    TransportProfile(window_size=16777216).apply(transport)
+
+    assert transport.default_window_size == 16777216
+    assert transport.default_max_packet_size == 32768
+
+
+def test_profile_rejects_unknown_options():
+    with pytest.raises(ValidationError):
+        TransportProfile(compresion=True)
+
+
+@pytest.mark.parametrize("profile, prefetched", [(TransportProfile(prefetch=True, prefetch_requests=8), True),
+                                                 (TransportProfile(), False),
+                                                 (None, False)])
+def test_read_remote_prefetch(profile, prefetched):
+    sftp = SimpleNamespace(transport_profile=profile)
+    file_handle = MagicMock()
+    file_handle.read.return_value = b"data"
+
+    assert read_remote(sftp, file_handle, size=4) == b"data"
+    if prefetched:
+        file_handle.prefetch.assert_called_once_with(file_size=4, max_concurrent_requests=8)
+    else:
+        file_handle.prefetch.assert_not_called()
@@ -0,0 +1,133 @@
+from types import SimpleNamespace
+from unittest.mock import patch, MagicMock
+
+import pandas as pd
+import pytest
+
+from lib import TIMEZONE
+from lib.config import WatcherConfig
+from lib.metrics import MetricsTotals
+from lib.watcher import Watcher
+
+NOW = pd.Timestamp("2024-03-04 10:02:00", tz=TIMEZONE)
+CURRENT = pd.Timestamp("2024-03-04 10:00", tz=TIMEZONE)
+LAST = pd.Timestamp("2024-03-04 09:55", tz=TIMEZONE)
+
+
+def attrs(*files):
+    return [SimpleNamespace(filename=name, st_size=size, st_mtime=mtime) for name, size, mtime in files]
+
+
+@pytest.fixture
+def watcher():
+    watcher = Watcher(config=WatcherConfig(debounce=5, min_upload_interval=60, force_spread=0), pool=MagicMock())
+    watcher.observe("pod_a", attrs(("a.csv", 100, 1000)), t=0)
+    watcher.processed("pod_a", t=0, date=LAST, written=True)
+    return watcher
+
+
+def test_unchanged_pod_not_due(watcher):
+    watcher.observe("pod_a", attrs(("a.csv", 100, 1000)), t=100)
+
+    assert watcher.due_date("pod_a", t=100, now=NOW) is None
+
+
+def test_changed_pod_due_after_debounce(watcher):
+    watcher.observe("pod_a", attrs(("a.csv", 120, 1300)), t=100)
+
+    assert watcher.due_date("pod_a", t=102, now=NOW) is None
+    assert watcher.due_date("pod_a", t=105, now=NOW) == CURRENT
+
+
+def test_changes_pending_longer_than_min_upload_interval_are_due(watcher):
+    for t in range(100, 170, 2):  # file grows every 2 seconds, never quiet for debounce
+        watcher.observe("pod_a", attrs(("a.csv", t, t)), t=t)
+        due = watcher.due_date("pod_a", t=t, now=NOW)
+        if due is not None:
+            break
+
+    assert due == CURRENT
+    assert t == 160
+
+
+def test_rate_limit(watcher):
+    watcher.observe("pod_a", attrs(("a.csv", 120, 1300)), t=10)
+
+    assert watcher.due_date("pod_a", t=30, now=NOW) is None  # uploaded at t=0
+    assert watcher.due_date("pod_a", t=60, now=NOW) == CURRENT
+
+
+def test_failed_upload_stays_pending(watcher):
+    watcher.observe("pod_a", attrs(("a.csv", 120, 1300)), t=100)
+    watcher.processed("pod_a", t=105, date=CURRENT, written=False)
+
+    assert watcher.due_date("pod_a", t=120, now=NOW) is None
+    assert watcher.due_date("pod_a", t=165, now=NOW) == CURRENT
+
+
+def test_unchanged_pod_sent_once_per_interval(watcher):
+    next_interval = NOW + pd.Timedelta(minutes=5)
+
+    assert watcher.due_date("pod_a", t=400, now=next_interval) == CURRENT
+    watcher.processed("pod_a", t=400, date=CURRENT, written=True)
+    assert watcher.due_date("pod_a", t=500, now=next_interval) is None
+
+
+def test_new_pods_spread_over_interval_start():
+    watcher = Watcher(config=WatcherConfig(force_spread=60), pool=MagicMock())
+    pod_ids = [f"pod_{i}" for i in range(20)]
+    for pod_id in pod_ids:
+        watcher.observe(pod_id, attrs(("a.csv", 100, 1000)), t=0)
+
+    offsets = [watcher.spread_offset(pod_id) for pod_id in pod_ids]
+    due_at_start = [pod_id for pod_id in pod_ids if watcher.due_date(pod_id, t=0, now=CURRENT) is not None]
+    due_later = [pod_id for pod_id in pod_ids if watcher.due_date(pod_id, t=0, now=NOW) is not None]
+
+    assert all(0 <= offset < 60 for offset in offsets)
+    assert len(set(offsets)) > 10
+    assert len(due_at_start) < len(pod_ids)
+    assert due_later == pod_ids
+    assert watcher.due_date("pod_0", t=0, now=NOW) == LAST
+
+
+def test_retain_forgets_removed_pods(watcher):
+    watcher.retain(["pod_b"])
+
+    assert watcher.pods == {}
+
+
+@patch("lib.watcher.list_pod_files")
+@patch("lib.watcher.list_pod_ids", return_value=["pod_a", "pod_b"])
+@patch("lib.watcher.SftpConn")
+def test_poll_processes_only_changed_pods(mock_sftp, mock_list_ids, mock_list_files, watcher):
+    watcher.observe("pod_b", attrs(("b.csv", 100, 1000)), t=0)
+    watcher.processed("pod_b", t=0, date=LAST, written=True)
+    mock_list_files.side_effect = lambda sftp: attrs(
+        ("a.csv", 100, 1000)) if sftp.cd.call_args.args[0] == "pod_a" else attrs(("b.csv", 200, 1300))
+
+    with patch("lib.watcher.process_pod", side_effect=[True]) as mock_process:
+        watcher.poll(t=100, now=NOW)
+        assert mock_process.call_count == 0  # pod_b changed, waits for debounce
+        result = watcher.poll(t=110, now=NOW)
+
+    assert result.uploaded == ["pod_b"]
+    mock_process.assert_called_once_with(sftp=mock_sftp.return_value, pool=watcher.pool, pod_id="pod_b",
+                                         date=CURRENT)
+    assert watcher.pods["pod_b"].sent_date == CURRENT
+
+
+@patch("lib.watcher.list_pod_files", return_value=attrs(("a.csv", 100, 1000)))
+@patch("lib.watcher.list_pod_ids", return_value=["pod_a", "pod_b"])
+@patch("lib.watcher.SftpConn")
+def test_poll_reconnects_after_failed_pod(mock_sftp, mock_list_ids, mock_list_files, watcher):
+    next_interval = NOW + pd.Timedelta(minutes=5)
+    totals = MetricsTotals()
+
+    with patch("lib.watcher.process_pod", side_effect=[OSError("Socket is closed"), True]), \
+            patch("lib.metrics.totals", totals):
+        result = watcher.poll(t=400, now=next_interval)
+
+    assert result.uploaded == ["pod_b"]
+    assert result.failed == ["pod_a"]
+    assert mock_sftp.call_count == 2
+    assert totals.events["watch_interval"] == 2
@@ -0,0 +1,74 @@
+import ast
+import subprocess
+import sys
+import textwrap
+
+import pandas as pd
+import pytest
+
+import main
+from lib import APP_PATH, TIMEZONE
+from lib.sftp_conn import CycleResult
+
+HEAVY_MODULES = {"pandas", "numpy", "pydantic", "pysftp", "paramiko", "apscheduler"}
+
+
+def loaded_modules(code: str) -> tuple:
+    """
+    Run code in fresh interpreter (startup time is measured by benchmarks.startup)
+
+    :return: (completed process, set of top level packages and modules in sys.modules after the code)
+    """
+    code = textwrap.dedent(code) + "\nimport sys\nprint(sorted({s.split('.')[0] for s in sys.modules} | set(sys.modules)))"
+    process = subprocess.run([sys.executable, "-c", code], cwd=APP_PATH, capture_output=True, text=True, timeout=60)
+    loaded = set(ast.literal_eval(process.stdout.splitlines()[-1])) if process.returncode == 0 else set()
+    return process, loaded
+
+
+def test_import_main_is_light():
+    process, loaded = loaded_modules("import main")
+
+    assert process.returncode == 0, process.stderr
+    assert not HEAVY_MODULES & loaded
+
+
+def test_once_imports_only_sequential_cycle(tmp_path):
+    process, loaded = loaded_modules(f"""
+        import main
+        from lib import metrics, sftp_conn
+        sftp_conn.SFTP_CONFIG = {str(tmp_path / "missing.json")!r}  # cycle fails without network access
+        metrics.METRICS_JSONL = {str(tmp_path / "metrics.jsonl")!r}
+        metrics.METRICS_PROM = {str(tmp_path / "metrics.prom")!r}
+        print(main.run_once(main.main, date="2024-03-04 10:00"))
+    """)
+
+    assert process.returncode == 0, process.stderr
+    assert process.stdout.splitlines()[0] == str(main.EXIT_CYCLE_FAILED), process.stderr
+    assert not loaded & {"apscheduler", "asyncio", "lib.pipeline", "lib.scheduler", "lib.backfill"}
+
+
+def test_run_once_exit_codes():
+    assert main.run_once(lambda date: CycleResult(uploaded=["pod_a"], failed=[])) == main.EXIT_OK
+    assert main.run_once(lambda date: CycleResult(uploaded=["pod_a"], failed=["pod_b"])) == main.EXIT_PODS_FAILED
+    assert main.run_once(lambda date: CycleResult(uploaded=[], failed=[], skipped=["pod_b"])) == main.EXIT_PODS_FAILED
+
+    def fail(date):
+        raise ValueError("No directories found on sftp")
+
+    assert main.run_once(fail) == main.EXIT_CYCLE_FAILED
+
+
+@pytest.mark.parametrize("value, expected", [
+    ("2024-03-04 10:00", "2024-03-04 10:00"),
+    ("2024-03-04 10:07", "2024-03-04 10:05"),
+])
+def test_run_once_date(value, expected):
+    dates = []
+
+    def job(date):
+        dates.append(date)
+        return CycleResult(uploaded=[], failed=[])
+
+    main.run_once(job, date=value)
+
+    assert dates == [pd.Timestamp(expected, tz=TIMEZONE)]